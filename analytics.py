@@ -0,0 +1,127 @@
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.orm import aliased, joinedload
+from database import upsert
+from autocomplete import note_catalog_changed, note_sales
+from models import db, Product, TransactionHistory, ProductSales, CategorySales, DailySales, UserSales
+
+# Sales analytics.
+# Every purchase adds its units, revenue and order count to running totals per product, category, day and user. The
+# increments are upserts executed inside the purchase transaction, so the totals are always consistent with the
+# transaction history, and the dashboard reads a handful of small rows instead of aggregating the whole history.
+# An order is one purchase, however many lines it has: it counts once for every product, category, day and user it
+# touches. The history rows of one purchase share its user and created_at.
+
+MAX_TOP = 100  # Most products and customers the dashboard lists.
+MAX_DAYS = 365 # Longest daily series the dashboard shows.
+
+AGGREGATES = (
+    (ProductSales, 'product_id'),
+    (CategorySales, 'category'),
+    (DailySales, 'day'),
+    (UserSales, 'user_id'),
+)
+
+def _increment(excluded, table):
+    return {column: table.c[column]+excluded[column] for column in ('units', 'revenue', 'orders')}
+
+def _add(totals, key, amount, total):
+    units, revenue = totals.get(key, (0, 0))
+    totals[key] = (units+amount, revenue+total)
+
+def record_sales(user_id, lines, day=None):
+    # lines: list of (product_id, category, amount, total) of one purchase. Call inside the purchase transaction,
+    # before its commit.
+    day = day or datetime.utcnow().date()
+    totals = {model: {} for model, _ in AGGREGATES}
+    for product_id, category, amount, total in lines:
+        _add(totals[ProductSales], product_id, amount, total)
+        _add(totals[CategorySales], category, amount, total)
+        _add(totals[DailySales], day, amount, total)
+        _add(totals[UserSales], user_id, amount, total)
+
+    for model, key in AGGREGATES:
+        table = model.__table__
+        rows = [{key: value, 'units': units, 'revenue': revenue, 'orders': 1} for value, (units, revenue) in totals[model].items()]
+        upsert(db.session, table, rows, [key], lambda excluded, table=table: _increment(excluded, table))
+    note_sales(db.session, [(product_id, units) for product_id, (units, _) in totals[ProductSales].items()])
+
+def remove_product_sales(product_id):
+    # Takes a product's history out of the category, day and user totals, before that history is deleted. A purchase
+    # only stops counting as an order where the product was its only line for that category, day or user.
+    # The product's own ProductSales row is deleted with the product.
+    category = db.session.scalar(select(Product.category).where(Product.id==product_id))
+    other = aliased(TransactionHistory)
+    same_purchase = (other.user_id==TransactionHistory.user_id) & (other.created_at==TransactionHistory.created_at) & (other.product_id!=product_id)
+    other_lines = select(func.count()).where(same_purchase).scalar_subquery()
+    other_in_category = select(func.count()).select_from(other).join(Product, Product.id==other.product_id).where(same_purchase, Product.category==category).scalar_subquery()
+    purchases = db.session.execute(
+        select(TransactionHistory.user_id, TransactionHistory.created_at, func.sum(TransactionHistory.amount), func.sum(TransactionHistory.total), other_lines, other_in_category)
+        .where(TransactionHistory.product_id==product_id)
+        .group_by(TransactionHistory.user_id, TransactionHistory.created_at)
+    ).all()
+
+    totals = {CategorySales: {}, DailySales: {}, UserSales: {}}
+    for user_id, created_at, units, revenue, lines, lines_in_category in purchases:
+        for model, key, others in ((CategorySales, category, lines_in_category), (DailySales, created_at.date(), lines), (UserSales, user_id, lines)):
+            total = totals[model].setdefault(key, [0, 0, 0])
+            total[0] += units
+            total[1] += revenue
+            total[2] += 0 if others else 1
+
+    connection = db.session.connection()
+    for model, key in AGGREGATES:
+        if not totals.get(model):
+            continue
+        table = model.__table__
+        column = table.c[key]
+        statement = update(table).where(column==bindparam('key_value')).values(units=table.c.units-bindparam('units_value'), revenue=table.c.revenue-bindparam('revenue_value'), orders=table.c.orders-bindparam('orders_value'))
+        connection.execute(statement, [{'key_value': value, 'units_value': units, 'revenue_value': revenue, 'orders_value': orders} for value, (units, revenue, orders) in totals[model].items()])
+        # Nothing left to count, the same as a rebuild would leave it.
+        db.session.execute(delete(model).where(column.in_(list(totals[model])), table.c.units<=0))
+
+def rebuild():
+    # Recomputes every aggregate from the transaction history, for existing databases and after data fixes.
+    for model, _ in AGGREGATES:
+        db.session.execute(delete(model))
+
+    day = func.date(TransactionHistory.created_at)
+    sources = (
+        (ProductSales, 'product_id', TransactionHistory.product_id),
+        (CategorySales, 'category', Product.category),
+        (DailySales, 'day', day),
+        (UserSales, 'user_id', TransactionHistory.user_id),
+    )
+    for model, key, column in sources:
+        # Summed per purchase first, so that each purchase counts as one order.
+        purchases = (
+            select(column.label('key'), func.sum(TransactionHistory.amount).label('units'), func.sum(TransactionHistory.total).label('revenue'))
+            .join(Product, Product.id==TransactionHistory.product_id)
+            .group_by(column, TransactionHistory.user_id, TransactionHistory.created_at)
+            .subquery()
+        )
+        query = select(purchases.c.key, func.sum(purchases.c.units), func.sum(purchases.c.revenue), func.count()).group_by(purchases.c.key)
+        rows = [{key: value, 'units': units, 'revenue': revenue, 'orders': orders} for value, units, revenue, orders in db.session.execute(query)]
+        if model is DailySales:
+            rows = [{**row, 'day': datetime.strptime(str(row['day']), '%Y-%m-%d').date()} for row in rows]
+        if rows:
+            db.session.execute(insert(model), rows)
+    note_catalog_changed(db.session) # The suggestion ranking reloads the sales figures.
+    db.session.commit()
+
+def get_dashboard(*, top=10, days=30):
+    # top and days may come straight from the query string, out of range values are clamped.
+    top = min(max(top, 1), MAX_TOP)
+    days = min(max(days, 1), MAX_DAYS)
+    since = datetime.utcnow().date()-timedelta(days=days-1)
+    # Summed over the days, a purchase spanning several categories is still one order there.
+    totals = db.session.execute(select(func.coalesce(func.sum(DailySales.units), 0), func.coalesce(func.sum(DailySales.revenue), 0), func.coalesce(func.sum(DailySales.orders), 0))).one()
+    return {
+        'units': totals[0],
+        'revenue': totals[1],
+        'orders': totals[2],
+        'products': ProductSales.query.options(joinedload(ProductSales.product)).order_by(ProductSales.revenue.desc()).limit(top).all(),
+        'categories': CategorySales.query.order_by(CategorySales.revenue.desc()).all(),
+        'days': DailySales.query.filter(DailySales.day>=since).order_by(DailySales.day).all(),
+        'customers': UserSales.query.options(joinedload(UserSales.user)).order_by(UserSales.revenue.desc()).limit(top).all(),
+    }
@@ -0,0 +1,164 @@
+from flask import Blueprint, jsonify, request
+from flask_login import current_user
+from sqlalchemy import select
+from werkzeug.exceptions import HTTPException
+from models import db, User, Product
+from pagination import paginate_products, PRODUCT_SORTS
+from repository import get_carts
+from querycount import query_budget
+from checkout import purchase_cart, purchase_item, CheckoutError, EmptyCart, InsufficientBalance, InvalidQuantity, OutOfStock, ProductNotFound
+
+# Versioned JSON API for the catalog, the cart and checkout.
+# Built on the same query layer, cart store and checkout engine as the HTML views, so both stay consistent. Clients
+# authenticate with the normal session cookie. POST and PATCH requests must be sent as application/json, which a
+# plain cross-site form can't do, so the session cookie alone is not enough to change a cart or check out. Errors are
+# returned as {"error": "..."} with a matching status code.
+# Cart changes are batched: one PATCH sets the quantities of any number of products.
+
+MAX_BATCH = 100 # Products per batched lookup or cart update.
+
+def create_api(*, cart_store, user_cache, page_cache, search_cache, assets):
+    api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+    def product_json(product):
+        return {
+            'id': product.id,
+            'name': product.name,
+            'desc': product.desc,
+            'price': product.price,
+            'stock': product.stock,
+            'available': product.available,
+            'category': product.category,
+            'image': assets.product_image_url(product.image),
+            'srcset': assets.product_image_srcset(product.image),
+        }
+
+    def cart_json(user_id):
+        lines = get_carts(user_id)
+        return {
+            'items': [{'id': line.id, 'product': product_json(line.product), 'quantity': line.amount, 'subtotal': line.amount*line.product.price} for line in lines],
+            'total': sum(line.amount*line.product.price for line in lines),
+        }
+
+    def error(message, status, **extra):
+        return jsonify({'error': message, **extra}), status
+
+    def json_body():
+        if not request.is_json:
+            return None
+        return request.get_json(silent=True)
+
+    @api.before_request
+    def require_login():
+        # Catalog reads are public, everything else needs a logged in user (401 instead of a redirect to the login page).
+        if request.endpoint not in ('api.list_products', 'api.get_product', 'api.search') and not current_user.is_authenticated:
+            return error('Login required.', 401)
+        if request.method in ('POST', 'PUT', 'PATCH') and not request.is_json:
+            return error('Expected a JSON body.', 415)
+
+    @api.errorhandler(HTTPException)
+    def http_error(e):
+        return error(e.description, e.code)
+
+    @api.route('/products')
+    def list_products():
+        # ?ids=1,2,3 fetches a batch of products in one query, otherwise a keyset paginated page of the catalog.
+        if request.args.get('ids'):
+            try:
+                ids = [int(value) for value in request.args['ids'].split(',')][:MAX_BATCH]
+            except ValueError:
+                return error('ids must be a comma separated list of numbers.', 400)
+            products = db.session.scalars(select(Product).where(Product.id.in_(ids), Product.archived==False)).all()
+            return {'items': [product_json(product) for product in products]}
+
+        sort = request.args.get('sort', 'newest')
+        if sort not in PRODUCT_SORTS:
+            return error(f'sort must be one of {", ".join(PRODUCT_SORTS)}.', 400)
+        per_page = min(max(request.args.get('per_page', 12, type=int), 1), MAX_BATCH)
+        page = paginate_products(category=request.args.get('category', ''), sort=sort, after=request.args.get('after'), per_page=per_page)
+        return {'items': [product_json(product) for product in page.items], 'next_cursor': page.next_cursor}
+
+    @api.route('/products/<int:product_id>')
+    def get_product(product_id):
+        product = db.session.get(Product, product_id)
+        if product is None or product.archived:
+            return error('Product not found.', 404)
+        return product_json(product)
+
+    @api.route('/products/search')
+    def search():
+        per_page = min(max(request.args.get('per_page', 12, type=int), 1), MAX_BATCH)
+        results = search_cache.search(request.args.get('q', ''), page=request.args.get('page', 1, type=int), per_page=per_page)
+        return {'items': [product_json(product) for product in results.items], 'total': results.total, 'page': results.page, 'pages': results.pages}
+
+    @api.route('/cart')
+    @query_budget(2)
+    def get_cart():
+        cart_store.flush(current_user.id)
+        return cart_json(current_user.id)
+
+    @api.route('/cart', methods=['PATCH'])
+    def update_cart():
+        # {"items": {"<product id>": quantity, ...}}, a quantity of 0 removes the product from the cart.
+        body = json_body()
+        items = body.get('items') if isinstance(body, dict) else None
+        if not isinstance(items, dict) or not items or len(items)>MAX_BATCH:
+            return error(f'Expected {{"items": {{product id: quantity}}}} with 1 to {MAX_BATCH} products.', 400)
+        try:
+            quantities = {int(product_id): int(quantity) for product_id, quantity in items.items()}
+        except (TypeError, ValueError):
+            return error('Product ids and quantities must be whole numbers.', 400)
+        added = [product_id for product_id, quantity in quantities.items() if quantity>0]
+        found = set(db.session.scalars(select(Product.id).where(Product.id.in_(added), Product.archived==False))) if added else set()
+        missing = sorted(set(added)-found)
+        if missing:
+            return error('Products not found.', 404, product_ids=missing)
+        try:
+            cart_store.set_quantities(current_user.id, quantities)
+        except OutOfStock as e:
+            return error(str(e), 409, product=e.name, available=e.available)
+        except ProductNotFound as e:
+            return error(str(e), 404)
+        cart_store.flush(current_user.id)
+        return cart_json(current_user.id)
+
+    @api.route('/cart/items/<int:product_id>', methods=['DELETE'])
+    def remove_cart_item(product_id):
+        cart_store.set_quantity(current_user.id, product_id, 0)
+        cart_store.flush(current_user.id)
+        return cart_json(current_user.id)
+
+    @api.route('/checkout', methods=['POST'])
+    @query_budget(12) # The HTML checkout's 11 plus reading back the balance.
+    def checkout():
+        # Buys the whole cart, or with {"product_id": 7, "quantity": 2} a single product directly.
+        body = json_body() or {}
+        if not isinstance(body, dict):
+            return error('Expected a JSON object.', 400)
+        product_id = body.get('product_id')
+        if product_id is not None:
+            try:
+                product_id, quantity = int(product_id), int(body.get('quantity', 1))
+            except (TypeError, ValueError):
+                return error('product_id and quantity must be whole numbers.', 400)
+        cart_store.flush(current_user.id)
+        try:
+            if product_id is not None:
+                _, total = purchase_item(current_user.id, product_id, quantity)
+            else:
+                total = purchase_cart(current_user.id)
+        except (EmptyCart, InvalidQuantity) as e:
+            return error(str(e) or 'Your cart is empty.', 400)
+        except ProductNotFound as e:
+            return error(str(e), 404)
+        except InsufficientBalance as e:
+            return error(str(e), 402, shortfall=e.shortfall)
+        except OutOfStock as e:
+            return error(str(e), 409, product=e.name, available=e.available)
+        except CheckoutError as e:
+            return error(str(e), 400)
+        user_cache.invalidate(current_user.id)
+        page_cache.bump() # Stock changed.
+        return {'total': total, 'balance': db.session.scalar(select(User.balance).where(User.id==current_user.id))}
+
+    return api
@@ -1,83 +1,142 @@
 import os
-from datetime import timedelta
-from PIL import Image
-from flask import Flask, render_template, redirect, flash, request, session
+import click
+from datetime import date, datetime, time, timedelta
+from flask import Flask, render_template, redirect, flash, request, session, url_for, abort, Response, stream_with_context
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager, login_required, current_user, login_user, logout_user
-from models import db, User, Product, Cart, TransactionHistory
-from forms import RegistrationForm, LoginForm, AdminRoleSetupForm, ProductsForm, ProfileForm
+from models import db, User, Product
+from forms import RegistrationForm, LoginForm, AdminRoleSetupForm, ProductsForm, ProductImportForm, ProfileForm, CATEGORIES
+from search import SearchCache
+from autocomplete import SuggestionIndex
+from pagination import paginate_products, PRODUCT_SORTS
+from repository import get_carts, get_recent_transactions, paginate_transactions
+from exports import transaction_rows, product_rows, EXPORT_FORMATS, PRODUCT_FIELDS, TRANSACTION_FIELDS
+from catalog import open_upload, import_products, bulk_update, delete_product, restore_product, CatalogError
+from analytics import get_dashboard, rebuild as rebuild_analytics
+from querycount import query_budget
+from metrics import Metrics
+from assets import Assets
+from api import create_api
+from images import ImagePipeline, ImageSweeper
+from hashing import PasswordHasher, LoginThrottle, HashingBusy
+from usercache import UserCache
+from carts import CartStore
+from inventory import Inventory
+from caching import PageCache
+from checkout import purchase_cart, purchase_item, CheckoutError, EmptyCart, InsufficientBalance, OutOfStock
+from database import configure_database, read_only
 from flask_migrate import Migrate
+from sqlalchemy import func, select
 
 # APP CONFIGURATION
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///ecommerce.sqlite'   # SQLite database file
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///ecommerce.sqlite')   # SQLite database file unless DATABASE_URL is set
+app.config['SQLALCHEMY_REPLICA_URI'] = os.environ.get('DATABASE_REPLICA_URL')   # Optional read replica for read-only views
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False               # Disable modification tracking
 app.config["SECRET_KEY"] = "test"                             # Secret key for sessions and CSRF
+app.config['QUERY_BUDGET_ENFORCE'] = False                    # Raise instead of logging when a view exceeds its query budget (enable in tests)
+app.config['PRODUCT_SOFT_DELETE'] = False                     # Archive deleted products, keeping their transaction history
 app.permanent_session_lifetime = timedelta(days=7)
+configure_database(app) # WAL and busy timeout for SQLite, pool sizing for server databases, replica bind.
 db.init_app(app)
 migrate = Migrate(app, db)
+metrics = Metrics(app) # Latency, SQL, template and bcrypt timings at /metrics, X-Profile header profiling when PROFILE_TOKEN is set.
 # Creating necessary instances
 bcrypt = Bcrypt(app)
+password_hasher = PasswordHasher(app, bcrypt)
+login_throttle = LoginThrottle(app)
+user_cache = UserCache(app)
+page_cache = PageCache(app) # Anonymous catalog pages, bumped whenever products or stock change.
+inventory = Inventory(app, page_cache) # Time limited stock holds for cart contents, expired in bulk by a background sweeper.
+cart_store = CartStore(app, inventory)
+search_cache = SearchCache(app, page_cache) # Search result pages shared by all users, keyed by the normalized term and catalog version.
+image_pipeline = ImagePipeline(app)
+suggestions = SuggestionIndex(app) # In-memory prefix and typo tolerant index behind the search box suggestions.
+assets = Assets(app) # Fingerprinted, immutable-cached URLs for static files and product images (product_image_url, product_image_srcset).
+PRODUCT_IMAGES = os.path.join(app.root_path, 'static', 'images', 'products')
+PROFILE_PICTURES = os.path.join(app.root_path, 'static', 'images', 'profile_pictures')
+app.register_blueprint(create_api(cart_store=cart_store, user_cache=user_cache, page_cache=page_cache, search_cache=search_cache, assets=assets)) # JSON API under /api/v1
+image_sweeper = ImageSweeper(app, PRODUCT_IMAGES, lambda filenames: Utility.referenced_pictures(filenames))
 login_manager = LoginManager(app) 
 login_manager.login_view = 'login' # Setting up login route
 login_manager.login_message = 'Please login to view this page.'
 login_manager.login_message_category = 'danger'
 
-# Used to load user in the session.
+# Used to load user in the session, served from a short lived cache of user snapshots.
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(user_id)
+    return user_cache.load(user_id)
 
 class Utility():
     @staticmethod
     def hash_password(pw):
-        return bcrypt.generate_password_hash(pw).decode('utf-8')
+        return password_hasher.hash(pw)
     
     @staticmethod
     def check_password(hashed_pw, pw):
-        return bcrypt.check_password_hash(hashed_pw, pw)
+        return password_hasher.check(hashed_pw, pw)
     
     def save_picture(picture, *, product_id=None, user_id=None):
-        ext = os.path.splitext(picture.filename)[-1]
-        img = Image.open(picture)
-        img.thumbnail((200,200))
+        # The upload is resized in the background, until it's done the product keeps its current image.
         if product_id:
-            path = os.path.join(app.root_path, 'static/images/products', f'{str(product_id)+ext}')
-            img.save(path)
-            return f'{str(product_id)+ext}'         
+            image_pipeline.submit(picture, PRODUCT_IMAGES, key=('product', product_id), on_done=lambda filename: Utility.set_product_image(product_id, filename))
         elif user_id:
-            path = os.path.join(app.root_path, 'static/images/profile_pictures', f'{str(user_id)+ext}')
-            img.save(path)
-            return f'{str(user_id)+ext}'
-        else:
+            image_pipeline.submit(picture, PROFILE_PICTURES, key=('user', user_id))
+
+    def set_product_image(product_id, filename):
+        product = Product.query.get(product_id)
+        if not product: # The product was deleted while its image was being processed.
+            Utility.release_picture(filename)
             return
+        oldFilename = product.image
+        product.image = filename
+        db.session.commit()
+        page_cache.bump()
+        if oldFilename!=filename:
+            Utility.release_picture(oldFilename)
+
+    def release_picture(filename):
+        # Images are named after their content, so the sweeper only removes the files once no product uses them anymore.
+        image_sweeper.schedule(filename)
+
+    def referenced_pictures(filenames):
+        return {'default.png'} | set(db.session.scalars(select(Product.image).where(Product.image.in_(filenames))))
+
+# The password hashing pool is saturated, asking the user to retry instead of queueing more bcrypt work.
+@app.errorhandler(HashingBusy)
+def hashing_busy(error):
+    flash('The server is busy, please try again in a moment.', 'warning')
+    return redirect(request.path)
 
 # Home Route
 
 @app.route("/")
+@page_cache.cached
+@read_only
 def home():
-    products = Product.query.all()
-    return render_template('index.html', products=products)
+    category = request.args.get('category', '')
+    sort = request.args.get('sort', 'newest')
+    page = paginate_products(category=category, sort=sort, after=request.args.get('after'))
+    return render_template('index.html', products=page.items, page=page, category=category, sort=sort, categories=CATEGORIES, sorts=PRODUCT_SORTS)
 
-# SEARCH PRODUCTS BY NAME
+# SEARCH PRODUCTS BY NAME, DESCRIPTION OR CATEGORY
 @app.route('/search/product', methods=['GET', 'POST'])
+@page_cache.cached
+@read_only
 def search_product():
-    ids = session.get('searched_products_id')
-    products=[]
-    if ids:
-        for id in ids:
-            products.append(Product.query.get(id))
-        session.pop('searched_products_id')
-    print(products, ids)
-    print(ids)
-
     if request.method=='POST':
-        name = request.form['search']
-        products = Product.query.all()
-        requiredProductsID = [product.id for product in products if name in product.name.lower()]
-        session['searched_products_id'] = requiredProductsID
-        return redirect('/search/product')
-    return render_template('searchproduct.html', products=products)
+        return redirect(url_for('search_product', q=request.form['search']))
+
+    term = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+    results = search_cache.search(term, page=page) # Ranked page from the full-text index, popular searches straight from memory.
+    correction = suggestions.correct(term) if not results.total else None # "Did you mean ..." for misspelt searches.
+    return render_template('searchproduct.html', products=results.items, results=results, term=term, correction=correction)
+
+# Search box suggestions as JSON, ranked by sales.
+@app.route('/search/suggest')
+def suggest():
+    return suggestions.suggest(request.args.get('q', ''), limit=min(max(request.args.get('limit', 8, type=int), 1), 20))
 
 # BASIC USER AUTHENTICATION LOGICS
 
@@ -102,13 +161,24 @@ def login():
         return redirect('/')
     
     if form.validate_on_submit():
+        # Throttled clients are turned away before any bcrypt work is done.
+        if not login_throttle.allow(request.remote_addr, form.username.data):
+            flash("Too many login attempts, please try again in a few minutes.", "danger")
+            return redirect('/login')
+
         user = User.query.filter_by(username=form.username.data).first()
         if Utility.check_password(user.password, form.pw.data):
+            login_throttle.succeeded(user.username)
+            # Upgrading the hash to the current cost factor while we have the plain password.
+            if password_hasher.needs_rehash(user.password):
+                user.password = Utility.hash_password(form.pw.data)
+                db.session.commit()
             login_user(user)
             session.permanent = True
             flash("Successfully logged in.", "success")
             return redirect('/')
         else:
+            login_throttle.failed(user.username)
             flash("Invalid Password.", "danger")
             return redirect('/login')
     return render_template('login.html', form=form)
@@ -120,7 +190,12 @@ def reset_password():
         new_pw = request.form['npw']
         confirm_new_pw = request.form['cnpw']
         
+        if not login_throttle.allow(request.remote_addr, current_user.username):
+            flash('Too many attempts, please try again in a few minutes.', 'danger')
+            return redirect('/profile')
+
         if not Utility.check_password(current_user.password, old_pw):
+            login_throttle.failed(current_user.username)
             flash('Incorrect password, please try again.', 'danger')
             return redirect('/profile')
         
@@ -131,6 +206,7 @@ def reset_password():
         hashed_pw = Utility.hash_password(new_pw)
         current_user.password = hashed_pw
         db.session.commit()
+        user_cache.invalidate(current_user.id)
         logout_user()
         flash('Password changed successfully, please login.', 'success')
         return redirect('/login')
@@ -146,8 +222,8 @@ def logout():
 
 # ADMIN PANEL
 
-@login_required
 @app.route('/admin', methods=["GET", "POST"])
+@login_required
 def admin_panel():
     if current_user.role!='admin':
         flash("You are not an admin", "danger")
@@ -157,12 +233,30 @@ def admin_panel():
     userData = None
     if form.validate_on_submit():
         userData = User.query.filter_by(username=form.search.data).first()
-        if userData:
-            return render_template('dashboard.html', form=form, userData=userData, users=User.query.all(), products=Product.query.all())
-        else:
+        if not userData:
             flash("User not found in the database.", 'danger')
             return redirect('/admin')
-    return render_template('dashboard.html', form=form, userData=userData, users=User.query.all(), products=Product.query.all())
+    # Counts and sales figures come from COUNT queries and the precomputed aggregates, not from loading every row.
+    userCount = db.session.scalar(select(func.count(User.id)))
+    productCount = db.session.scalar(select(func.count(Product.id)))
+    return render_template('dashboard.html', form=form, userData=userData, userCount=userCount, productCount=productCount, sales=get_dashboard())
+
+# Sales figures for the admin dashboard as JSON, read only from the aggregate tables.
+@app.route('/admin/analytics')
+@login_required
+def admin_analytics():
+    if current_user.role!='admin':
+        abort(403)
+    sales = get_dashboard(top=request.args.get('top', 10, type=int), days=request.args.get('days', 30, type=int))
+    return {
+        'units': sales['units'],
+        'revenue': sales['revenue'],
+        'orders': sales['orders'],
+        'products': [{'product_id': row.product_id, 'name': row.product.name if row.product else None, 'units': row.units, 'revenue': row.revenue, 'orders': row.orders} for row in sales['products']],
+        'categories': [{'category': row.category, 'units': row.units, 'revenue': row.revenue, 'orders': row.orders} for row in sales['categories']],
+        'days': [{'day': row.day.isoformat(), 'units': row.units, 'revenue': row.revenue, 'orders': row.orders} for row in sales['days']],
+        'customers': [{'user_id': row.user_id, 'username': row.user.username if row.user else None, 'units': row.units, 'revenue': row.revenue, 'orders': row.orders} for row in sales['customers']],
+    }
 
 # Change User's role
 @app.route('/admin/set/role/<string:role>/<string:username>')
@@ -175,6 +269,7 @@ def set_role(role, username):
     user= User.query.filter_by(username=username).first()
     user.role = role
     db.session.commit()
+    user_cache.invalidate(user.id)
     flash(f"Succesfully set {username}'s role to {role.capitalize()}.", 'success')
     return redirect('/admin')
 
@@ -184,6 +279,7 @@ def set_balance(user_id):
     user = User.query.get(user_id)
     user.balance = request.form['balance']
     db.session.commit()
+    user_cache.invalidate(user.id)
     flash(f"Succesfully set {user.username}'s balance to ${user.balance}.", 'success')
     return redirect('/admin')
 
@@ -192,19 +288,72 @@ def set_balance(user_id):
 @app.route('/admin/products', methods=["GET", "POST"])
 def manage_products():
     form = ProductsForm()
-    products = Product.query.all()
 
     if form.validate_on_submit():
         product = Product(name=form.name.data, desc=form.desc.data, price=form.price.data, stock=form.stock.data, category=form.category.data)
         db.session.add(product)
-        if form.img.data:
-            db.session.flush() # Writes the changes to the database temporarily but does not commit them. If not flushed, product.id would be None as the id gets assinged only when it gets committed.
-            filename = Utility.save_picture(form.img.data, product_id=product.id) # Retreiving the filename to save in the db.
-            product.image = filename
         db.session.commit()
+        page_cache.bump()
+        if form.img.data:
+            Utility.save_picture(form.img.data, product_id=product.id) # Submitted after the commit so the background job can find the product.
         flash(f'New Product: {form.name.data} added successfully.', 'success')
         return redirect('/admin/products')
-    return render_template('products_dash.html', form=form, products=products)
+
+    category = request.args.get('category', '')
+    sort = request.args.get('sort', 'newest')
+    page = paginate_products(category=category, sort=sort, after=request.args.get('after'), include_archived=True)
+    return render_template('products_dash.html', form=form, import_form=ProductImportForm(), products=page.items, page=page, category=category, sort=sort, categories=CATEGORIES, sorts=PRODUCT_SORTS)
+
+# Bulk catalog import from a CSV or JSON lines upload.
+@app.route('/admin/products/import', methods=["POST"])
+@login_required
+def import_catalog():
+    if current_user.role!='admin':
+        abort(403)
+    form = ProductImportForm()
+    if not form.validate_on_submit():
+        for errors in form.errors.values():
+            for error in errors:
+                flash(error, 'danger')
+        return redirect('/admin/products')
+    fmt = os.path.splitext(form.file.data.filename)[-1].lower().lstrip('.')
+    report = import_products(open_upload(form.file.data.stream, fmt), replace=form.replace.data)
+    page_cache.bump()
+    flash(f'Imported products: {report.created} added, {report.updated} updated, {report.skipped} skipped.', 'success')
+    for line, error in report.errors[:10]:
+        flash(f'Line {line}: {error}', 'danger')
+    if len(report.errors)>10:
+        flash(f'{len(report.errors)-10} more rows were rejected.', 'danger')
+    return redirect('/admin/products')
+
+@app.route('/admin/products/export.<fmt>')
+@login_required
+def export_catalog(fmt):
+    if current_user.role!='admin':
+        abort(403)
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    serialize, mimetype = EXPORT_FORMATS[fmt]
+    response = Response(stream_with_context(serialize(product_rows(), PRODUCT_FIELDS)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=products.{fmt}'
+    return response
+
+# Bulk price and stock changes as JSON: {"changes": [{"id": 7, "price": 12}, {"name": "Chess", "stock_delta": -2}]}
+@app.route('/admin/products/bulk', methods=["POST"])
+@login_required
+def bulk_update_products():
+    if current_user.role!='admin':
+        abort(403)
+    payload = request.get_json(silent=True)
+    changes = payload.get('changes') if isinstance(payload, dict) else None
+    if not isinstance(changes, list):
+        return {'error': 'Expected a JSON object with a list of changes.'}, 400
+    try:
+        changed = bulk_update(changes)
+    except CatalogError as error:
+        return {'error': str(error)}, 400
+    page_cache.bump()
+    return {'changed': changed}
 
 @app.route('/admin/products/edit/<int:id>', methods=["GET", "POST"])
 def update_products(id):
@@ -213,151 +362,156 @@ def update_products(id):
     form.id = product.id # Creating an attribute called id and assigning to the form i.e instance of ProductsForm. This will help us to distinguish whether the product is being added or updated to avoid name validation issues while updating the products.
 
     if request.method == 'POST' and form.validate_on_submit():
-        if form.img.data:
-            if product.image!='default.png':
-                oldFilePath = os.path.join(app.root_path, 'static', 'images', 'products', product.image)
-                if os.path.exists(oldFilePath):
-                    os.remove(oldFilePath)
-                    filename = Utility.save_picture(form.img.data, product_id=product.id) # Retreiving the filename to save in the db.
-            product.image = filename
-
         product.name=form.name.data
         product.desc=form.desc.data
         product.price=form.price.data
         product.stock=form.stock.data
         product.category=form.category.data
         db.session.commit()
+        page_cache.bump()
+        if form.img.data:
+            Utility.save_picture(form.img.data, product_id=product.id) # The old image is removed once the new one is ready.
         flash(f'Product: {form.name.data} updated successfully.', 'success')
         return redirect('/admin/products')
     return render_template('updateproduct.html', form=form, product=product)
 
 @app.route('/admin/products/delete/<int:id>', methods=["GET", "POST"])
 def delete_products(id):
-    product = Product.query.get(id)
-    for cart in product.carts:
-        db.session.delete(cart)
-    for transaction in product.transactions:
-        db.session.delete(transaction)
-    name = product.name
-    if product.image!='default.png':
-        filepath = os.path.join(app.root_path, 'static', 'images', 'products', product.image)
-        os.remove(filepath)
-    db.session.delete(product)
-    db.session.commit()
+    # A few set-based statements instead of loading and deleting every cart line and transaction of the product.
+    deleted = delete_product(id, archive=app.config['PRODUCT_SOFT_DELETE'])
+    if deleted is None:
+        flash('Product not found.', 'danger')
+        return redirect('/admin/products')
+    name, image = deleted
+    page_cache.bump()
+    if not app.config['PRODUCT_SOFT_DELETE']:
+        Utility.release_picture(image)
     flash(f'Product: {name} deleted successfully.', 'success')
     return redirect('/admin/products')
 
+@app.route('/admin/products/restore/<int:id>', methods=["POST"])
+@login_required
+def restore_products(id):
+    if current_user.role!='admin':
+        abort(403)
+    if restore_product(id):
+        page_cache.bump()
+        flash('Product restored successfully.', 'success')
+    return redirect('/admin/products')
+
 # OUR WEBSITE'S VIRTUAL ECONOMY SYSTEM
 
 @app.route('/cart', methods=['GET', 'POST'])
 @login_required
+@query_budget(4)
 def cart():
+    cart_store.flush(current_user.id) # Pending write-behind edits first, so the page shows them.
     total = 0
-    carts = current_user.carts
-    transactions = current_user.transactions
+    carts = get_carts(current_user.id)
+    transactions = get_recent_transactions(current_user.id) # Only the latest few, the full history is paginated on /transactions.
     for cart in carts:
         total+=cart.amount*cart.product.price
     return render_template('cart.html', carts=carts, total=total, transactions=transactions)
 
 @app.route('/checkout', methods=['GET', 'POST'])
 @login_required
+@query_budget(11)
 def checkout():
-    carts = current_user.carts
-    if not carts:
+    # The whole cart is bought in one transaction, either every line goes through or nothing is charged.
+    cart_store.flush(current_user.id)
+    try:
+        purchase_cart(current_user.id)
+    except EmptyCart:
         flash('Your cart is empty, add some items.', 'warning')
         return redirect('/')
-
-    total = 0
-    for cart in carts:
-        total+=cart.amount*cart.product.price
-
-    # If the user has insufficient balance.
-    if(current_user.balance<total):
-        flash(f'You need ${total-current_user.balance} more to checkout.', 'danger')
+    except InsufficientBalance as e:
+        flash(f'You need ${e.shortfall} more to checkout.', 'danger')
         return redirect('/cart')
-    
-    current_user.balance -= total
-    for cart in carts:
-
-        # Checking if user is trying to buy more than the available stocks.
-        if(cart.product.stock>=cart.amount):
-            # Updating the stocks.
-            cart.product.stock -= cart.amount
-
-            # Creating transaction history.
-            transaction = TransactionHistory(amount=cart.amount, total=cart.product.price*cart.amount, user=current_user, product=cart.product)
-            db.session.add(transaction)
-            db.session.delete(cart)
-        else:
-            flash(f'Only {cart.product.stock} stocks left of {cart.product.name}', 'warning')
-            return redirect('/cart')
-    db.session.commit()
+    except OutOfStock as e:
+        flash(f'Only {e.available} stocks left of {e.name}', 'warning')
+        return redirect('/cart')
+    except CheckoutError as e:
+        flash(str(e), 'danger')
+        return redirect('/cart')
+    user_cache.invalidate(current_user.id)
+    page_cache.bump() # Stock changed.
     flash('Purchase successful, thanks for shopping with us.', 'success')
     return redirect('/cart')
 
 # To add an item in the cart or update the cart.
 @app.route('/product/cart/<int:product_id>', methods=['GET', 'POST'])
+@login_required
 def add_to_cart(product_id):
     product = Product.query.get(product_id)
-    if request.method=='POST':
-        cart = Cart(amount=int(request.form['quantity']), user=current_user, product=product)
-        itemAlreadyCarted = [item for item in current_user.carts if item.product_id==product.id] # Checking if the user has already carted the item which they are trying to cart now.
-
-        # We will just update the quantity of the item if the user had already carted that item before instead of adding it again in the db.
-        if itemAlreadyCarted: 
-            itemAlreadyCarted = itemAlreadyCarted[0]
-            itemAlreadyCarted.amount = int(request.form['quantity'])
-        else:
-            db.session.add(cart)
-        db.session.commit()
-        flash(f'Product: {product.name} added to cart successfully.', 'success')
-
+    if request.method=='POST' and product and not product.archived:
         # isRedirect helps to distinguish if the user is trying to add an item to the cart from home page or trying to update the quantity from cart page itself.
         isRedirect = request.args.get('redirect', 'true')
+        # Upserted on (user, product), so carting an item again just updates its quantity. The stock is held for the cart.
+        try:
+            cart_store.set_quantity(current_user.id, product.id, int(request.form['quantity']))
+            flash(f'Product: {product.name} added to cart successfully.', 'success')
+        except OutOfStock as e:
+            flash(f'Only {e.available} stocks left of {e.name}', 'warning')
+        except CheckoutError as e:
+            flash(str(e), 'danger')
         if isRedirect=='true':
             return redirect('/') # If user is trying to add an item to the card from home page.
         else:
             return redirect('/cart') # If the user is trying to update the quantity from cart page itself.
     return redirect('/')
 
+# To update the quantities of several cart items at once, form fields are named quantity-<product_id>.
+@app.route('/cart/update', methods=['POST'])
+@login_required
+def update_cart():
+    quantities = {}
+    for field, value in request.form.items():
+        if field.startswith('quantity-'):
+            try:
+                quantities[int(field.removeprefix('quantity-'))] = int(value)
+            except ValueError:
+                flash('Please specify appropriate quantities.', 'danger')
+                return redirect('/cart')
+    try:
+        cart_store.set_quantities(current_user.id, quantities)
+    except OutOfStock as e:
+        flash(f'Only {e.available} stocks left of {e.name}', 'warning')
+        return redirect('/cart')
+    except CheckoutError as e:
+        flash(str(e), 'danger')
+        return redirect('/cart')
+    flash('Cart updated successfully.', 'success')
+    return redirect('/cart')
+
 # To buy a particular item directly without adding in the cart.
 @app.route('/product/buy/<int:product_id>', methods=['GET', 'POST'])
+@login_required
+@query_budget(9)
 def buy_item(product_id):
-    product = Product.query.get(product_id)
-    quantity = int(request.form['quantity'])
-    total = product.price*quantity
-
-    # If the user has insufficient balance.
-    if(current_user.balance<total):
-        flash(f'You need ${total-current_user.balance} more to buy this product.', 'danger')
+    try:
+        name, _ = purchase_item(current_user.id, product_id, int(request.form['quantity']))
+    except InsufficientBalance as e:
+        flash(f'You need ${e.shortfall} more to buy this product.', 'danger')
         return redirect('/')
-    
-    # If user is trying to buy more than the available stocks.
-    if(product.stock<quantity):
-        flash(f'Only {product.stock} stocks left of {product.name}', 'warning')
+    except OutOfStock as e:
+        flash(f'Only {e.available} stocks left of {e.name}', 'warning')
         return redirect('/')
-    
-    current_user.balance -= total
-    product.stock -= quantity
-
-    # Creating transaction history.
-    transaction = TransactionHistory(amount=quantity, total=product.price*quantity, user=current_user, product=product)
-    db.session.add(transaction)
-    db.session.commit()
-    flash(f'Product: {product.name} bought successfully.', 'success')
+    except CheckoutError as e:
+        flash(str(e), 'danger')
+        return redirect('/')
+    user_cache.invalidate(current_user.id)
+    page_cache.bump() # Stock changed.
+    flash(f'Product: {name} bought successfully.', 'success')
     return redirect('/')
 
 # To remove an item in the cart.
 @app.route('/product/cart/remove/<int:cart_id>', methods=['GET', 'POST'])
+@login_required
 def remove_from_cart(cart_id):
-    cart = Cart.query.get(cart_id)
-    if cart:
-        product = cart.product.name
-        db.session.delete(cart)
-        db.session.commit()
-        flash(f'Product: {product} added to cart successfully.', 'success')
+    if cart_store.remove(current_user.id, cart_id):
+        flash('Product removed from cart successfully.', 'success')
     else:
-        flash(f'Product: {product} not found.', 'danger')
+        flash('Product not found in your cart.', 'danger')
     return redirect('/cart')
 
 # User Profile
@@ -374,17 +528,99 @@ def edit_profile():
         current_user.username = form.username.data
         current_user.email = form.email.data
         db.session.commit()
+        user_cache.invalidate(current_user.id)
         flash("Profile updated successfully.", "success")
         return redirect('/profile')
     return render_template('editprofile.html', form=form)
 
 # TRANSACTION HISTORY
+
+# Reads the optional ?start=YYYY-MM-DD&end=YYYY-MM-DD range, both days inclusive.
+def get_date_range():
+    try:
+        start = date.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = date.fromisoformat(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        flash('Please specify dates as YYYY-MM-DD.', 'danger')
+        return None, None
+    start = datetime.combine(start, time.min) if start else None
+    end = datetime.combine(end+timedelta(days=1), time.min) if end else None
+    return start, end
+
 @app.route('/transactions')
+@login_required
+@read_only
+@query_budget(1)
 def transactions():
-    transactions = current_user.transactions
-    return render_template('transactionhistory.html', transactions=transactions)
+    start, end = get_date_range()
+    page = paginate_transactions(current_user.id, start=start, end=end, after=request.args.get('after'))
+    return render_template('transactionhistory.html', transactions=page.items, page=page, start=request.args.get('start', ''), end=request.args.get('end', ''))
+
+# Streams the whole (or date filtered) history as CSV or NDJSON without loading it into memory.
+@app.route('/transactions/export.<string:fmt>')
+@login_required
+@read_only
+def export_transactions(fmt):
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    start, end = get_date_range()
+    serialize, mimetype = EXPORT_FORMATS[fmt]
+    rows = transaction_rows(current_user.id, start=start, end=end)
+    response = Response(stream_with_context(serialize(rows, TRANSACTION_FIELDS)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=transactions.{fmt}'
+    return response
+
+# Removes product image files no product references anymore: flask --app app sweep-images
+@app.cli.command('sweep-images')
+@click.option('--min-age', default=3600, show_default=True, help='Skip files younger than this many seconds.')
+def sweep_images_command(min_age):
+    removed = image_sweeper.sweep_orphans(min_age=min_age)
+    click.echo(f'{len(removed)} unused images removed.')
+
+# Releases the stock of expired cart holds now instead of waiting for the sweeper: flask --app app expire-holds
+@app.cli.command('expire-holds')
+def expire_holds_command():
+    click.echo(f'{inventory.expire()} expired holds released.')
+
+# Recomputes the sales aggregates from the transaction history: flask --app app rebuild-analytics
+@app.cli.command('rebuild-analytics')
+def rebuild_analytics_command():
+    rebuild_analytics()
+    click.echo('Sales aggregates rebuilt.')
+
+# Loads a catalog file: flask --app app import-products products.csv
+@app.cli.command('import-products')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl', 'ndjson']), help='Defaults to the file extension.')
+@click.option('--skip-existing', is_flag=True, help='Leave products that already exist unchanged.')
+@click.option('--chunk-size', default=1000, show_default=True)
+def import_products_command(path, fmt, skip_existing, chunk_size):
+    fmt = fmt or os.path.splitext(path)[-1].lower().lstrip('.')
+    with open(path, 'rb') as file:
+        try:
+            report = import_products(open_upload(file, fmt), replace=not skip_existing, chunk_size=chunk_size)
+        except CatalogError as error:
+            raise click.ClickException(str(error))
+    page_cache.bump()
+    click.echo(f'{report.created} added, {report.updated} updated, {report.skipped} skipped, {len(report.errors)} rejected.')
+    for line, error in report.errors:
+        click.echo(f'Line {line}: {error}', err=True)
+
+# Writes the catalog out in a format import-products reads back: flask --app app export-products products.csv
+@app.cli.command('export-products')
+@click.argument('path', type=click.Path(dir_okay=False, writable=True))
+def export_products_command(path):
+    fmt = os.path.splitext(path)[-1].lower().lstrip('.')
+    fmt = 'ndjson' if fmt=='jsonl' else fmt
+    if fmt not in EXPORT_FORMATS:
+        raise click.ClickException(f'Unsupported export format: {fmt}.')
+    serialize, _ = EXPORT_FORMATS[fmt]
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        for chunk in serialize(product_rows(), PRODUCT_FIELDS):
+            file.write(chunk)
 
 if __name__=='__main__':
     with app.app_context():
         db.create_all()
+        suggestions.load()
     app.run(debug=True)
\ No newline at end of file
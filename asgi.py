@@ -0,0 +1,12 @@
+from asgiref.wsgi import WsgiToAsgi
+from app import app, suggestions
+
+# ASGI entry point, e.g. `uvicorn asgi:application --workers 4` (needs `pip install asgiref uvicorn`).
+# Slow clients and long-lived connections are then handled by the server's event loop, and the Flask views keep
+# running unchanged in its thread pool. The WSGI app in app.py stays the entry point for gunicorn and `flask run`.
+
+# The search suggestions are loaded before the worker takes requests, not by the first search.
+with app.app_context():
+    suggestions.load()
+
+application = WsgiToAsgi(app)
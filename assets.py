@@ -0,0 +1,104 @@
+import hashlib
+import mimetypes
+import os
+import threading
+from flask import Response, current_app, request, send_from_directory, url_for
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+from images import FORMATS, PRIMARY_FORMAT, VARIANTS, VARIANT_NAME, variant_filename
+
+# Static asset serving with long-lived caching.
+# Asset URLs are fingerprinted: processed images are already named after their content, every other file gets
+# ?v=<hash of its content>. A fingerprinted URL never changes meaning, so it is served with
+# "Cache-Control: public, max-age=<a year>, immutable" and browsers stop revalidating it. When a file is replaced in
+# place (e.g. a legacy 7.png) its hash and therefore its URL change. Files with a precompressed .br/.gz sibling are
+# sent compressed to clients that accept it. With USE_X_SENDFILE (Apache, lighttpd) or ASSETS_ACCEL_REDIRECT
+# (nginx) the web server sends the file body instead of a Python worker.
+
+PRODUCT_IMAGE_PATH = 'images/products'
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+class Assets():
+    def __init__(self, app=None):
+        self._digests = {} # path -> (mtime, size, digest)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_URL_PATH', '/assets')
+        app.config.setdefault('ASSETS_IMMUTABLE_MAX_AGE', 365*24*3600) # Seconds, for fingerprinted URLs.
+        app.config.setdefault('ASSETS_MAX_AGE', 3600)                  # Seconds, for URLs without a current fingerprint.
+        app.config.setdefault('ASSETS_ACCEL_REDIRECT', None)           # nginx internal location the static folder is mapped to, e.g. '/protected-static/'.
+        app.add_url_rule(app.config['ASSETS_URL_PATH']+'/<path:filename>', 'asset', self.serve)
+        app.add_template_global(self.asset_url)
+        app.add_template_global(self.product_image_url)
+        app.add_template_global(self.product_image_srcset)
+
+    def digest(self, filename):
+        path = safe_join(current_app.static_folder, filename)
+        if path is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._digests.get(filename)
+        if cached and cached[:2]==(stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        sha = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(65536), b''):
+                sha.update(block)
+        digest = sha.hexdigest()[:12]
+        with self._lock:
+            self._digests[filename] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def asset_url(self, filename):
+        if VARIANT_NAME.match(os.path.basename(filename)):
+            return url_for('asset', filename=filename)
+        digest = self.digest(filename)
+        return url_for('asset', filename=filename, v=digest) if digest else url_for('asset', filename=filename)
+
+    def product_image_url(self, image, variant=None, ext=PRIMARY_FORMAT):
+        # Legacy images (e.g. 7.png) only exist in one size, processed ones in every variant and format.
+        match = VARIANT_NAME.match(image)
+        if match and variant:
+            image = variant_filename(match['digest'], variant, ext)
+        return self.asset_url(f'{PRODUCT_IMAGE_PATH}/{image}')
+
+    def product_image_srcset(self, image, ext=PRIMARY_FORMAT):
+        # "<url> 200w, <url> 400w, <url> 800w" for processed images, empty for legacy ones.
+        if not VARIANT_NAME.match(image) or ext not in FORMATS:
+            return ''
+        return ', '.join(f'{self.product_image_url(image, variant, ext)} {width}w' for variant, (width, _) in VARIANTS.items())
+
+    def serve(self, filename):
+        config = current_app.config
+        fingerprinted = bool(VARIANT_NAME.match(os.path.basename(filename))) or (request.args.get('v') is not None and request.args['v']==self.digest(filename))
+        max_age = config['ASSETS_IMMUTABLE_MAX_AGE'] if fingerprinted else config['ASSETS_MAX_AGE']
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        sent, encoding = filename, None
+        for name, suffix in ENCODINGS:
+            if request.accept_encodings[name] and os.path.isfile(safe_join(current_app.static_folder, filename+suffix) or ''):
+                sent, encoding = filename+suffix, name
+                break
+
+        if config['ASSETS_ACCEL_REDIRECT']:
+            if not os.path.isfile(safe_join(current_app.static_folder, sent) or ''):
+                raise NotFound()
+            response = Response(mimetype=mimetype)
+            response.headers['X-Accel-Redirect'] = config['ASSETS_ACCEL_REDIRECT'].rstrip('/')+'/'+sent
+        else:
+            response = send_from_directory(current_app.static_folder, sent, mimetype=mimetype, max_age=max_age, conditional=True)
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        if fingerprinted:
+            response.cache_control.immutable = True
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
@@ -0,0 +1,267 @@
+import heapq
+import re
+import threading
+import time
+from collections import Counter
+from sqlalchemy import event, select
+from sqlalchemy.orm import object_session
+from database import RoutingSession
+from models import db, Product, ProductSales
+
+# In-memory search suggestions.
+# Every word of a product's name and category is indexed under all of its prefixes, so completing "chess bo" is two
+# dictionary lookups and a set intersection. Words that match no prefix are looked up through a trigram index and
+# accepted within a small edit distance, which makes the suggestions tolerant of typos ("chses" finds "chess").
+# Matches are ranked by units sold (ProductSales, kept in step with the transaction history).
+# The index is loaded from the database once and then updated incrementally: ORM writes to products are picked up
+# by mapper events, bulk statements (imports, deletes) and sales note themselves in the session, and the changes are
+# applied when the session commits. Other worker processes' changes arrive with the periodic refresh.
+# The server entry points (asgi.py, python app.py) load it before taking requests. Where the app is imported by a
+# server that gives no such hook (gunicorn app:app, flask run) the first query loads it.
+
+PENDING = 'suggestion_changes' # Session.info key for changes waiting for the commit.
+SCAN_THRESHOLD = 256  # Above this many matches, the best sellers are found by walking the sales ranking instead.
+RERANK_INTERVAL = 1.0 # Seconds the sales ranking may lag behind new sales.
+
+def words(text):
+    return re.findall(r'\w+', text.lower())
+
+def trigrams(word):
+    # Padded at the front only, so misspelt prefixes still share their first trigrams with the word.
+    padded = f'  {word}'
+    return {padded[index:index+3] for index in range(len(padded)-2)}
+
+def edit_distance(a, b, limit):
+    # Levenshtein distance with adjacent transpositions, gives up (returns limit+1) once it can't stay within limit.
+    if abs(len(a)-len(b))>limit:
+        return limit+1
+    previous2, previous = None, list(range(len(b)+1))
+    for i in range(1, len(a)+1):
+        current = [i]+[0]*len(b)
+        for j in range(1, len(b)+1):
+            current[j] = min(previous[j]+1, current[j-1]+1, previous[j-1]+(a[i-1]!=b[j-1]))
+            if i>1 and j>1 and a[i-1]==b[j-2] and a[i-2]==b[j-1]:
+                current[j] = min(current[j], previous2[j-2]+1)
+        if min(current)>limit:
+            return limit+1
+        previous2, previous = previous, current
+    return previous[-1]
+
+def _note(session, change):
+    session.info.setdefault(PENDING, []).append(change)
+
+def note_sales(session, lines):
+    # lines: list of (product_id, units), applied to the ranking once the purchase commits.
+    for product_id, units in lines:
+        _note(session, ('sold', product_id, units))
+
+def note_removed(session, product_id):
+    _note(session, ('removed', product_id))
+
+def note_catalog_changed(session):
+    # For bulk writes that don't say which products changed, the index is reloaded after the commit.
+    _note(session, ('reload',))
+
+class SuggestionIndex():
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._built = 0.0       # time.monotonic() of the last load, 0 when it has to be (re)loaded before use.
+        self._refreshing = False
+        self._reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SUGGEST_LIMIT', 8)
+        app.config.setdefault('SUGGEST_REFRESH_INTERVAL', 300) # Seconds between reloads in the background.
+        self.app = app
+        event.listen(Product, 'after_insert', self._product_written)
+        event.listen(Product, 'after_update', self._product_written)
+        event.listen(Product, 'after_delete', self._product_deleted)
+        event.listen(RoutingSession, 'after_commit', self._after_commit)
+        event.listen(RoutingSession, 'after_soft_rollback', self._after_rollback)
+
+    def _reset(self):
+        self._products = {} # id -> (name, category)
+        self._sales = {}    # id -> units sold
+        self._prefixes = {} # prefix -> ids of the products with a word starting with it
+        self._words = {}    # word -> ids of the products containing it
+        self._trigrams = {} # trigram -> words containing it
+        self._ranking = []  # product ids, best selling first
+        self._ranked = 0.0  # time.monotonic() of the last sort, 0 when it is out of date.
+
+    # Loading and incremental updates
+
+    def load(self):
+        # Reads the catalog and sales into fresh structures and swaps them in, queries keep using the old ones meanwhile.
+        # Uses its own connection, so it never touches the state of the session of the request that triggered it.
+        with db.engine.connect() as connection:
+            products = connection.execute(select(Product.id, Product.name, Product.category).where(Product.archived==False)).all()
+            sales = dict(connection.execute(select(ProductSales.product_id, ProductSales.units)).all())
+        fresh = SuggestionIndex()
+        for product in products:
+            fresh._add(product.id, product.name, product.category)
+        fresh._sales = sales
+        with self._lock:
+            self._products, self._sales, self._prefixes, self._words, self._trigrams = fresh._products, fresh._sales, fresh._prefixes, fresh._words, fresh._trigrams
+            self._ranked = 0.0
+            self._built = time.monotonic()
+
+    def _add(self, product_id, name, category):
+        self._products[product_id] = (name, category)
+        for word in set(words(f'{name} {category}')):
+            if word not in self._words:
+                self._words[word] = set()
+                for gram in trigrams(word):
+                    self._trigrams.setdefault(gram, set()).add(word)
+            self._words[word].add(product_id)
+            for end in range(1, len(word)+1):
+                self._prefixes.setdefault(word[:end], set()).add(product_id)
+
+    def _remove(self, product_id):
+        name, category = self._products.pop(product_id, (None, None))
+        if name is None:
+            return
+        for word in set(words(f'{name} {category}')):
+            for end in range(1, len(word)+1):
+                ids = self._prefixes.get(word[:end])
+                if ids is not None:
+                    ids.discard(product_id)
+                    if not ids:
+                        del self._prefixes[word[:end]]
+            ids = self._words.get(word)
+            if ids is not None:
+                ids.discard(product_id)
+                if not ids:
+                    del self._words[word]
+                    for gram in trigrams(word):
+                        self._trigrams.get(gram, set()).discard(word)
+
+    def _product_written(self, mapper, connection, product):
+        session = object_session(product)
+        if session is not None:
+            _note(session, ('removed', product.id) if product.archived else ('product', product.id, product.name, product.category))
+
+    def _product_deleted(self, mapper, connection, product):
+        session = object_session(product)
+        if session is not None:
+            note_removed(session, product.id)
+
+    def _after_rollback(self, session, previous_transaction):
+        session.info.pop(PENDING, None)
+
+    def _after_commit(self, session):
+        changes = session.info.pop(PENDING, None)
+        if not changes:
+            return
+        with self._lock:
+            for change in changes:
+                if change[0]=='product':
+                    self._remove(change[1])
+                    self._add(*change[1:])
+                elif change[0]=='removed':
+                    self._remove(change[1])
+                    self._sales.pop(change[1], None)
+                elif change[0]=='sold':
+                    self._sales[change[1]] = self._sales.get(change[1], 0)+change[2]
+                elif change[0]=='reload':
+                    self._built = 0.0
+
+    def _ensure_loaded(self):
+        if not self._built:
+            self.load()
+        elif time.monotonic()-self._built>self.app.config['SUGGEST_REFRESH_INTERVAL'] and not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self._refresh, name='suggestion-refresh', daemon=True).start()
+
+    def _refresh(self):
+        try:
+            with self.app.app_context():
+                self.load()
+        except Exception:
+            self.app.logger.exception('Reloading the search suggestions failed.')
+        finally:
+            self._refreshing = False
+
+    # Queries, call with the lock held
+
+    def _fuzzy_words(self, word):
+        # Indexed words within 1 (short words) or 2 edits of the word, or whose prefix of the same length is.
+        if len(word)<3:
+            return []
+        limit = 1 if len(word)<=5 else 2
+        shared = Counter()
+        for gram in trigrams(word):
+            shared.update(self._trigrams.get(gram, ()))
+        matches = []
+        for candidate, _ in shared.most_common(50):
+            distance = min(edit_distance(word, candidate, limit), edit_distance(word, candidate[:len(word)], limit))
+            if distance<=limit:
+                matches.append((distance, -len(self._words[candidate]), candidate))
+        return [candidate for _, _, candidate in sorted(matches)]
+
+    def _rank_key(self, product_id):
+        return (self._sales.get(product_id, 0), -product_id)
+
+    def _best_sellers(self, candidates, limit):
+        if len(candidates)<=SCAN_THRESHOLD:
+            return heapq.nlargest(limit, candidates, key=self._rank_key)
+        # Many matches (short prefixes): walk the products in sales order and stop at the first limit matches. The
+        # order is re-sorted at most every RERANK_INTERVAL seconds, products added since then fall back to the heap.
+        if time.monotonic()-self._ranked>RERANK_INTERVAL:
+            self._ranking = sorted(self._products, key=self._rank_key, reverse=True)
+            self._ranked = time.monotonic()
+        best = []
+        for product_id in self._ranking:
+            if product_id in candidates:
+                best.append(product_id)
+                if len(best)==limit:
+                    return best
+        return heapq.nlargest(limit, candidates, key=self._rank_key)
+
+    def _matches(self, word):
+        ids = self._prefixes.get(word)
+        if ids:
+            return ids, False
+        fuzzy = set()
+        for candidate in self._fuzzy_words(word):
+            fuzzy |= self._words[candidate]
+        return fuzzy, bool(fuzzy)
+
+    # Public API
+
+    def suggest(self, term, limit=None):
+        limit = limit or self.app.config['SUGGEST_LIMIT']
+        tokens = words(term)
+        if not tokens:
+            return {'products': [], 'categories': [], 'corrected': False}
+        self._ensure_loaded()
+        with self._lock:
+            candidates, corrected = None, False
+            for token in tokens:
+                ids, fuzzy = self._matches(token)
+                corrected = corrected or fuzzy
+                candidates = ids if candidates is None else candidates & ids
+                if not candidates:
+                    break
+            ranked = self._best_sellers(candidates, limit) if candidates else []
+            products = [{'id': product_id, 'name': self._products[product_id][0], 'category': self._products[product_id][1], 'sold': self._sales.get(product_id, 0)} for product_id in ranked]
+        categories = sorted({product['category'] for product in products})
+        return {'products': products, 'categories': categories, 'corrected': corrected}
+
+    def correct(self, term):
+        # The term with every unknown word replaced by its closest indexed word, None when there is nothing to correct.
+        tokens = words(term)
+        if not tokens:
+            return None
+        self._ensure_loaded()
+        corrected = []
+        with self._lock:
+            for token in tokens:
+                if token in self._words or token in self._prefixes:
+                    corrected.append(token)
+                    continue
+                matches = [word for word in self._fuzzy_words(token) if edit_distance(token, word, 2)<=2]
+                corrected.append(matches[0] if matches else token)
+        return ' '.join(corrected) if corrected!=tokens else None
@@ -0,0 +1,344 @@
+"""Storefront benchmark.
+
+Seeds a throwaway SQLite database, then drives the main shop routes and reports throughput, p50/p99 latency and
+SQL statements per request. Every scenario runs through Flask's test client (single thread, no network) and
+concurrently against a real WSGI server on a local port.
+
+    python benchmarks/bench.py
+    python benchmarks/bench.py --products 20000 --transactions 200000 --requests 500 --concurrency 16
+    python benchmarks/bench.py --json results.json
+    python benchmarks/bench.py --baseline results.json --tolerance 0.25   # Exits with 1 on a regression.
+
+The seed is fixed, so the same arguments produce the same data and the same request mix.
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORDS = ['classic', 'deluxe', 'mini', 'pro', 'smart', 'vintage', 'organic', 'wireless', 'family', 'travel', 'ultra', 'eco']
+NOUNS = ['chess', 'novel', 'laptop', 'coffee', 'puzzle', 'headphones', 'tea', 'console', 'atlas', 'cookbook', 'tablet', 'honey']
+PASSWORD = 'benchmark'
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the storefront routes.')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--products', type=int, default=5000)
+    parser.add_argument('--transactions', type=int, default=50000)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per scenario and mode.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Client threads against the WSGI server.')
+    parser.add_argument('--mode', choices=['client', 'server', 'both'], default='both')
+    parser.add_argument('--scenario', action='append', help='Only run these scenarios, may be repeated.')
+    parser.add_argument('--database', help='SQLite file to create, a temporary one by default.')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help='Write the results to this file.')
+    parser.add_argument('--baseline', help='Results file of an earlier run to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed slowdown against the baseline, 0.2 is 20%%.')
+    return parser.parse_args()
+
+def create_app(database):
+    # The app reads DATABASE_URL when it is imported.
+    os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+    sys.path.insert(0, ROOT)
+    import app as storefront
+    config = storefront.app.config
+    config['WTF_CSRF_ENABLED'] = False
+    config['BCRYPT_LOG_ROUNDS'] = 4 # Logging in is not what is being measured.
+    config['LOGIN_MAX_ATTEMPTS_PER_IP'] = 10**9
+    config['IMAGE_PIPELINE_SYNC'] = True
+    return storefront
+
+def seed(storefront, args):
+    from sqlalchemy import insert
+    from analytics import rebuild
+    from forms import CATEGORIES
+    from models import db, User, Product, TransactionHistory
+
+    rng = random.Random(args.seed)
+    app = storefront.app
+    with app.app_context():
+        db.create_all()
+        password = storefront.Utility.hash_password(PASSWORD)
+        db.session.execute(insert(User), [{'username': f'user{index}', 'email': f'user{index}@example.com', 'password': password, 'balance': 10**12} for index in range(args.users)])
+        db.session.execute(insert(Product), [{
+            'name': f'{rng.choice(WORDS).title()} {rng.choice(NOUNS).title()} {index}',
+            'desc': ' '.join(rng.choice(WORDS+NOUNS) for _ in range(20)),
+            'price': rng.randint(1, 500),
+            'stock': 10**9,
+            'category': rng.choice(CATEGORIES),
+        } for index in range(args.products)])
+        now = datetime.utcnow()
+        batch = []
+        for _ in range(args.transactions):
+            amount = rng.randint(1, 5)
+            batch.append({'user_id': rng.randint(1, args.users), 'product_id': rng.randint(1, args.products), 'amount': amount, 'total': amount*rng.randint(1, 500), 'created_at': now-timedelta(minutes=rng.randint(0, 60*24*365))})
+            if len(batch)==10000:
+                db.session.execute(insert(TransactionHistory), batch)
+                batch = []
+        if batch:
+            db.session.execute(insert(TransactionHistory), batch)
+        db.session.commit()
+        rebuild()
+
+# Scenarios: prepare(client, rng) does any untimed setup and returns the timed request as (method, path, form data).
+# A purchase that fails still answers with a redirect, only the flashed message tells, so a request whose response
+# flashed one of FAILURE_CATEGORIES counts as failed rather than as served.
+
+FAILURE_CATEGORIES = ('danger', 'warning')
+
+def home(client, rng):
+    return 'GET', '/?'+urllib.parse.urlencode({'category': rng.choice(['', 'Food', 'Devices', 'Games', 'Books'])}), None
+
+def search_product(client, rng):
+    return 'GET', '/search/product?'+urllib.parse.urlencode({'q': f'{rng.choice(WORDS)} {rng.choice(NOUNS)}'}), None
+
+def add_to_cart(client, rng):
+    return 'POST', f'/product/cart/{rng.randint(1, client.products)}', {'quantity': rng.randint(1, 3)}
+
+def checkout(client, rng):
+    for _ in range(3):
+        client.request('POST', f'/product/cart/{rng.randint(1, client.products)}', {'quantity': 1})
+    return 'GET', '/checkout', None
+
+def buy_item(client, rng):
+    return 'POST', f'/product/buy/{rng.randint(1, client.products)}', {'quantity': 1}
+
+def transactions(client, rng):
+    return 'GET', '/transactions', None
+
+SCENARIOS = {
+    'home': home,
+    'search_product': search_product,
+    'add_to_cart': add_to_cart,
+    'checkout': checkout,
+    'buy_item': buy_item,
+    'transactions': transactions,
+}
+
+class QueryCounter():
+    # Counts SQL statements per thread, so requests in the test client (which run in the calling thread) can be attributed.
+
+    def __init__(self):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+        self._local = threading.local()
+        event.listen(Engine, 'after_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0)+1
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+class AppClient():
+    def __init__(self, app, username, products):
+        self.client = app.test_client()
+        self.products = products
+        self.request('POST', '/login', {'username': username, 'pw': PASSWORD})
+
+    def request(self, method, path, data):
+        response = self.client.open(path, method=method, data=data)
+        return response.status_code
+
+    def take_flashes(self):
+        # Categories of the messages flashed since the last call. Redirects aren't followed, so nothing else reads them.
+        with self.client.session_transaction() as session:
+            return [category for category, _ in session.pop('_flashes', [])]
+
+class NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Redirects are part of the response being measured, following them would time a second request.
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+class HTTPClient():
+    def __init__(self, app, base_url, username, products):
+        self.base_url = base_url
+        self.products = products
+        # The session cookie is signed, not encrypted, with the app's serializer the flashed messages can be read from it.
+        self.serializer = app.session_interface.get_signing_serializer(app)
+        self.cookie_name = app.config['SESSION_COOKIE_NAME']
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies), NoRedirect())
+        self.request('POST', '/login', {'username': username, 'pw': PASSWORD})
+
+    def request(self, method, path, data):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(urllib.request.Request(self.base_url+path, data=body, method=method)) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as error:
+            error.read()
+            return error.code
+
+    def take_flashes(self):
+        for cookie in self.cookies:
+            if cookie.name==self.cookie_name:
+                session = self.serializer.loads(cookie.value)
+                flashes = session.pop('_flashes', [])
+                if flashes:
+                    cookie.value = self.serializer.dumps(session)
+                return [category for category, _ in flashes]
+        return []
+
+def failed(client):
+    return any(category in FAILURE_CATEGORIES for category in client.take_flashes())
+
+def percentile(latencies, fraction):
+    ordered = sorted(latencies)
+    return ordered[min(int(len(ordered)*fraction), len(ordered)-1)]
+
+def summarize(scenario, mode, latencies, errors, failures, elapsed, queries=None):
+    # Throughput only counts requests that did what they were meant to, errors (status >= 400) and failures (e.g. a
+    # checkout turned down with a flashed message) are reported on their own.
+    served = len(latencies)-errors-failures
+    return {
+        'scenario': scenario,
+        'mode': mode,
+        'requests': len(latencies),
+        'errors': errors,
+        'failures': failures,
+        'throughput': served/elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 0.5)*1000,
+        'p99_ms': percentile(latencies, 0.99)*1000,
+        'queries': queries,
+    }
+
+def run_client(storefront, args, scenario, counter):
+    rng = random.Random(f'{args.seed}-{scenario}-client')
+    client = AppClient(storefront.app, 'user0', args.products)
+    prepare = SCENARIOS[scenario]
+    latencies, errors, failures, queries = [], 0, 0, 0
+    started = time.perf_counter()
+    for _ in range(args.requests):
+        method, path, data = prepare(client, rng)
+        client.take_flashes() # Left by the login or the setup requests.
+        before = counter.count
+        request_started = time.perf_counter()
+        status = client.request(method, path, data)
+        latencies.append(time.perf_counter()-request_started)
+        queries += counter.count-before
+        errors += status>=400
+        failures += status<400 and failed(client)
+    elapsed = time.perf_counter()-started
+    return summarize(scenario, 'client', latencies, errors, failures, elapsed, queries/args.requests)
+
+def run_server(app, base_url, args, scenario):
+    workers = max(1, min(args.concurrency, args.users))
+    prepare = SCENARIOS[scenario]
+    per_worker = max(1, args.requests//workers)
+    clients = [HTTPClient(app, base_url, f'user{index}', args.products) for index in range(workers)]
+    results = []
+    lock = threading.Lock()
+
+    def work(index):
+        rng = random.Random(f'{args.seed}-{scenario}-server-{index}')
+        latencies, errors, failures = [], 0, 0
+        for _ in range(per_worker):
+            method, path, data = prepare(clients[index], rng)
+            clients[index].take_flashes()
+            request_started = time.perf_counter()
+            status = clients[index].request(method, path, data)
+            latencies.append(time.perf_counter()-request_started)
+            errors += status>=400
+            failures += status<400 and failed(clients[index])
+        with lock:
+            results.append((latencies, errors, failures))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(work, range(workers)))
+    elapsed = time.perf_counter()-started
+    latencies = [latency for worker_latencies, _, _ in results for latency in worker_latencies]
+    return summarize(scenario, 'server', latencies, sum(errors for _, errors, _ in results), sum(failures for _, _, failures in results), elapsed)
+
+def start_server(app):
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name='benchmark-server', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+def report(results):
+    print(f'{"scenario":<16}{"mode":<8}{"requests":>9}{"errors":>8}{"failed":>8}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"queries":>9}')
+    for result in results:
+        queries = f'{result["queries"]:.1f}' if result['queries'] is not None else '-'
+        print(f'{result["scenario"]:<16}{result["mode"]:<8}{result["requests"]:>9}{result["errors"]:>8}{result["failures"]:>8}{result["throughput"]:>10.1f}{result["p50_ms"]:>10.2f}{result["p99_ms"]:>10.2f}{queries:>9}')
+
+def compare(results, baseline, tolerance):
+    # A scenario regresses when its p99 grows, its throughput drops, it runs more queries than the baseline allows or
+    # requests fail that didn't before.
+    previous = {(result['scenario'], result['mode']): result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get((result['scenario'], result['mode']))
+        if before is None:
+            continue
+        name = f'{result["scenario"]} ({result["mode"]})'
+        if result['p99_ms']>before['p99_ms']*(1+tolerance):
+            regressions.append(f'{name}: p99 {before["p99_ms"]:.2f} ms -> {result["p99_ms"]:.2f} ms')
+        if result['throughput']<before['throughput']*(1-tolerance):
+            regressions.append(f'{name}: throughput {before["throughput"]:.1f} -> {result["throughput"]:.1f} req/s')
+        if result['queries'] is not None and before['queries'] is not None and result['queries']>before['queries']+0.5:
+            regressions.append(f'{name}: queries per request {before["queries"]:.1f} -> {result["queries"]:.1f}')
+        if result['errors']+result['failures']>before['errors']+before.get('failures', 0):
+            regressions.append(f'{name}: errors and failed requests {before["errors"]+before.get("failures", 0)} -> {result["errors"]+result["failures"]}')
+    return regressions
+
+def main():
+    args = parse_args()
+    scenarios = args.scenario or list(SCENARIOS)
+    unknown = set(scenarios)-set(SCENARIOS)
+    if unknown:
+        sys.exit(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+
+    directory = tempfile.mkdtemp(prefix='storefront-bench-')
+    database = os.path.abspath(args.database or os.path.join(directory, 'bench.sqlite'))
+    if os.path.exists(database):
+        sys.exit(f'{database} already exists, the benchmark needs a fresh database.')
+    storefront = create_app(database)
+    started = time.perf_counter()
+    seed(storefront, args)
+    print(f'Seeded {args.users} users, {args.products} products and {args.transactions} transactions in {time.perf_counter()-started:.1f} s.')
+
+    counter = QueryCounter()
+    results = []
+    if args.mode in ('client', 'both'):
+        results.extend(run_client(storefront, args, scenario, counter) for scenario in scenarios)
+    if args.mode in ('server', 'both'):
+        server, base_url = start_server(storefront.app)
+        try:
+            results.extend(run_server(storefront.app, base_url, args, scenario) for scenario in scenarios)
+        finally:
+            server.shutdown()
+    report(results)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump({'arguments': vars(args), 'results': results}, file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file)['results'], args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+if __name__=='__main__':
+    main()
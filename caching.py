@@ -0,0 +1,111 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+from flask import Response, make_response, request, session
+from flask_login import current_user
+
+# In-process caches.
+
+class TTLCache():
+    # Bounded least-recently-used cache whose entries also expire after ttl seconds. Safe to share between threads.
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires<=time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic()+(self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data)>self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class PageCache():
+    # Whole-page cache for anonymous visitors of the catalog pages.
+    # Rendered pages are stored under the current catalog version, which the views bump whenever products or stock
+    # change, so a bump makes every cached page stale at once and the old entries simply age out of the LRU. Responses
+    # carry an ETag (a hash of the page) and Last-Modified (when it was rendered), and a conditional GET that still
+    # matches a cached page is answered with 304 before anything is queried or rendered.
+    # The backend is any object with get/set like TTLCache. The version lives in the backend too, so a backend
+    # shared between worker processes also shares invalidation. With the default per-process backend a bump only
+    # reaches the worker that made it, the other workers re-render their pages after PAGE_CACHE_TTL seconds, and as
+    # the ETag follows the content, browsers then get the new page instead of a 304.
+
+    VERSION_KEY = 'catalog-version'
+
+    def __init__(self, app=None, backend=None):
+        self.backend = backend
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, backend)
+
+    def init_app(self, app, backend=None):
+        app.config.setdefault('PAGE_CACHE_SIZE', 256)
+        app.config.setdefault('PAGE_CACHE_TTL', 300) # Seconds
+        self.backend = backend or TTLCache(maxsize=app.config['PAGE_CACHE_SIZE'], ttl=app.config['PAGE_CACHE_TTL'])
+
+    def version(self):
+        return self.backend.get(self.VERSION_KEY) or 0
+
+    def bump(self):
+        with self._lock:
+            self.backend.set(self.VERSION_KEY, self.version()+1, ttl=float('inf'))
+
+    def cached(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Only anonymous GETs without pending flash messages get the same page for everyone.
+            if request.method!='GET' or current_user.is_authenticated or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            key = ('page', self.version(), request.full_path)
+            page = self.backend.get(key)
+            if page is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code!=200:
+                    return response
+                body = response.get_data()
+                # HTTP dates only have a precision of one second.
+                page = (body, response.mimetype, hashlib.sha1(body).hexdigest(), datetime.now(timezone.utc).replace(microsecond=0))
+                self.backend.set(key, page)
+
+            body, mimetype, etag, last_modified = page
+            if etag in request.if_none_match:
+                response = Response(status=304)
+            else:
+                response = Response(body, mimetype=mimetype)
+
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.headers['Cache-Control'] = 'public, no-cache' # Browsers may keep it but have to revalidate.
+            response.vary.add('Cookie')
+            return response.make_conditional(request)
+        return wrapper
@@ -0,0 +1,109 @@
+import atexit
+import threading
+import time
+from sqlalchemy import delete, select
+from database import upsert
+from models import db, Cart
+
+# Server-side cart store.
+# Quantities are written with a single upsert on the (user_id, product_id) key, so adding a product that is already in
+# the cart just changes its quantity, and any number of lines can be changed in one statement.
+# With CART_WRITE_BEHIND enabled, edits are collected in memory per user and flushed in one transaction once they
+# have been quiet for CART_WRITE_BEHIND_DELAY seconds, so a burst of quantity changes costs a single write. Anything
+# that reads a cart (the cart page, checkout) flushes that user's pending edits first.
+# Given an Inventory, every quantity change first moves the stock held for the cart (immediately, also with
+# write-behind), and a change that would hold more than is available raises OutOfStock without touching the cart.
+
+class CartStore():
+    def __init__(self, app=None, inventory=None):
+        self.app = None
+        self.inventory = inventory
+        self._pending = {} # user id -> ({product id: amount}, time of the last edit)
+        self._lock = threading.Lock()
+        self._flusher = None
+        if app is not None:
+            self.init_app(app, inventory)
+
+    def init_app(self, app, inventory=None):
+        app.config.setdefault('CART_WRITE_BEHIND', False)
+        app.config.setdefault('CART_WRITE_BEHIND_DELAY', 2.0) # Seconds
+        self.app = app
+        self.inventory = inventory
+
+    @property
+    def write_behind(self):
+        return self.app.config['CART_WRITE_BEHIND']
+
+    def set_quantity(self, user_id, product_id, amount):
+        self.set_quantities(user_id, {product_id: amount})
+
+    def set_quantities(self, user_id, quantities):
+        # quantities: {product id: amount}, an amount below 1 removes the line.
+        if not quantities:
+            return
+        if self.inventory is not None:
+            self.inventory.hold(user_id, quantities)
+        if not self.write_behind:
+            self._write(user_id, quantities)
+            return
+
+        with self._lock:
+            pending, _ = self._pending.get(user_id, ({}, None))
+            pending.update(quantities)
+            self._pending[user_id] = (pending, time.monotonic())
+        self._start_flusher()
+
+    def remove(self, user_id, cart_id):
+        # Returns whether a line was removed, only the owner of the cart line can remove it.
+        self.flush(user_id)
+        product_id = db.session.scalar(select(Cart.product_id).where(Cart.id==cart_id, Cart.user_id==user_id))
+        if product_id is None:
+            return False
+        db.session.execute(delete(Cart).where(Cart.id==cart_id, Cart.user_id==user_id))
+        db.session.commit()
+        if self.inventory is not None:
+            self.inventory.release(user_id, [product_id])
+        return True
+
+    def flush(self, user_id):
+        with self._lock:
+            pending, _ = self._pending.pop(user_id, (None, None))
+        if pending:
+            self._write(user_id, pending)
+
+    def flush_all(self):
+        with self._lock:
+            users = list(self._pending)
+        for user_id in users:
+            with self.app.app_context():
+                self.flush(user_id)
+
+    def _write(self, user_id, quantities):
+        rows = [{'user_id': user_id, 'product_id': product_id, 'amount': amount} for product_id, amount in quantities.items() if amount>0]
+        removed = [product_id for product_id, amount in quantities.items() if amount<=0]
+        upsert(db.session, Cart.__table__, rows, ['user_id', 'product_id'], lambda excluded: {'amount': excluded.amount})
+        if removed:
+            db.session.execute(delete(Cart).where(Cart.user_id==user_id, Cart.product_id.in_(removed)))
+        db.session.commit()
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name='cart-flusher', daemon=True)
+            self._flusher.start()
+        atexit.register(self.flush_all)
+
+    def _flush_loop(self):
+        delay = self.app.config['CART_WRITE_BEHIND_DELAY']
+        while True:
+            time.sleep(delay/2)
+            now = time.monotonic()
+            with self._lock:
+                due = [user_id for user_id, (_, edited) in self._pending.items() if now-edited>=delay]
+            for user_id in due:
+                try:
+                    with self.app.app_context():
+                        self.flush(user_id)
+                except Exception:
+                    self.app.logger.exception('Flushing the cart of user %s failed.', user_id)
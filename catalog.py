@@ -0,0 +1,214 @@
+import codecs
+import csv
+import json
+from sqlalchemy import bindparam, delete, select, update
+from database import upsert
+from analytics import remove_product_sales
+from autocomplete import note_catalog_changed, note_removed
+from forms import CATEGORIES
+from models import db, Product, Cart, StockHold, TransactionHistory, ProductSales
+
+# Bulk catalog maintenance.
+# Imports read CSV or JSON lines one row at a time and write them in chunks: every chunk is checked for duplicates
+# with one IN query against the existing names, then written with a single executemany insert or upsert keyed on the
+# unique product name and committed. Memory use depends on the chunk size, not on the size of the file.
+# Bulk updates change price and/or stock of many products with one executemany UPDATE per kind of change.
+# Deleting a product is a handful of set-based DELETE statements, or with archive=True a soft delete that keeps the
+# product row and its transaction history and only hides it from the shop.
+
+CHUNK_SIZE = 1000
+IMPORT_FIELDS = ('name', 'desc', 'price', 'stock', 'category', 'image')
+UPDATE_FIELDS = ('price', 'stock', 'stock_delta') # stock_delta adjusts the stock, e.g. -3 or +50.
+
+class CatalogError(Exception):
+    pass
+
+class ImportReport():
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.errors = [] # (line number, message)
+
+    def as_dict(self):
+        return {'created': self.created, 'updated': self.updated, 'skipped': self.skipped, 'errors': [{'line': line, 'error': error} for line, error in self.errors]}
+
+# Readers yield (line number, row) so rejected rows can be reported by their position in the file.
+
+def read_csv(stream):
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+def read_jsonl(stream):
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, {'__error__': 'Invalid JSON.'}
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+    'ndjson': read_jsonl,
+}
+
+def _decoded(rows):
+    # A file that isn't UTF-8 ends the import with a rejected row instead of an exception. The rows before it are kept.
+    line = 0
+    try:
+        for line, row in rows:
+            yield line, row
+    except UnicodeDecodeError:
+        yield line+1, {'__error__': 'The file is not UTF-8 encoded, the rest of it was not imported.'}
+
+def open_upload(upload, fmt):
+    # Wraps an uploaded file (or any binary stream) so it is decoded and parsed lazily.
+    if fmt not in READERS:
+        raise CatalogError(f'Unsupported import format: {fmt}.')
+    # Decoded line by line, so an invalid byte only loses the line it is on and what follows.
+    return _decoded(READERS[fmt](codecs.iterdecode(upload, 'utf-8-sig')))
+
+def _integer(value, field):
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise CatalogError(f'{field} must be a whole number.')
+    return number
+
+def clean_row(row):
+    if not isinstance(row, dict):
+        raise CatalogError('Row must be an object.')
+    if '__error__' in row:
+        raise CatalogError(row['__error__'])
+    name = (row.get('name') or '').strip()
+    if not name or len(name)>32:
+        raise CatalogError('name is required and must be at most 32 characters.')
+    desc = (row.get('desc') or '').strip()
+    if not desc:
+        raise CatalogError('desc is required.')
+    price = _integer(row.get('price'), 'price')
+    stock = _integer(row.get('stock'), 'stock')
+    if price<0 or stock<0:
+        raise CatalogError('price and stock cannot be negative.')
+    category = (row.get('category') or '').strip()
+    if category not in CATEGORIES:
+        raise CatalogError(f'category must be one of {", ".join(CATEGORIES)}.')
+    return {'name': name, 'desc': desc, 'price': price, 'stock': stock, 'category': category, 'image': (row.get('image') or '').strip() or 'default.png'}
+
+def _write_chunk(chunk, report, replace):
+    names = [row['name'] for _, row in chunk]
+    existing = set(db.session.scalars(select(Product.name).where(Product.name.in_(names))))
+    if replace:
+        upsert(db.session, Product.__table__, [row for _, row in chunk], ['name'],
+               lambda excluded: {'desc': excluded.desc, 'price': excluded.price, 'stock': excluded.stock, 'category': excluded.category, 'archived': False})
+        report.updated += len(existing)
+        report.created += len(chunk)-len(existing)
+    else:
+        new = [row for _, row in chunk if row['name'] not in existing]
+        if new:
+            db.session.execute(Product.__table__.insert(), new)
+        report.skipped += len(chunk)-len(new)
+        report.created += len(new)
+    note_catalog_changed(db.session)
+    db.session.commit()
+
+def import_products(rows, *, replace=True, chunk_size=CHUNK_SIZE):
+    # rows: iterable of (line number, dict), e.g. from open_upload(). With replace, existing products (matched by name) get the
+    # imported description, price, stock and category, otherwise they are left alone and counted as skipped.
+    report = ImportReport()
+    seen = set()
+    chunk = []
+    for number, row in rows:
+        try:
+            row = clean_row(row)
+        except CatalogError as error:
+            report.errors.append((number, str(error)))
+            continue
+        if row['name'] in seen:
+            report.errors.append((number, f'Duplicate of an earlier row: {row["name"]}.'))
+            continue
+        seen.add(row['name'])
+        chunk.append((number, row))
+        if len(chunk)>=chunk_size:
+            _write_chunk(chunk, report, replace)
+            chunk = []
+    if chunk:
+        _write_chunk(chunk, report, replace)
+    return report
+
+def bulk_update(changes):
+    # changes: list of dicts identifying a product by 'id' or 'name' with any of price, stock and stock_delta.
+    # Returns the number of products changed. Stock adjustments never take the stock below zero.
+    groups = {}
+    for change in changes:
+        if not isinstance(change, dict):
+            raise CatalogError('Every change must be an object.')
+        key = 'id' if 'id' in change else 'name' if 'name' in change else None
+        if key is None:
+            raise CatalogError('Every change needs an id or a name.')
+        if key=='name' and not isinstance(change['name'], str):
+            raise CatalogError('name must be a string.')
+        fields = tuple(field for field in UPDATE_FIELDS if change.get(field) is not None)
+        if not fields:
+            raise CatalogError('Every change needs a price, stock or stock_delta.')
+        if 'stock' in fields and 'stock_delta' in fields:
+            raise CatalogError('Use either stock or stock_delta, not both.')
+        params = {'key_value': change[key] if key=='name' else _integer(change[key], 'id')}
+        for field in fields:
+            params[f'{field}_value'] = _integer(change[field], field)
+            if field!='stock_delta' and params[f'{field}_value']<0:
+                raise CatalogError(f'{field} cannot be negative.')
+        groups.setdefault((key, fields), []).append(params)
+
+    changed = 0
+    connection = db.session.connection()
+    for (key, fields), params in groups.items():
+        column = getattr(Product, key)
+        statement = update(Product).where(column==bindparam('key_value'))
+        values = {}
+        # Parameters are suffixed with _value, SQLAlchemy reserves the bare column names for the SET clause.
+        if 'price' in fields:
+            values['price'] = bindparam('price_value')
+        if 'stock' in fields:
+            values['stock'] = bindparam('stock_value')
+        if 'stock_delta' in fields:
+            values['stock'] = Product.stock+bindparam('stock_delta_value')
+            statement = statement.where(Product.stock+bindparam('stock_delta_value')>=0)
+        statement = statement.values(**values)
+        if connection.dialect.supports_sane_multi_rowcount:
+            changed += connection.execute(statement, params).rowcount
+        else:
+            changed += sum(connection.execute(statement, param).rowcount for param in params)
+    db.session.commit()
+    return changed
+
+def delete_product(product_id, *, archive=False):
+    # Returns the product's (name, image), or None when it doesn't exist. Nothing is loaded into the session.
+    # The child rows are deleted explicitly as well as by ON DELETE CASCADE, so databases whose tables predate the
+    # cascade (and SQLite connections without foreign keys) end up in the same state.
+    product = db.session.execute(select(Product.name, Product.image).where(Product.id==product_id)).first()
+    if product is None:
+        return None
+    if archive:
+        # Archived first, which locks the product row: from then on no cart can place a new hold on it.
+        db.session.execute(update(Product).where(Product.id==product_id).values(archived=True, held=0).execution_options(synchronize_session=False))
+    db.session.execute(delete(Cart).where(Cart.product_id==product_id).execution_options(synchronize_session=False))
+    db.session.execute(delete(StockHold).where(StockHold.product_id==product_id).execution_options(synchronize_session=False))
+    if not archive:
+        remove_product_sales(product_id) # The dashboard totals keep matching the history that is left.
+        db.session.execute(delete(TransactionHistory).where(TransactionHistory.product_id==product_id).execution_options(synchronize_session=False))
+        db.session.execute(delete(ProductSales).where(ProductSales.product_id==product_id).execution_options(synchronize_session=False))
+        db.session.execute(delete(Product).where(Product.id==product_id).execution_options(synchronize_session=False))
+    note_removed(db.session, product_id)
+    db.session.commit()
+    return product.name, product.image
+
+def restore_product(product_id):
+    restored = db.session.execute(update(Product).where(Product.id==product_id, Product.archived==True).values(archived=False).execution_options(synchronize_session=False)).rowcount
+    note_catalog_changed(db.session)
+    db.session.commit()
+    return restored==1
@@ -0,0 +1,161 @@
+import random
+import time
+from datetime import datetime
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.exc import OperationalError
+from models import db, User, Product, Cart, StockHold, TransactionHistory
+from analytics import record_sales
+
+# Checkout engine.
+# A purchase is a single database transaction made of conditional UPDATE statements: the balance is only charged
+# WHERE balance >= total and the stock is only decremented WHERE stock >= amount. The database checks and applies
+# each change atomically, so concurrent buyers of the same product can never oversell it, and if any statement
+# doesn't match its row the whole transaction is rolled back and nothing is charged.
+# Units held by other carts (see inventory.py) are not for sale, the buyer's own holds are consumed by the purchase.
+# A cart checkout starts by deleting the cart lines it read, and only goes on if every line was still there with the
+# same quantity, so submitting the same cart twice at once buys it once. The buyer's holds are consumed the same way.
+
+MAX_ATTEMPTS = 5     # Attempts before giving up when the database reports lock contention.
+RETRY_DELAY = 0.02   # Base delay in seconds, doubled on every retry with some jitter.
+
+class CheckoutError(Exception):
+    pass
+
+class EmptyCart(CheckoutError):
+    pass
+
+class InvalidQuantity(CheckoutError):
+    pass
+
+class ProductNotFound(CheckoutError):
+    pass
+
+class UserNotFound(CheckoutError):
+    pass
+
+class InsufficientBalance(CheckoutError):
+    def __init__(self, shortfall):
+        super().__init__(f'Balance is short by ${shortfall}.')
+        self.shortfall = shortfall
+
+class CartChanged(CheckoutError):
+    def __init__(self):
+        super().__init__('Your cart changed during checkout, please review it and try again.')
+
+class OutOfStock(CheckoutError):
+    def __init__(self, name, available):
+        super().__init__(f'Only {available} stocks left of {name}.')
+        self.name = name
+        self.available = available
+
+def with_retry(operation):
+    # Re-runs the whole transaction when it loses a lock race (SQLite's "database is locked", deadlocks and
+    # serialization failures on server databases) or the cart changed after it was read.
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            return operation()
+        except (OperationalError, CartChanged):
+            db.session.rollback()
+            if attempt==MAX_ATTEMPTS-1:
+                raise
+            time.sleep(RETRY_DELAY*(2**attempt)*random.uniform(0.5, 1.5))
+
+def _execute_many(statement, params):
+    # Returns the number of rows matched by an executemany, also on drivers that don't report it for the whole batch.
+    connection = db.session.connection()
+    if connection.dialect.supports_sane_multi_rowcount:
+        return connection.execute(statement, params).rowcount
+    return sum(connection.execute(statement, param).rowcount for param in params)
+
+def _claim_cart(lines):
+    # Deletes the cart lines exactly as they were read, before anything else is written.
+    statement = delete(Cart).where(Cart.id==bindparam('cart_id'), Cart.amount==bindparam('amount_value'))
+    if _execute_many(statement, [{'cart_id': line.id, 'amount_value': line.amount} for line in lines])!=len(lines):
+        db.session.rollback()
+        raise CartChanged()
+
+def _consume_holds(user_id, held):
+    # held: {product_id: amount} as read with the cart. Called after _take_stock locked the product rows, which every
+    # change to holds has to lock first, so a hold that no longer matches was changed or expired in the meantime.
+    if not held:
+        return
+    statement = delete(StockHold).where(StockHold.user_id==bindparam('user_id_value'), StockHold.product_id==bindparam('product_id_value'), StockHold.amount==bindparam('amount_value'))
+    if _execute_many(statement, [{'user_id_value': user_id, 'product_id_value': product_id, 'amount_value': amount} for product_id, amount in held.items()])!=len(held):
+        db.session.rollback()
+        raise CartChanged()
+
+def _charge(user_id, total):
+    charged = db.session.execute(update(User).where(User.id==user_id, User.balance>=total).values(balance=User.balance-total).execution_options(synchronize_session=False))
+    if charged.rowcount!=1:
+        balance = db.session.scalar(select(User.balance).where(User.id==user_id))
+        db.session.rollback()
+        if balance is None: # The account was deleted.
+            raise UserNotFound('User not found.')
+        raise InsufficientBalance(total-balance)
+
+def _take_stock(lines):
+    # lines: list of (product_id, name, amount, held), ordered by product id so concurrent checkouts lock rows in the
+    # same order. held is what the buyer's own hold reserves, it counts as available to them and is released.
+    statement = update(Product).where(Product.id==bindparam('product_id'), Product.stock-Product.held+bindparam('released')>=bindparam('amount')).values(stock=Product.stock-bindparam('amount'), held=Product.held-bindparam('released'))
+    params = [{'product_id': product_id, 'amount': amount, 'released': held} for product_id, _, amount, held in lines]
+    if _execute_many(statement, params)!=len(lines):
+        db.session.rollback()
+        stocks = {product.id: product.stock-product.held for product in db.session.execute(select(Product.id, Product.stock, Product.held).where(Product.id.in_([line[0] for line in lines])))}
+        db.session.rollback()
+        for product_id, name, amount, held in lines:
+            available = max(stocks.get(product_id, 0)+held, 0)
+            if available<amount:
+                raise OutOfStock(name, available)
+        raise OutOfStock(lines[0][1], max(stocks.get(lines[0][0], 0)+lines[0][3], 0))
+
+def _record(user_id, rows):
+    # rows: list of (product_id, category, amount, total). Every row of a purchase gets the same created_at.
+    created_at = datetime.utcnow()
+    db.session.execute(insert(TransactionHistory), [{'user_id': user_id, 'product_id': product_id, 'amount': amount, 'total': total, 'created_at': created_at} for product_id, _, amount, total in rows])
+    record_sales(user_id, rows, day=created_at.date())
+
+def purchase_cart(user_id):
+    def run():
+        lines = db.session.execute(
+            select(Cart.id, Cart.product_id, Cart.amount, Product.price, Product.name, Product.category, StockHold.amount.label('held'))
+            .join(Product, Product.id==Cart.product_id)
+            .outerjoin(StockHold, (StockHold.user_id==Cart.user_id) & (StockHold.product_id==Cart.product_id))
+            .where(Cart.user_id==user_id, Product.archived==False)
+            .order_by(Cart.product_id)
+        ).all()
+        if not lines:
+            raise EmptyCart()
+        if any(line.amount<1 for line in lines):
+            raise InvalidQuantity('Cart quantities must be at least 1.')
+
+        total = sum(line.amount*line.price for line in lines)
+        amounts = {}
+        for line in lines:
+            amounts[line.product_id] = amounts.get(line.product_id, 0)+line.amount
+        names = {line.product_id: line.name for line in lines}
+        held = {line.product_id: line.held for line in lines if line.held}
+        _claim_cart(lines)
+        _charge(user_id, total)
+        _take_stock([(product_id, names[product_id], amount, held.get(product_id, 0)) for product_id, amount in amounts.items()])
+        _consume_holds(user_id, held)
+        _record(user_id, [(line.product_id, line.category, line.amount, line.amount*line.price) for line in lines])
+        db.session.commit()
+        return total
+    return with_retry(run)
+
+def purchase_item(user_id, product_id, quantity):
+    if quantity<1:
+        raise InvalidQuantity('Quantity must be at least 1.')
+
+    def run():
+        product = db.session.execute(select(Product.price, Product.name, Product.category).where(Product.id==product_id, Product.archived==False)).first()
+        if product is None:
+            raise ProductNotFound('Product not found.')
+
+        total = product.price*quantity
+        _charge(user_id, total)
+        _take_stock([(product_id, product.name, quantity, 0)]) # Buying directly leaves the cart and its holds alone.
+        _record(user_id, [(product_id, product.category, quantity, total)])
+        db.session.commit()
+        return product.name, total
+    return with_retry(run)
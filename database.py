@@ -0,0 +1,110 @@
+import os
+import sqlite3
+from functools import wraps
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Delete, Insert, Update, and_, event, insert, literal
+from sqlalchemy.engine import Engine
+
+# Database engine configuration.
+# SQLite runs in WAL mode so readers no longer block on a checkout that is writing, and waits for a busy lock
+# instead of failing right away. Server databases get a sized connection pool. Optionally a read replica can be
+# configured, views marked with @read_only then send their queries to it while every write still goes to the primary.
+
+REPLICA_BIND = 'replica'
+
+def configure_database(app):
+    # Call before db.init_app(app), the engine options are read when the engines are created.
+    config = app.config
+    config.setdefault('SQLALCHEMY_REPLICA_URI', os.environ.get('DATABASE_REPLICA_URL'))
+    config.setdefault('SQLITE_JOURNAL_MODE', 'WAL')
+    config.setdefault('SQLITE_SYNCHRONOUS', 'NORMAL')  # Safe with WAL, only the last commits may be lost on power failure.
+    config.setdefault('SQLITE_BUSY_TIMEOUT', 5000)     # Milliseconds to wait for a lock before "database is locked".
+    config.setdefault('SQLITE_FOREIGN_KEYS', True)     # SQLite only enforces foreign keys and ON DELETE CASCADE when asked to.
+    config.setdefault('DB_POOL_SIZE', 10)
+    config.setdefault('DB_MAX_OVERFLOW', 20)
+    config.setdefault('DB_POOL_TIMEOUT', 30)
+    config.setdefault('DB_POOL_RECYCLE', 1800)
+
+    if not config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        options = config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        options.setdefault('pool_size', config['DB_POOL_SIZE'])
+        options.setdefault('max_overflow', config['DB_MAX_OVERFLOW'])
+        options.setdefault('pool_timeout', config['DB_POOL_TIMEOUT'])
+        options.setdefault('pool_recycle', config['DB_POOL_RECYCLE'])
+        options.setdefault('pool_pre_ping', True)
+
+    if config['SQLALCHEMY_REPLICA_URI']:
+        config.setdefault('SQLALCHEMY_BINDS', {})[REPLICA_BIND] = config['SQLALCHEMY_REPLICA_URI']
+
+    @event.listens_for(Engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        if not isinstance(dbapi_connection, sqlite3.Connection):
+            return
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}")
+        cursor.execute(f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}")
+        cursor.execute(f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'])}")
+        cursor.execute(f"PRAGMA foreign_keys={'ON' if config['SQLITE_FOREIGN_KEYS'] else 'OFF'}")
+        cursor.close()
+
+class RoutingSession(Session):
+    # Sends reads made inside a @read_only view to the replica. Flushes and INSERT/UPDATE/DELETE statements always
+    # use the primary.
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_request_context() and g.get('read_replica')
+                and REPLICA_BIND in self._db.engines and not isinstance(clause, (Insert, Update, Delete))):
+            return self._db.engines[REPLICA_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def upsert(session, table, rows, index_elements, update):
+    # INSERT ... ON CONFLICT DO UPDATE for a batch of rows in one executemany.
+    # update(excluded) returns the SET clause, excluded refers to the values of the row that was being inserted.
+    if not rows:
+        return
+    dialect = session.get_bind(clause=insert(table)).dialect.name
+    if dialect=='sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect=='postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect in ('mysql', 'mariadb'):
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        statement = dialect_insert(table)
+        session.execute(statement.on_duplicate_key_update(**update(statement.inserted)), rows)
+        return
+    else:
+        _update_or_insert(session, table, rows, index_elements, update)
+        return
+    statement = dialect_insert(table)
+    session.execute(statement.on_conflict_do_update(index_elements=index_elements, set_=update(statement.excluded)), rows)
+
+class _RowValues(dict):
+    # Stands in for "excluded": the values of one row as SQL literals, by attribute or by key.
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+def _update_or_insert(session, table, rows, index_elements, update):
+    # Portable fallback for databases without an upsert statement: an UPDATE per row, and an INSERT where it matched
+    # nothing. Not atomic, two transactions inserting the same new key at once make one of them fail with an
+    # IntegrityError.
+    for row in rows:
+        excluded = _RowValues({name: literal(value, table.c[name].type) for name, value in row.items()})
+        key = and_(*[table.c[name]==row[name] for name in index_elements])
+        if session.execute(table.update().where(key).values(update(excluded))).rowcount==0:
+            session.execute(table.insert().values(row))
+
+def read_only(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Restored afterwards, so whatever runs later in the same context (error handlers, teardown) uses the primary.
+        previous = g.get('read_replica', False)
+        g.read_replica = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.read_replica = previous
+    return wrapper
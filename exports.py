@@ -0,0 +1,54 @@
+import csv
+import io
+import json
+from datetime import datetime
+from sqlalchemy import select
+from models import db, Product, TransactionHistory
+from repository import filter_transactions
+
+# Streaming exports of a user's transaction history and of the product catalog.
+# Rows are fetched from the database in batches and written out one by one, so memory use stays flat no matter how
+# long the history is.
+
+TRANSACTION_FIELDS = ('id', 'created_at', 'product', 'amount', 'total')
+PRODUCT_FIELDS = ('id', 'name', 'desc', 'price', 'stock', 'category', 'image')
+BATCH_SIZE = 500
+
+def transaction_rows(user_id, *, start=None, end=None):
+    statement = (
+        select(TransactionHistory.id, TransactionHistory.created_at, Product.name.label('product'), TransactionHistory.amount, TransactionHistory.total)
+        .join(Product, Product.id==TransactionHistory.product_id)
+        .where(TransactionHistory.user_id==user_id)
+        .order_by(TransactionHistory.created_at, TransactionHistory.id)
+    )
+    statement = filter_transactions(statement, start=start, end=end)
+    for row in db.session.execute(statement.execution_options(yield_per=BATCH_SIZE)):
+        yield row._asdict()
+
+def product_rows():
+    statement = select(*(getattr(Product, field) for field in PRODUCT_FIELDS)).order_by(Product.id)
+    for row in db.session.execute(statement.execution_options(yield_per=BATCH_SIZE)):
+        yield row._asdict()
+
+def _plain(row):
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in row.items()}
+
+def to_csv(rows, fields=TRANSACTION_FIELDS):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(_plain(row))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+def to_ndjson(rows, fields=TRANSACTION_FIELDS):
+    for row in rows:
+        yield json.dumps(_plain(row))+'\n'
+
+EXPORT_FORMATS = {
+    'csv': (to_csv, 'text/csv'),
+    'ndjson': (to_ndjson, 'application/x-ndjson'),
+}
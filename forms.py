@@ -1,10 +1,12 @@
 import os
 from flask_wtf import FlaskForm
-from wtforms import StringField, EmailField, PasswordField, SubmitField, SearchField, FileField, IntegerField, SelectField
+from wtforms import StringField, EmailField, PasswordField, SubmitField, SearchField, FileField, IntegerField, SelectField, BooleanField
 from wtforms.validators import EqualTo, DataRequired, Email, ValidationError, NumberRange
 from flask_login import current_user
 from models import User, Product
 
+CATEGORIES = ['Food', 'Devices', 'Games', 'Books']
+
 class RegistrationForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
     email = EmailField('Email', validators=[DataRequired(), Email()])
@@ -45,13 +47,7 @@ class ProductsForm(FlaskForm):
     desc = StringField('Product Description', validators=[DataRequired()])
     price = IntegerField('Price', validators=[DataRequired()])
     stock = IntegerField('Stock', validators=[DataRequired()])
-    category = SelectField('Category', choices=[
-        ('', 'Select a category'),
-        ('Food', 'Food'),
-        ('Devices', 'Devices'),
-        ('Games', 'Games'),
-        ('Books', 'Books')
-    ], validators=[DataRequired()])
+    category = SelectField('Category', choices=[('', 'Select a category')]+[(category, category) for category in CATEGORIES], validators=[DataRequired()])
     img = FileField('Product Image')
     add_product = SubmitField('Add Product')
     update_product = SubmitField('Update Product')
@@ -83,6 +79,16 @@ class ProductsForm(FlaskForm):
         if ext not in allowed_extensions:
             raise ValidationError('Unsupported file.')
 
+class ProductImportForm(FlaskForm):
+    file = FileField('Catalog File (.csv or .jsonl)', validators=[DataRequired()])
+    replace = BooleanField('Update products that already exist', default=True)
+    import_products = SubmitField('Import Products')
+
+    def validate_file(self, file):
+        ext = os.path.splitext(file.data.filename)[-1].lower()
+        if ext not in ('.csv', '.jsonl', '.ndjson'):
+            raise ValidationError('Unsupported file.')
+
 class ProfileForm(FlaskForm):
     username = StringField('Username', validators=[DataRequired()])
     email = EmailField('Email', validators=[Email()])
@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from metrics import BCRYPT_SECONDS
+
+# Password hashing service.
+# bcrypt is deliberately slow, so it runs in a small bounded thread pool (bcrypt releases the GIL while hashing) rather
+# than on every request thread at once. When the pool and its queue are full, callers get HashingBusy right away
+# instead of piling up behind a login storm, and the rest of the site keeps responding.
+
+class HashingBusy(Exception):
+    pass
+
+class PasswordHasher():
+    def __init__(self, app=None, bcrypt=None):
+        self.bcrypt = bcrypt
+        self._executor = None
+        self._slots = None
+        if app is not None:
+            self.init_app(app, bcrypt)
+
+    def init_app(self, app, bcrypt):
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)           # bcrypt cost factor, existing hashes are upgraded on login.
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 4)        # Hashes computed in parallel.
+        app.config.setdefault('PASSWORD_HASH_QUEUE', 16)         # Hashes allowed to wait for a worker.
+        app.config.setdefault('PASSWORD_HASH_WAIT', 2.0)         # Seconds to wait for a queue slot before giving up.
+        self.bcrypt = bcrypt
+        self.config = app.config
+        workers = app.config['PASSWORD_HASH_WORKERS']
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+        self._slots = threading.BoundedSemaphore(workers+app.config['PASSWORD_HASH_QUEUE'])
+
+    @property
+    def rounds(self):
+        return self.config['BCRYPT_LOG_ROUNDS']
+
+    def _run(self, operation, function, *args):
+        if not self._slots.acquire(timeout=self.config['PASSWORD_HASH_WAIT']):
+            raise HashingBusy('Too many passwords are being hashed right now.')
+        try:
+            return self._executor.submit(self._timed, operation, function, *args).result()
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _timed(operation, function, *args):
+        started = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            BCRYPT_SECONDS.observe(time.perf_counter()-started, operation)
+
+    def hash(self, pw):
+        return self._run('hash', self.bcrypt.generate_password_hash, pw, self.rounds).decode('utf-8')
+
+    def check(self, hashed_pw, pw):
+        return self._run('check', self.bcrypt.check_password_hash, hashed_pw, pw)
+
+    def needs_rehash(self, hashed_pw):
+        # bcrypt hashes look like $2b$12$..., the second field is the cost they were made with.
+        try:
+            return int(hashed_pw.split('$')[2])!=self.rounds
+        except (IndexError, ValueError):
+            return True
+
+class LoginThrottle():
+    # Sliding window limits on login attempts, checked before any hashing happens. Every attempt counts against the
+    # client's IP address, failed attempts also count against the username being tried.
+
+    def __init__(self, app=None):
+        self._attempts = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOGIN_THROTTLE_WINDOW', 300)     # Seconds
+        app.config.setdefault('LOGIN_MAX_ATTEMPTS_PER_IP', 30)
+        app.config.setdefault('LOGIN_MAX_FAILURES_PER_USER', 5)
+        self.config = app.config
+
+    def _recent(self, key, now):
+        attempts = self._attempts.get(key)
+        if attempts is None:
+            return 0
+        while attempts and attempts[0]<=now-self.config['LOGIN_THROTTLE_WINDOW']:
+            attempts.popleft()
+        if not attempts:
+            del self._attempts[key]
+            return 0
+        return len(attempts)
+
+    def _record(self, key, now):
+        self._attempts.setdefault(key, deque()).append(now)
+
+    def _prune(self, now):
+        # Keeps the table from growing without bound under a flood of distinct addresses.
+        for key in list(self._attempts):
+            self._recent(key, now)
+
+    def allow(self, ip, username):
+        now = time.monotonic()
+        with self._lock:
+            if len(self._attempts)>10000:
+                self._prune(now)
+            if self._recent(('ip', ip), now)>=self.config['LOGIN_MAX_ATTEMPTS_PER_IP']:
+                return False
+            if self._recent(('user', username), now)>=self.config['LOGIN_MAX_FAILURES_PER_USER']:
+                return False
+            self._record(('ip', ip), now)
+            return True
+
+    def failed(self, username):
+        with self._lock:
+            self._record(('user', username), time.monotonic())
+
+    def succeeded(self, username):
+        with self._lock:
+            self._attempts.pop(('user', username), None)
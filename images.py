@@ -0,0 +1,205 @@
+import atexit
+import hashlib
+import io
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageOps
+from metrics import IMAGE_SECONDS
+
+# Background image processing.
+# Uploads are read in the request, then decoded, resized and encoded in a process pool so that the CPU heavy Pillow
+# work never blocks a request worker. Every upload produces a set of variants in JPEG and WebP named after the hash
+# of the uploaded bytes, e.g. 3f2a9c0d1b7e4a55-card.jpg, so a new upload never overwrites a file browsers have cached.
+# Until the job is done the product keeps showing its current (or the default) image.
+
+# Variant name -> bounding box in pixels
+VARIANTS = {
+    'thumb': (200, 200),
+    'card': (400, 400),
+    'detail': (800, 800),
+}
+# File extension -> (Pillow format, save options)
+FORMATS = {
+    '.jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+    '.webp': ('WEBP', {'quality': 80, 'method': 4}),
+}
+# The variant stored in the database and used by the templates.
+PRIMARY_VARIANT = 'card'
+PRIMARY_FORMAT = '.jpg'
+
+VARIANT_NAME = re.compile(r'^(?P<digest>[0-9a-f]{16})-(?P<variant>\w+)(?P<ext>\.\w+)$')
+
+def variant_filename(digest, variant=PRIMARY_VARIANT, ext=PRIMARY_FORMAT):
+    return f'{digest}-{variant}{ext}'
+
+def variant_filenames(filename):
+    # All the files belonging to an image, legacy images (e.g. 7.png) are a single file.
+    match = VARIANT_NAME.match(filename)
+    if not match:
+        return [filename]
+    return [variant_filename(match['digest'], variant, ext) for variant in VARIANTS for ext in FORMATS]
+
+def process_image(data, folder):
+    # Runs in a worker process, so it only deals with bytes and paths.
+    digest = hashlib.sha256(data).hexdigest()[:16]
+    with Image.open(io.BytesIO(data)) as original:
+        img = ImageOps.exif_transpose(original)
+        if img.mode in ('RGBA', 'LA', 'P'):
+            # JPEG has no alpha channel, transparent areas become white instead of black.
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel('A'))
+            img = background
+        else:
+            img = img.convert('RGB')
+
+        for variant, size in VARIANTS.items():
+            resized = img.copy()
+            resized.thumbnail(size)
+            for ext, (fmt, options) in FORMATS.items():
+                path = os.path.join(folder, variant_filename(digest, variant, ext))
+                if os.path.exists(path): # Same content was uploaded before.
+                    continue
+                tmp_path = f'{path}.{os.getpid()}.tmp'
+                resized.save(tmp_path, fmt, **options)
+                os.replace(tmp_path, path) # Readers never see a half written file.
+    return variant_filename(digest)
+
+class ImagePipeline():
+    def __init__(self, app=None):
+        self.app = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._latest = {} # job key -> id of the newest job, so an older upload finishing late can't win.
+        self._next_job = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IMAGE_WORKERS', 2)
+        app.config.setdefault('IMAGE_PIPELINE_SYNC', False) # Process in the request, for tests and scripts.
+        self.app = app
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.app.config['IMAGE_WORKERS'])
+            return self._executor
+
+    def submit(self, upload, folder, *, key=None, on_done=None):
+        # key identifies what the image belongs to (e.g. ('product', 7)), on_done(filename) runs in an app context.
+        data = upload.read()
+        started = time.perf_counter()
+        with self._lock:
+            self._next_job += 1
+            job = self._next_job
+            if key is not None:
+                self._latest[key] = job
+
+        if self.app.config['IMAGE_PIPELINE_SYNC']:
+            filename = process_image(data, folder)
+            IMAGE_SECONDS.observe(time.perf_counter()-started)
+            self._finish(key, job, on_done, filename)
+            return
+
+        future = self.executor.submit(process_image, data, folder)
+        future.add_done_callback(lambda future: self._done(key, job, on_done, future, started))
+
+    def _done(self, key, job, on_done, future, started):
+        error = future.exception()
+        if error is not None:
+            self.app.logger.error('Image processing failed for %s: %s', key, error)
+            return
+        IMAGE_SECONDS.observe(time.perf_counter()-started)
+        self._finish(key, job, on_done, future.result())
+
+    def _finish(self, key, job, on_done, filename):
+        with self._lock:
+            if key is not None and self._latest.get(key)!=job:
+                return
+            self._latest.pop(key, None)
+        if on_done is not None:
+            with self.app.app_context():
+                on_done(filename)
+
+def remove_image(folder, filename):
+    for name in variant_filenames(filename):
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+class ImageSweeper():
+    # Deferred removal of image files that are no longer used.
+    # Requests only schedule a file, a background thread removes it after IMAGE_SWEEP_DELAY seconds if nothing references
+    # it by then. Deleting a product never waits on the filesystem, and pages cached just before the change can still
+    # load the old image for a while. referenced(filenames) returns the subset still in use and runs in an app context.
+
+    def __init__(self, app=None, folder=None, referenced=None):
+        self.app = None
+        self.folder = folder
+        self.referenced = referenced
+        self._pending = {} # filename -> time it was released
+        self._lock = threading.Lock()
+        self._sweeper = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IMAGE_SWEEP_DELAY', 60.0) # Seconds
+        self.app = app
+
+    def schedule(self, filename):
+        if self.app.config['IMAGE_PIPELINE_SYNC']:
+            self._remove_unreferenced([filename])
+            return
+        with self._lock:
+            self._pending[filename] = time.monotonic()
+        self._start_sweeper()
+
+    def sweep(self, *, force=False):
+        # Removes the scheduled files that are due (all of them with force) and still unreferenced.
+        now = time.monotonic()
+        with self._lock:
+            due = [filename for filename, released in self._pending.items() if force or now-released>=self.app.config['IMAGE_SWEEP_DELAY']]
+            for filename in due:
+                del self._pending[filename]
+        if due:
+            with self.app.app_context():
+                self._remove_unreferenced(due)
+
+    def sweep_orphans(self, *, min_age=3600):
+        # Full scan for variant files no product references, e.g. left behind by a crash. Files younger than min_age
+        # seconds are skipped, they may belong to an upload that is still being processed.
+        images = set()
+        for name in os.listdir(self.folder):
+            match = VARIANT_NAME.match(name)
+            if match and time.time()-os.path.getmtime(os.path.join(self.folder, name))>=min_age:
+                images.add(variant_filename(match['digest']))
+        return self._remove_unreferenced(sorted(images))
+
+    def _remove_unreferenced(self, filenames):
+        used = self.referenced(filenames)
+        removed = [filename for filename in filenames if filename not in used]
+        for filename in removed:
+            remove_image(self.folder, filename)
+        return removed
+
+    def _start_sweeper(self):
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='image-sweeper', daemon=True)
+            self._sweeper.start()
+        atexit.register(self.sweep, force=True)
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(max(self.app.config['IMAGE_SWEEP_DELAY']/2, 1))
+            try:
+                self.sweep()
+            except Exception:
+                self.app.logger.exception('Sweeping released images failed.')
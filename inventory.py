@@ -0,0 +1,125 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, delete, func, select, update
+from database import upsert
+from models import db, Product, StockHold
+from checkout import OutOfStock, ProductNotFound
+
+# Stock reservations for carts.
+# Putting a product in the cart places a hold on that many units for HOLD_DURATION seconds, so shoppers find out about
+# a shortage when they add an item rather than when the checkout fails. Product.held counts the units held by all
+# carts. Changing holds first locks the product rows, then reads the current holds and applies the difference in the
+# same transaction, so concurrent requests can't both apply the same change and two carts can never hold the same
+# unit. The checkout consumes the buyer's holds.
+# Expired holds stay counted until the sweeper releases them in bulk, every HOLD_SWEEP_INTERVAL seconds in a
+# background thread (or `flask --app app expire-holds`).
+
+def lock_products(product_ids):
+    # Returns the products' id, name, stock, held and archived, with their rows locked until the transaction ends.
+    # Every change to holds or stock takes these locks first, so nothing read afterwards can change under the caller.
+    # SQLite ignores FOR UPDATE, a no-op write takes its database-wide write lock instead.
+    if db.session.connection().dialect.name=='sqlite':
+        db.session.execute(update(Product).where(Product.id.in_(product_ids)).values(held=Product.held).execution_options(synchronize_session=False))
+    statement = select(Product.id, Product.name, Product.stock, Product.held, Product.archived).where(Product.id.in_(product_ids))
+    return db.session.execute(statement.order_by(Product.id).with_for_update()).all()
+
+class Inventory():
+    def __init__(self, app=None, page_cache=None):
+        self.app = None
+        self.page_cache = page_cache
+        self._lock = threading.Lock()
+        self._sweeper = None
+        if app is not None:
+            self.init_app(app, page_cache)
+
+    def init_app(self, app, page_cache=None):
+        app.config.setdefault('HOLD_DURATION', 900)      # Seconds a cart holds its stock after the last change.
+        app.config.setdefault('HOLD_SWEEP_INTERVAL', 60) # Seconds between releasing expired holds.
+        self.app = app
+        self.page_cache = page_cache
+
+    def hold(self, user_id, quantities):
+        # quantities: {product id: amount}, an amount below 1 releases the hold. Raises OutOfStock (or ProductNotFound)
+        # and changes nothing when a product doesn't have enough unheld stock.
+        if not quantities:
+            return
+        products = {product.id: product for product in lock_products(list(quantities))}
+        current = dict(db.session.execute(select(StockHold.product_id, StockHold.amount).where(StockHold.user_id==user_id, StockHold.product_id.in_(list(quantities)))).all())
+
+        changes, rows, released, crossed = [], [], [], False
+        for product_id in sorted(quantities):
+            amount, held = max(quantities[product_id], 0), current.get(product_id, 0)
+            product = products.get(product_id)
+            if amount>0 and (product is None or product.archived):
+                db.session.rollback()
+                raise ProductNotFound('Product not found.')
+            if product is None or amount==held==0:
+                continue
+            available = product.stock-product.held
+            if amount-held>available:
+                db.session.rollback()
+                raise OutOfStock(product.name, max(available+held, 0))
+            if amount!=held:
+                changes.append({'product_id_value': product_id, 'delta': amount-held})
+                crossed = crossed or (available>0)!=(available-amount+held>0)
+            if amount>0:
+                rows.append({'user_id': user_id, 'product_id': product_id, 'amount': amount, 'expires_at': datetime.utcnow()+timedelta(seconds=self.app.config['HOLD_DURATION'])})
+            else:
+                released.append(product_id)
+
+        if changes:
+            db.session.connection().execute(update(Product).where(Product.id==bindparam('product_id_value')).values(held=Product.held+bindparam('delta')), changes)
+        upsert(db.session, StockHold.__table__, rows, ['user_id', 'product_id'], lambda excluded: {'amount': excluded.amount, 'expires_at': excluded.expires_at})
+        if released:
+            db.session.execute(delete(StockHold).where(StockHold.user_id==user_id, StockHold.product_id.in_(released)))
+        db.session.commit()
+        if crossed:
+            self._sold_out_changed()
+        if rows:
+            self._start_sweeper()
+
+    def release(self, user_id, product_ids):
+        self.hold(user_id, {product_id: 0 for product_id in product_ids})
+
+    def expire(self, now=None):
+        # Releases every hold that expired by now in one transaction, returns the number of holds released.
+        expired = StockHold.expires_at<=(now or datetime.utcnow())
+        product_ids = db.session.scalars(select(StockHold.product_id).where(expired).distinct()).all()
+        if not product_ids:
+            db.session.rollback()
+            return 0
+        products = lock_products(product_ids)
+        # Read after taking the locks, so holds changed in the meantime are released with their current amounts.
+        amounts = dict(db.session.execute(select(StockHold.product_id, func.sum(StockHold.amount)).where(expired, StockHold.product_id.in_(product_ids)).group_by(StockHold.product_id)).all())
+        if amounts:
+            db.session.connection().execute(update(Product).where(Product.id==bindparam('product_id_value')).values(held=Product.held-bindparam('released')),
+                                            [{'product_id_value': product_id, 'released': amount} for product_id, amount in amounts.items()])
+        count = db.session.execute(delete(StockHold).where(expired, StockHold.product_id.in_(product_ids))).rowcount
+        db.session.commit()
+        if any(product.stock-product.held<=0<product.stock-product.held+amounts.get(product.id, 0) for product in products):
+            self._sold_out_changed()
+        return count
+
+    def _sold_out_changed(self):
+        # Cached catalog pages are only refreshed when a product sells out or comes back, holds come and go with every
+        # click and bumping the version for each of them would leave nothing cached. The counts shown on cached
+        # pages may lag by up to PAGE_CACHE_TTL seconds, the holds themselves are always checked against the database.
+        if self.page_cache is not None:
+            self.page_cache.bump()
+
+    def _start_sweeper(self):
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='hold-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.app.config['HOLD_SWEEP_INTERVAL'])
+            try:
+                with self.app.app_context():
+                    self.expire()
+            except Exception:
+                self.app.logger.exception('Releasing expired stock holds failed.')
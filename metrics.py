@@ -0,0 +1,173 @@
+import cProfile
+import io
+import pstats
+import threading
+import time
+from flask import Response, current_app, g, has_request_context, request, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Performance instrumentation.
+# Request latency, SQL statements, template rendering, bcrypt and image processing are recorded in histograms and
+# counters kept in this process, and served in the Prometheus text format at /metrics. With several worker processes
+# every process reports its own numbers, Prometheus adds them up when they are scraped as separate targets.
+# Setting PROFILE_TOKEN turns on profiling single requests: a request carrying an X-Profile header with that token gets
+# the cProfile statistics of its view back instead of the page.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]+[f'{name}="{value}"' for name, value in extra]
+    return '{'+','.join(pairs)+'}' if pairs else ''
+
+class Counter():
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {} # label values -> count
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0)+amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, labels)} {value}')
+        return lines
+
+class Histogram():
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._values = {} # label values -> ([count per bucket], sum, count)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *labels):
+        with self._lock:
+            counts, total, count = self._values.get(labels) or ([0]*len(self.buckets), 0.0, 0)
+            for index, bound in enumerate(self.buckets):
+                if seconds<=bound:
+                    counts[index] += 1
+                    break
+            self._values[labels] = (counts, total+seconds, count+1)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket in zip(self.buckets, counts):
+                    cumulative += bucket
+                    lines.append(f'{self.name}_bucket{_format_labels(self.labels, labels, [("le", bound)])} {cumulative}')
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, labels, [("le", "+Inf")])} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, labels)} {total}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, labels)} {count}')
+        return lines
+
+REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'Time spent handling a request.', ('endpoint', 'method'))
+REQUESTS = Counter('http_requests_total', 'Requests handled.', ('endpoint', 'method', 'status'))
+SQL_SECONDS = Histogram('db_query_duration_seconds', 'Time spent executing a SQL statement.', ('endpoint',), QUERY_BUCKETS)
+REQUEST_QUERIES = Histogram('db_queries_per_request', 'SQL statements executed per request.', ('endpoint',), (1, 2, 3, 5, 8, 13, 21, 34, 55, 100))
+TEMPLATE_SECONDS = Histogram('template_render_duration_seconds', 'Time spent rendering a template.', ('template',))
+BCRYPT_SECONDS = Histogram('bcrypt_duration_seconds', 'Time spent hashing or checking a password, not counting the queue.', ('operation',))
+IMAGE_SECONDS = Histogram('image_processing_duration_seconds', 'Time from an image upload to its variants being ready.', (), (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0))
+
+METRICS = (REQUEST_SECONDS, REQUESTS, SQL_SECONDS, REQUEST_QUERIES, TEMPLATE_SECONDS, BCRYPT_SECONDS, IMAGE_SECONDS)
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines)+'\n'
+
+def _endpoint():
+    if not has_request_context():
+        return 'background'
+    return request.url_rule.endpoint if request.url_rule else 'unmatched'
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info['query_started'] = time.perf_counter()
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _end_query(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('query_started', None)
+    if started is not None:
+        SQL_SECONDS.observe(time.perf_counter()-started, _endpoint())
+
+@event.listens_for(Engine, 'handle_error')
+def _failed_query(exception_context):
+    # after_cursor_execute doesn't run when a statement raises, the failed statement's time is recorded here instead.
+    conn = exception_context.connection
+    started = conn.info.pop('query_started', None) if conn is not None else None
+    if started is not None:
+        SQL_SECONDS.observe(time.perf_counter()-started, _endpoint())
+
+class Metrics():
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_PATH', '/metrics')
+        app.config.setdefault('PROFILE_TOKEN', None) # Profiling through the X-Profile header is off unless set.
+        app.config.setdefault('PROFILE_STATS_LINES', 40)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.add_url_rule(app.config['METRICS_PATH'], 'metrics', self.metrics_view)
+
+    def metrics_view(self):
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+    def _before_request(self):
+        g.request_started = time.perf_counter()
+        g.request_queries = g.get('query_count', 0)
+        token = current_app.config['PROFILE_TOKEN']
+        if token and request.headers.get('X-Profile')==token:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    def _after_request(self, response):
+        g.response_status = response.status_code
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+        profiler.disable()
+        output = io.StringIO()
+        stats = pstats.Stats(profiler, stream=output).sort_stats('cumulative')
+        stats.print_stats(current_app.config['PROFILE_STATS_LINES'])
+        elapsed = time.perf_counter()-g.request_started
+        return Response(f'{request.method} {request.full_path} -> {response.status} in {elapsed*1000:.1f} ms\n\n{output.getvalue()}', mimetype='text/plain')
+
+    def _teardown_request(self, error):
+        profiler = g.pop('profiler', None)
+        if profiler is not None: # The view raised before after_request could stop it.
+            profiler.disable()
+        started = g.get('request_started')
+        if started is None:
+            return
+        endpoint = _endpoint()
+        REQUEST_SECONDS.observe(time.perf_counter()-started, endpoint, request.method)
+        REQUESTS.inc(endpoint, request.method, g.get('response_status', 500))
+        REQUEST_QUERIES.observe(g.get('query_count', 0)-g.request_queries, endpoint)
+
+    def _before_render(self, app, template, context):
+        g.setdefault('render_started', []).append(time.perf_counter())
+
+    def _after_render(self, app, template, context):
+        started = g.get('render_started')
+        if started:
+            TEMPLATE_SECONDS.observe(time.perf_counter()-started.pop(), template.name or 'string')
@@ -0,0 +1,71 @@
+"""Baseline schema: users, products, carts and transaction history
+
+Revision ID: 0001
+Revises: 
+Create Date: 2026-10-18 09:00:00
+
+Databases created with db.create_all() before migrations existed have
+exactly this schema, mark them with `flask --app app db stamp 0001` and
+then run `flask --app app db upgrade`.
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('username', sa.String(length=32), nullable=False),
+        sa.Column('email', sa.String(length=100), nullable=False),
+        sa.Column('password', sa.String(length=1000), nullable=False),
+        sa.Column('role', sa.String(length=1000), nullable=True),
+        sa.Column('balance', sa.Integer(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('email'),
+        sa.UniqueConstraint('username')
+    )
+    op.create_table('product',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=32), nullable=False),
+        sa.Column('desc', sa.String(length=1000), nullable=False),
+        sa.Column('price', sa.Integer(), nullable=False),
+        sa.Column('stock', sa.Integer(), nullable=False),
+        sa.Column('category', sa.String(length=32), nullable=False),
+        sa.Column('image', sa.String(length=32), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name')
+    )
+    op.create_table('cart',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('product_id', sa.Integer(), nullable=True),
+        sa.Column('amount', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id']),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('transaction_history',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('amount', sa.Integer(), nullable=False),
+        sa.Column('total', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id'], name='fk_transactionhistory_product'),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], name='fk_transactionhistory_user'),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('transaction_history')
+    op.drop_table('cart')
+    op.drop_table('product')
+    op.drop_table('user')
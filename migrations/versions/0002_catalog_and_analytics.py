@@ -0,0 +1,114 @@
+"""Catalog indexes, soft delete, cascades, transaction timestamps and sales aggregates
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:10:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+# SQLite doesn't name the foreign keys it reflects, batch mode names them with this convention so they can be dropped.
+NAMING_CONVENTION = {'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'}
+
+
+def _cart_product_fk():
+    for foreign_key in sa.inspect(op.get_bind()).get_foreign_keys('cart'):
+        if foreign_key['constrained_columns']==['product_id']:
+            return foreign_key['name'] or 'fk_cart_product_id_product'
+    return None
+
+
+def upgrade():
+    op.create_table('category_sales',
+        sa.Column('category', sa.String(length=32), nullable=False),
+        sa.Column('units', sa.Integer(), nullable=False),
+        sa.Column('revenue', sa.Integer(), nullable=False),
+        sa.Column('orders', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('category')
+    )
+    op.create_table('daily_sales',
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('units', sa.Integer(), nullable=False),
+        sa.Column('revenue', sa.Integer(), nullable=False),
+        sa.Column('orders', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('day')
+    )
+    op.create_table('product_sales',
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('units', sa.Integer(), nullable=False),
+        sa.Column('revenue', sa.Integer(), nullable=False),
+        sa.Column('orders', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('product_id')
+    )
+    op.create_index('ix_productsales_revenue', 'product_sales', ['revenue'], unique=False)
+    op.create_index('ix_productsales_units', 'product_sales', ['units'], unique=False)
+    op.create_table('user_sales',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('units', sa.Integer(), nullable=False),
+        sa.Column('revenue', sa.Integer(), nullable=False),
+        sa.Column('orders', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('user_id')
+    )
+    op.create_index('ix_usersales_revenue', 'user_sales', ['revenue'], unique=False)
+
+    # A product appears at most once per cart, older duplicate lines are dropped before the constraint is added.
+    op.execute('DELETE FROM cart WHERE id NOT IN (SELECT id FROM (SELECT max(id) AS id FROM cart GROUP BY user_id, product_id) AS latest)')
+    fk_name = _cart_product_fk()
+    with op.batch_alter_table('cart', naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.create_unique_constraint('uq_cart_user_product', ['user_id', 'product_id'])
+        if fk_name:
+            batch_op.drop_constraint(fk_name, type_='foreignkey')
+        batch_op.create_foreign_key('fk_cart_product_id_product', 'product', ['product_id'], ['id'], ondelete='CASCADE')
+
+    # Plain ALTER statements, a batch would recreate the product table on SQLite and drop the full-text index triggers.
+    op.add_column('product', sa.Column('archived', sa.Boolean(), server_default=sa.false(), nullable=False))
+    op.create_index('ix_product_category_id', 'product', ['category', 'id'], unique=False)
+    op.create_index('ix_product_category_price_id', 'product', ['category', 'price', 'id'], unique=False)
+    op.create_index('ix_product_category_stock_id', 'product', ['category', 'stock', 'id'], unique=False)
+    op.create_index('ix_product_price_id', 'product', ['price', 'id'], unique=False)
+    op.create_index('ix_product_stock_id', 'product', ['stock', 'id'], unique=False)
+
+    # Existing transactions get the time of the migration, there is no better record of when they happened.
+    with op.batch_alter_table('transaction_history') as batch_op:
+        batch_op.add_column(sa.Column('created_at', sa.DateTime(), server_default=sa.func.current_timestamp(), nullable=False))
+        batch_op.create_index('ix_transactionhistory_user_created', ['user_id', 'created_at', 'id'], unique=False)
+        batch_op.drop_constraint('fk_transactionhistory_product', type_='foreignkey')
+        batch_op.create_foreign_key('fk_transactionhistory_product', 'product', ['product_id'], ['id'], ondelete='CASCADE')
+
+
+def downgrade():
+    with op.batch_alter_table('transaction_history') as batch_op:
+        batch_op.drop_constraint('fk_transactionhistory_product', type_='foreignkey')
+        batch_op.create_foreign_key('fk_transactionhistory_product', 'product', ['product_id'], ['id'])
+        batch_op.drop_index('ix_transactionhistory_user_created')
+        batch_op.drop_column('created_at')
+
+    op.drop_index('ix_product_stock_id', table_name='product')
+    op.drop_index('ix_product_price_id', table_name='product')
+    op.drop_index('ix_product_category_stock_id', table_name='product')
+    op.drop_index('ix_product_category_price_id', table_name='product')
+    op.drop_index('ix_product_category_id', table_name='product')
+    op.drop_column('product', 'archived')
+
+    with op.batch_alter_table('cart') as batch_op:
+        batch_op.drop_constraint('fk_cart_product_id_product', type_='foreignkey')
+        batch_op.create_foreign_key('fk_cart_product_id_product', 'product', ['product_id'], ['id'])
+        batch_op.drop_constraint('uq_cart_user_product', type_='unique')
+
+    op.drop_index('ix_usersales_revenue', table_name='user_sales')
+    op.drop_table('user_sales')
+    op.drop_index('ix_productsales_units', table_name='product_sales')
+    op.drop_index('ix_productsales_revenue', table_name='product_sales')
+    op.drop_table('product_sales')
+    op.drop_table('daily_sales')
+    op.drop_table('category_sales')
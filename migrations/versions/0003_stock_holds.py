@@ -0,0 +1,36 @@
+"""Stock holds for carts
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 09:20:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('product', sa.Column('held', sa.Integer(), server_default='0', nullable=False))
+    op.create_table('stock_hold',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('product_id', sa.Integer(), nullable=False),
+        sa.Column('amount', sa.Integer(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.PrimaryKeyConstraint('user_id', 'product_id')
+    )
+    op.create_index('ix_stock_hold_expires_at', 'stock_hold', ['expires_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_stock_hold_expires_at', table_name='stock_hold')
+    op.drop_table('stock_hold')
+    op.drop_column('product', 'held')
@@ -0,0 +1,57 @@
+"""Stock and held can't go negative
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 14:10:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+# Adding the checks recreates the product table on SQLite, which drops the triggers keeping the full-text index
+# (search.py) in sync. They are restored as search.FTS_STATEMENTS had them when this revision was written.
+FTS_TRIGGERS = [
+    """CREATE TRIGGER IF NOT EXISTS product_fts_ai AFTER INSERT ON product BEGIN
+        INSERT INTO product_fts(rowid, name, "desc", category) VALUES (new.id, new.name, new."desc", new.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_ad AFTER DELETE ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, "desc", category) VALUES ('delete', old.id, old.name, old."desc", old.category);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS product_fts_au AFTER UPDATE OF name, "desc", category ON product BEGIN
+        INSERT INTO product_fts(product_fts, rowid, name, "desc", category) VALUES ('delete', old.id, old.name, old."desc", old.category);
+        INSERT INTO product_fts(rowid, name, "desc", category) VALUES (new.id, new.name, new."desc", new.category);
+    END""",
+]
+
+
+def _restore_fts_triggers():
+    bind = op.get_bind()
+    if bind.dialect.name!='sqlite':
+        return
+    if bind.execute(sa.text("SELECT 1 FROM sqlite_master WHERE type='table' AND name='product_fts'")).first():
+        for statement in FTS_TRIGGERS:
+            op.execute(statement)
+
+
+def upgrade():
+    # Rows oversold before the checks existed would fail them.
+    op.execute('UPDATE product SET stock = 0 WHERE stock < 0')
+    op.execute('UPDATE product SET held = 0 WHERE held < 0')
+    with op.batch_alter_table('product', recreate='always') as batch_op:
+        batch_op.create_check_constraint('ck_product_stock', 'stock>=0')
+        batch_op.create_check_constraint('ck_product_held', 'held>=0')
+    _restore_fts_triggers()
+
+
+def downgrade():
+    with op.batch_alter_table('product', recreate='always') as batch_op:
+        batch_op.drop_constraint('ck_product_held', type_='check')
+        batch_op.drop_constraint('ck_product_stock', type_='check')
+    _restore_fts_triggers()
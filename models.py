@@ -1,7 +1,9 @@
+from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from database import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
@@ -23,20 +25,94 @@ class Product(db.Model):
     stock = db.Column(db.Integer, nullable=False)
     category = db.Column(db.String(32), nullable=False)
     image = db.Column(db.String(32), default='default.png')
+    archived = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false()) # Soft deleted, hidden from the shop but kept for the history.
+    held = db.Column(db.Integer, nullable=False, default=0, server_default='0') # Units reserved by cart holds, the sum of its StockHold amounts.
 
-    # One to many relationships
-    carts = db.relationship('Cart', backref='product')
-    transactions = db.relationship('TransactionHistory', backref='product')
+    # One to many relationships, the rows are removed by the database (ON DELETE CASCADE) rather than loaded and deleted one by one.
+    carts = db.relationship('Cart', backref='product', passive_deletes=True)
+    transactions = db.relationship('TransactionHistory', backref='product', passive_deletes=True)
+
+    # Composite indexes matching the keyset pagination sort keys of the catalog listing, with and without a category filter.
+    __table_args__ = (
+        db.Index('ix_product_category_id', 'category', 'id'),
+        db.Index('ix_product_price_id', 'price', 'id'),
+        db.Index('ix_product_category_price_id', 'category', 'price', 'id'),
+        db.Index('ix_product_stock_id', 'stock', 'id'),
+        db.Index('ix_product_category_stock_id', 'category', 'stock', 'id'),
+        db.CheckConstraint('stock>=0', name='ck_product_stock'),
+        db.CheckConstraint('held>=0', name='ck_product_held'),
+    )
+
+    @property
+    def available(self):
+        return self.stock-self.held
 
 class Cart(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'))
     amount = db.Column(db.Integer, default=1)
 
+    # A product appears at most once in a user's cart, changing the quantity is an upsert on this key.
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'product_id', name='uq_cart_user_product'),
+    )
+
+# Stock reserved for a user's cart until expires_at, the amounts are also counted in Product.held.
+class StockHold(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), primary_key=True)
+    amount = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
 class TransactionHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id', name='fk_transactionhistory_user'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id', name='fk_transactionhistory_product'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', name='fk_transactionhistory_product', ondelete='CASCADE'), nullable=False)
     amount = db.Column(db.Integer, nullable=False)
-    total = db.Column(db.Integer, nullable=False)
\ No newline at end of file
+    total = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, server_default=db.func.current_timestamp())
+
+    # A user's history is always read newest first and by date range.
+    __table_args__ = (
+        db.Index('ix_transactionhistory_user_created', 'user_id', 'created_at', 'id'),
+    )
+
+# Sales aggregates, incremented inside the purchase transaction so the admin dashboard never has to scan the history.
+
+class ProductSales(db.Model):
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+
+    product = db.relationship('Product')
+
+    __table_args__ = (
+        db.Index('ix_productsales_revenue', 'revenue'),
+        db.Index('ix_productsales_units', 'units'),
+    )
+
+class CategorySales(db.Model):
+    category = db.Column(db.String(32), primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+
+class DailySales(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+
+class UserSales(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+
+    user = db.relationship('User')
+
+    __table_args__ = (
+        db.Index('ix_usersales_revenue', 'revenue'),
+    )
\ No newline at end of file
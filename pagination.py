@@ -0,0 +1,83 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+from models import Product
+
+# Keyset (cursor) pagination.
+# Instead of OFFSET, every page starts right after the sort key of the last row of the previous page, so the
+# database seeks straight into an index and the cost of a page doesn't depend on how deep the visitor has scrolled.
+# The sort key always ends with the primary key, which makes it unique and the page boundaries stable.
+
+# Sort option -> (sort columns, descending, label shown in the templates)
+PRODUCT_SORTS = {
+    'newest': ((Product.id,), True, 'Newest'),
+    'price_asc': ((Product.price, Product.id), False, 'Price: Low to High'),
+    'price_desc': ((Product.price, Product.id), True, 'Price: High to Low'),
+    'stock': ((Product.stock, Product.id), True, 'Most in Stock'),
+}
+
+def _dump(value):
+    return {'dt': value.isoformat()} if isinstance(value, datetime) else value
+
+def _load(value):
+    # Only what _dump produces: a scalar sort key or {'dt': <ISO datetime>}, anything else raises ValueError.
+    if isinstance(value, dict):
+        if list(value)!=['dt'] or not isinstance(value['dt'], str):
+            raise ValueError('Not a cursor value.')
+        return datetime.fromisoformat(value['dt'])
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError('Not a cursor value.')
+    return value
+
+def encode_cursor(values):
+    values = [_dump(value) for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, length):
+    # Returns None for anything that isn't a cursor we issued, callers then start from the first page.
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor+'='*(-len(cursor)%4)))
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(values, list) or len(values)!=length:
+        return None
+    try:
+        return [_load(value) for value in values]
+    except (KeyError, TypeError, ValueError):
+        return None
+
+class KeysetPage():
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+def keyset_paginate(query, columns, *, descending=False, after=None, per_page=12):
+    values = decode_cursor(after, len(columns)) if after else None
+    key = tuple_(*columns)
+    if values:
+        query = query.filter(key<tuple(values) if descending else key>tuple(values))
+    query = query.order_by(*[column.desc() if descending else column.asc() for column in columns])
+
+    # Fetching one extra row tells us whether there is a next page without counting the whole table.
+    rows = query.limit(per_page+1).all()
+    items = rows[:per_page]
+    next_cursor = None
+    if len(rows)>per_page:
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, column.key) for column in columns])
+    return KeysetPage(items, next_cursor)
+
+def paginate_products(*, category=None, sort='newest', after=None, per_page=12, include_archived=False):
+    columns, descending, _ = PRODUCT_SORTS.get(sort, PRODUCT_SORTS['newest'])
+    query = Product.query
+    if not include_archived:
+        query = query.filter(Product.archived==False)
+    if category:
+        query = query.filter(Product.category==category)
+    return keyset_paginate(query, columns, descending=descending, after=after, per_page=per_page)
@@ -0,0 +1,36 @@
+from functools import wraps
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Request-scoped SQL query counter.
+# Every statement executed while a request is being handled is counted in flask.g. Views declare how many queries
+# they are expected to need with @query_budget; going over it is logged, and raises when QUERY_BUDGET_ENFORCE is set
+# (meant for the test suite) so that an N+1 regression fails loudly instead of silently slowing the page down.
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get('query_count', 0)+1
+
+def get_query_count():
+    return g.get('query_count', 0)
+
+def query_budget(limit):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            start = get_query_count()
+            response = view(*args, **kwargs)
+            used = get_query_count()-start
+            if used>limit:
+                message = f'{request.endpoint} ran {used} queries, its budget is {limit}.'
+                if current_app.config.get('QUERY_BUDGET_ENFORCE'):
+                    raise QueryBudgetExceeded(message)
+                current_app.logger.warning(message)
+            return response
+        return wrapper
+    return decorator
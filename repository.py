@@ -0,0 +1,28 @@
+from sqlalchemy.orm import joinedload
+from models import Cart, TransactionHistory
+from pagination import keyset_paginate
+
+# Query layer for the user's cart and purchase history.
+# The views and templates read the product of every line item, so the products are joined into the same SELECT
+# instead of being lazy loaded one row at a time.
+
+def get_carts(user_id):
+    return Cart.query.options(joinedload(Cart.product)).filter_by(user_id=user_id).order_by(Cart.id).all()
+
+def filter_transactions(query, *, start=None, end=None):
+    # start and end are datetimes, start inclusive and end exclusive.
+    if start:
+        query = query.filter(TransactionHistory.created_at>=start)
+    if end:
+        query = query.filter(TransactionHistory.created_at<end)
+    return query
+
+def get_recent_transactions(user_id, limit=10):
+    query = TransactionHistory.query.options(joinedload(TransactionHistory.product)).filter_by(user_id=user_id)
+    return query.order_by(TransactionHistory.created_at.desc(), TransactionHistory.id.desc()).limit(limit).all()
+
+def paginate_transactions(user_id, *, start=None, end=None, after=None, per_page=25):
+    # Newest first, keyset paginated on the (user_id, created_at, id) index.
+    query = TransactionHistory.query.options(joinedload(TransactionHistory.product)).filter_by(user_id=user_id)
+    query = filter_transactions(query, start=start, end=end)
+    return keyset_paginate(query, (TransactionHistory.created_at, TransactionHistory.id), descending=True, after=after, per_page=per_page)
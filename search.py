@@ -0,0 +1,176 @@
+import math
+import re
+from collections import namedtuple
+from sqlalchemy import DDL, and_, event, func, literal_column, or_, select, text
+from models import db, Product
+from caching import TTLCache
+
+# Full-text index over the product catalog.
+# On SQLite the index is an FTS5 table using the product table as external content. Triggers keep it in sync,
+# so every write path (ORM flushes in the admin views as well as bulk statements) updates the index without the
+# views having to remember to do it.
+
+FTS_TABLE = 'product_fts'
+
+FTS_STATEMENTS = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, "desc", category,
+        content='product', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON product BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, "desc", category) VALUES (new.id, new.name, new."desc", new.category);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, "desc", category) VALUES ('delete', old.id, old.name, old."desc", old.category);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, "desc", category ON product BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, "desc", category) VALUES ('delete', old.id, old.name, old."desc", old.category);
+        INSERT INTO {FTS_TABLE}(rowid, name, "desc", category) VALUES (new.id, new.name, new."desc", new.category);
+    END""",
+]
+
+# Column weights for bm25(): a hit in the name counts the most, then the category, then the description.
+RANK = f'bm25({FTS_TABLE}, 10.0, 1.0, 5.0)'
+
+SEARCH_QUERY = f"""
+    WITH hits AS (
+        SELECT rowid AS product_id, {RANK} AS rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :query
+    )
+    SELECT product.*, count(*) OVER () AS total_hits
+    FROM hits JOIN product ON product.id = hits.product_id
+    WHERE NOT product.archived
+    ORDER BY hits.rank, product.id
+    LIMIT :limit OFFSET :offset
+"""
+
+# Only needed for pages past the last one, which come back empty and so without total_hits.
+COUNT_QUERY = f"""
+    SELECT count(*) FROM {FTS_TABLE} JOIN product ON product.id = {FTS_TABLE}.rowid
+    WHERE {FTS_TABLE} MATCH :query AND NOT product.archived
+"""
+
+# Creating the index together with the product table when db.create_all() runs.
+for statement in FTS_STATEMENTS:
+    event.listen(Product.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Product.__table__, 'before_drop', DDL(f'DROP TABLE IF EXISTS {FTS_TABLE}').execute_if(dialect='sqlite'))
+
+_indexed_engines = set()
+
+def ensure_index():
+    # Databases created before the index existed get it on first use, populated from the current catalog.
+    engine = db.engine
+    if engine.url in _indexed_engines or engine.dialect.name!='sqlite':
+        return
+    with engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type='table' AND name=:name"), {'name': FTS_TABLE}).first()
+        if not exists:
+            for statement in FTS_STATEMENTS:
+                conn.execute(text(statement))
+            conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    _indexed_engines.add(engine.url)
+
+def build_match_query(term):
+    # Every word of the search term becomes a quoted prefix query, so user input can never be parsed as FTS syntax.
+    tokens = re.findall(r'\w+', term.lower())
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+def normalize_term(term):
+    # Searches that differ only in case, punctuation, word order or repeated words match the same products.
+    return ' '.join(sorted(set(re.findall(r'\w+', term.lower()))))
+
+class SearchResults():
+    def __init__(self, items, total, page, per_page):
+        self.items = items
+        self.total = total
+        self.page = page
+        self.per_page = per_page
+
+    @property
+    def pages(self):
+        return math.ceil(self.total/self.per_page) if self.total else 0
+
+    @property
+    def has_prev(self):
+        return self.page>1
+
+    @property
+    def has_next(self):
+        return self.page<self.pages
+
+    @property
+    def prev_num(self):
+        # From past the last page straight back to the last one.
+        return min(self.page-1, max(self.pages, 1)) if self.has_prev else None
+
+    @property
+    def next_num(self):
+        return self.page+1 if self.has_next else None
+
+def search_products(term, *, page=1, per_page=12):
+    page = max(page, 1)
+    match_query = build_match_query(term)
+    if not match_query:
+        return SearchResults([], 0, page, per_page)
+
+    if db.engine.dialect.name!='sqlite':
+        return _search_products_like(term, page, per_page)
+
+    ensure_index()
+    # Products and the total hit count come back ranked in a single query.
+    statement = select(Product, literal_column('total_hits')).from_statement(text(SEARCH_QUERY))
+    rows = db.session.execute(statement, {'query': match_query, 'limit': per_page, 'offset': (page-1)*per_page}).all()
+    if rows:
+        total = rows[0].total_hits
+    else:
+        total = db.session.execute(text(COUNT_QUERY), {'query': match_query}).scalar() if page>1 else 0
+    return SearchResults([row.Product for row in rows], total, page, per_page)
+
+def _search_products_like(term, page, per_page):
+    # Fallback for server databases without FTS5: every word has to appear in one of the columns, name matches first.
+    tokens = re.findall(r'\w+', term.lower())
+    conditions = [or_(*[column.ilike(f'%{token}%') for column in (Product.name, Product.desc, Product.category)]) for token in tokens]
+    query = Product.query.filter(Product.archived==False, and_(*conditions))
+    total = query.order_by(None).with_entities(func.count(Product.id)).scalar()
+    name_hit = or_(*[Product.name.ilike(f'%{token}%') for token in tokens])
+    items = query.order_by(name_hit.desc(), Product.id).limit(per_page).offset((page-1)*per_page).all()
+    return SearchResults(items, total, page, per_page)
+
+class CachedProduct(namedtuple('CachedProduct', [column.key for column in Product.__table__.columns])):
+    # Read-only copy of a product's columns, safe to share between requests and threads.
+    __slots__ = ()
+
+    available = Product.available
+
+class SearchCache():
+    # Result cache shared by every visitor, logged in or not.
+    # Pages of search results are kept under the normalized term and the current catalog version of the page cache,
+    # so a popular search is answered from memory without a query, and whenever products or stock change (the views
+    # bump the version) the old entries simply age out. The products are stored as CachedProduct tuples rather than
+    # ORM instances, which belong to the session of the request that loaded them.
+
+    def __init__(self, app=None, page_cache=None):
+        self.page_cache = page_cache
+        self.backend = None
+        if app is not None:
+            self.init_app(app, page_cache)
+
+    def init_app(self, app, page_cache):
+        app.config.setdefault('SEARCH_CACHE_SIZE', 1024)
+        app.config.setdefault('SEARCH_CACHE_TTL', 120) # Seconds
+        self.page_cache = page_cache
+        self.backend = TTLCache(maxsize=app.config['SEARCH_CACHE_SIZE'], ttl=app.config['SEARCH_CACHE_TTL'])
+
+    def search(self, term, *, page=1, per_page=12):
+        page = max(page, 1)
+        normalized = normalize_term(term)
+        if not normalized:
+            return SearchResults([], 0, page, per_page)
+        key = ('search', self.page_cache.version(), normalized, page, per_page)
+        cached = self.backend.get(key)
+        if cached is None:
+            results = search_products(normalized, page=page, per_page=per_page)
+            cached = ([CachedProduct(*(getattr(product, field) for field in CachedProduct._fields)) for product in results.items], results.total)
+            self.backend.set(key, cached)
+        items, total = cached
+        return SearchResults(items, total, page, per_page)
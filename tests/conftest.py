@@ -0,0 +1,89 @@
+import os
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+import pytest
+from sqlalchemy import event
+
+# The app reads DATABASE_URL when it is imported. Tests run against a SQLite file, not :memory:, so that concurrent
+# requests in threads use separate connections and really contend for the database like worker processes do.
+os.environ['DATABASE_URL'] = 'sqlite:///'+os.path.join(tempfile.mkdtemp(), 'test.sqlite')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app, bcrypt, login_throttle, page_cache, search_cache, suggestions, user_cache
+from models import db, User, Product
+
+@pytest.fixture
+def app():
+    # Test users are hashed with 4 rounds, logging in doesn't upgrade them to the production cost.
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False, QUERY_BUDGET_ENFORCE=True, BCRYPT_LOG_ROUNDS=4)
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+    page_cache.backend.clear()
+    search_cache.backend.clear()
+    user_cache.cache.clear()
+    login_throttle._attempts.clear()
+    suggestions._reset()
+    suggestions._built = 0.0
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def add_user(username, balance=10000, role='user'):
+    user = User(username=username, email=f'{username}@example.com', password=bcrypt.generate_password_hash('password', 4).decode(), role=role, balance=balance)
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+def add_product(name, stock=10, price=20, category='Games'):
+    product = Product(name=name, desc=f'{name} description', price=price, stock=stock, category=category)
+    db.session.add(product)
+    db.session.commit()
+    return product.id
+
+def login(client, username):
+    response = client.post('/login', data={'username': username, 'pw': 'password'})
+    assert response.status_code==302
+    return client
+
+def run_concurrently(app, *targets):
+    # Runs every target in its own thread with its own app context (and so its own session), returns what each one
+    # returned or raised.
+    results = [None]*len(targets)
+    def run(index, target):
+        with app.app_context():
+            try:
+                results[index] = target()
+            except Exception as error:
+                results[index] = error
+            finally:
+                db.session.remove()
+    threads = [threading.Thread(target=run, args=(index, target)) for index, target in enumerate(targets)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+@contextmanager
+def rendezvous(marker, parties=2, timeout=1.0):
+    # The first statements containing marker wait for each other, so concurrent transactions are forced to interleave
+    # right after that point. A transaction that can't get there because it waits for a lock lets the others go on
+    # once the timeout breaks the barrier.
+    barrier = threading.Barrier(parties, timeout=timeout)
+    def wait(conn, cursor, statement, parameters, context, executemany):
+        if marker in statement:
+            try:
+                barrier.wait()
+            except threading.BrokenBarrierError:
+                pass
+    event.listen(db.engine, 'after_cursor_execute', wait)
+    try:
+        yield
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', wait)
@@ -0,0 +1,64 @@
+from datetime import date, timedelta
+from sqlalchemy import select
+from analytics import AGGREGATES, get_dashboard, rebuild
+from app import cart_store
+from catalog import delete_product
+from checkout import purchase_cart, purchase_item
+from models import db, DailySales
+from conftest import add_product, add_user, login
+
+def test_dashboard_limits_are_clamped(app, client):
+    alice = add_user('alice')
+    add_user('admin', role='admin')
+    for number in range(3):
+        purchase_item(alice, add_product(f'Game {number}'), 1)
+    for days_back in (200, 400):
+        db.session.add(DailySales(day=date.today()-timedelta(days=days_back), units=1, revenue=10, orders=1))
+    db.session.commit()
+    login(client, 'admin')
+    assert len(client.get('/admin/analytics?top=-1').json['products'])==1
+    assert len(client.get('/admin/analytics?top=2').json['products'])==2
+    assert [row['day'] for row in client.get('/admin/analytics?days=-5').json['days']]==[date.today().isoformat()]
+    assert len(client.get(f'/admin/analytics?days={10**6}').json['days'])==2 # A year back at most.
+
+def aggregates():
+    db.session.expire_all()
+    return {model.__name__: sorted(tuple(getattr(row, column) for column in (key, 'units', 'revenue', 'orders')) for row in db.session.scalars(select(model))) for model, key in AGGREGATES}
+
+def test_running_totals_match_a_rebuild_and_count_purchases(app):
+    alice, bob = add_user('alice'), add_user('bob')
+    chess, go = add_product('Chess', price=20), add_product('Go', price=30)
+    lamp = add_product('Lamp', price=15, category='Home')
+    for product_id, amount in ((chess, 2), (go, 1), (lamp, 3)):
+        cart_store.set_quantity(alice, product_id, amount)
+    purchase_cart(alice)
+    purchase_item(alice, chess, 1)
+    purchase_item(bob, lamp, 2)
+
+    recorded = aggregates()
+    rebuild()
+    assert aggregates()==recorded
+    today = date.today()
+    assert recorded['DailySales']==[(today, 9, 165, 3)]
+    assert recorded['UserSales']==[(alice, 7, 135, 2), (bob, 2, 30, 1)]
+    assert recorded['CategorySales']==[('Games', 4, 90, 2), ('Home', 5, 75, 2)]
+    assert recorded['ProductSales']==[(chess, 3, 60, 2), (go, 1, 30, 1), (lamp, 5, 75, 2)]
+    assert (get_dashboard()['units'], get_dashboard()['revenue'], get_dashboard()['orders'])==(9, 165, 3)
+
+def test_deleting_a_product_takes_its_sales_out_of_the_totals(app):
+    alice, bob = add_user('alice'), add_user('bob')
+    chess, go = add_product('Chess', price=20), add_product('Go', price=30)
+    lamp = add_product('Lamp', price=15, category='Books')
+    for product_id, amount in ((chess, 2), (go, 1), (lamp, 3)):
+        cart_store.set_quantity(alice, product_id, amount)
+    purchase_cart(alice)
+    purchase_item(alice, chess, 1)
+    purchase_item(bob, chess, 2)
+    purchase_item(bob, lamp, 2)
+
+    delete_product(chess)
+    remaining = aggregates()
+    rebuild()
+    assert aggregates()==remaining
+    assert remaining['UserSales']==[(alice, 4, 75, 1), (bob, 2, 30, 1)]
+    assert remaining['CategorySales']==[('Books', 5, 75, 2), ('Games', 1, 30, 1)]
@@ -0,0 +1,59 @@
+import pytest
+from conftest import add_product, add_user, login
+from models import db, User, Product
+
+@pytest.fixture
+def alice(app, client):
+    user_id = add_user('alice', balance=100)
+    login(client, 'alice')
+    return user_id
+
+def test_writes_need_a_login(client):
+    assert client.post('/api/v1/checkout', json={}).status_code==401
+    assert client.get('/api/v1/products').status_code==200
+
+@pytest.mark.parametrize('method, path', [('POST', '/api/v1/checkout'), ('PATCH', '/api/v1/cart')])
+def test_writes_must_be_json(client, alice, method, path):
+    # A plain form post, which any site can make with the session cookie, is turned away before it does anything.
+    product_id = add_product('Chess')
+    response = client.open(path, method=method, data={'product_id': product_id, 'items': product_id})
+    assert response.status_code==415 and response.json=={'error': 'Expected a JSON body.'}
+    assert db.session.get(Product, product_id).stock==10
+
+@pytest.mark.parametrize('body', [{'product_id': 'chess'}, {'product_id': 1, 'quantity': 'two'}, {'product_id': [1]}, {'product_id': 1, 'quantity': None}])
+def test_checkout_rejects_malformed_numbers(client, alice, body):
+    add_product('Chess')
+    response = client.post('/api/v1/checkout', json=body)
+    assert response.status_code==400 and response.json['error']=='product_id and quantity must be whole numbers.'
+
+@pytest.mark.parametrize('quantity', [0, -3])
+def test_checkout_rejects_quantities_below_one(client, alice, quantity):
+    product_id = add_product('Chess')
+    response = client.post('/api/v1/checkout', json={'product_id': product_id, 'quantity': quantity})
+    assert response.status_code==400 and response.json['error']=='Quantity must be at least 1.'
+    assert db.session.get(Product, product_id).stock==10 and db.session.get(User, alice).balance==100
+
+def test_checkout_status_codes(client, alice):
+    product_id = add_product('Chess', stock=2, price=30)
+    assert client.post('/api/v1/checkout', json={'product_id': product_id+1}).status_code==404
+    response = client.post('/api/v1/checkout', json={'product_id': product_id, 'quantity': 3})
+    assert response.status_code==409 and response.json['available']==2
+    response = client.post('/api/v1/checkout', json={'product_id': product_id, 'quantity': 2})
+    assert response.status_code==200 and response.json=={'total': 60, 'balance': 40}
+    add_product('Piano', price=500)
+    response = client.post('/api/v1/checkout', json={'product_id': product_id+1, 'quantity': 1})
+    assert response.status_code==402 and response.json['shortfall']==460
+    assert client.post('/api/v1/checkout', json={}).status_code==400
+
+def test_cart_update_validates_the_batch(client, alice):
+    product_id = add_product('Chess', stock=2)
+    assert client.patch('/api/v1/cart', json={'items': {}}).status_code==400
+    assert client.patch('/api/v1/cart', json={'items': {str(product_id): 'two'}}).status_code==400
+    response = client.patch('/api/v1/cart', json={'items': {str(product_id+1): 1}})
+    assert response.status_code==404 and response.json['product_ids']==[product_id+1]
+    assert client.patch('/api/v1/cart', json={'items': {str(product_id): 3}}).status_code==409
+    response = client.patch('/api/v1/cart', json={'items': {str(product_id): 2}})
+    assert response.status_code==200 and response.json['total']==40 and response.json['items'][0]['quantity']==2
+    response = client.post('/api/v1/checkout', json={})
+    assert response.status_code==200 and response.json['balance']==60
+    assert client.get('/api/v1/cart').json=={'items': [], 'total': 0}
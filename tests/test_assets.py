@@ -0,0 +1,86 @@
+import gzip
+import os
+from urllib.parse import parse_qs, urlsplit
+import pytest
+from flask import Flask
+from assets import Assets
+from images import variant_filename
+
+@pytest.fixture
+def static(tmp_path):
+    (tmp_path/'style.css').write_text('body { color: red; }')
+    (tmp_path/'images'/'products').mkdir(parents=True)
+    return tmp_path
+
+@pytest.fixture
+def assets_app(static):
+    app = Flask(__name__, static_folder=str(static))
+    app.config['SERVER_NAME'] = 'localhost'
+    return app, Assets(app)
+
+def fingerprinted_url(app, assets, filename):
+    with app.app_context():
+        return assets.asset_url(filename)
+
+def test_urls_carry_the_content_hash(assets_app, static):
+    app, assets = assets_app
+    url = fingerprinted_url(app, assets, 'style.css')
+    version = parse_qs(urlsplit(url).query)['v'][0]
+    assert urlsplit(url).path=='/assets/style.css' and len(version)==12
+    assert fingerprinted_url(app, assets, 'style.css')==url
+    # Replacing the file in place changes its URL.
+    (static/'style.css').write_text('body { color: blue; }')
+    os.utime(static/'style.css', ns=(1, 1))
+    assert fingerprinted_url(app, assets, 'style.css')!=url
+
+def test_fingerprinted_urls_are_immutable(assets_app):
+    app, assets = assets_app
+    client = app.test_client()
+    response = client.get(fingerprinted_url(app, assets, 'style.css'))
+    assert response.status_code==200 and response.data==b'body { color: red; }'
+    assert response.cache_control.public and response.cache_control.immutable
+    assert response.cache_control.max_age==app.config['ASSETS_IMMUTABLE_MAX_AGE']
+
+@pytest.mark.parametrize('query', ['', '?v=000000000000'])
+def test_stale_or_missing_fingerprints_are_revalidated(assets_app, query):
+    app, _ = assets_app
+    response = app.test_client().get('/assets/style.css'+query)
+    assert response.status_code==200 and not response.cache_control.immutable
+    assert response.cache_control.max_age==app.config['ASSETS_MAX_AGE']
+
+def test_processed_images_are_named_after_their_content(assets_app, static):
+    app, assets = assets_app
+    filename = variant_filename('0123456789abcdef', 'thumb', '.webp')
+    (static/'images'/'products'/filename).write_bytes(b'webp')
+    with app.app_context():
+        url = assets.product_image_url(variant_filename('0123456789abcdef'), variant='thumb', ext='.webp')
+    assert url.endswith('/assets/images/products/'+filename)
+    response = app.test_client().get(url)
+    assert response.status_code==200 and response.cache_control.immutable
+
+def test_precompressed_files_are_sent_to_clients_that_accept_them(assets_app, static):
+    app, assets = assets_app
+    (static/'style.css.gz').write_bytes(gzip.compress(b'body { color: red; }'))
+    client, url = app.test_client(), fingerprinted_url(app, assets, 'style.css')
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding']=='gzip' and response.mimetype=='text/css'
+    assert gzip.decompress(response.data)==b'body { color: red; }'
+    assert 'Accept-Encoding' in response.vary
+    response = client.get(url)
+    assert 'Content-Encoding' not in response.headers and response.data==b'body { color: red; }'
+
+def test_accel_redirect_leaves_the_body_to_the_web_server(assets_app):
+    app, _ = assets_app
+    app.config['ASSETS_ACCEL_REDIRECT'] = '/protected-static/'
+    client = app.test_client()
+    response = client.get('/assets/style.css')
+    assert response.status_code==200 and response.data==b''
+    assert response.headers['X-Accel-Redirect']=='/protected-static/style.css'
+    assert client.get('/assets/missing.css').status_code==404
+
+def test_paths_outside_the_static_folder_are_not_served(assets_app):
+    app, assets = assets_app
+    client = app.test_client()
+    assert client.get('/assets/../conftest.py').status_code==404
+    assert client.get('/assets/missing.css').status_code==404
+    assert fingerprinted_url(app, assets, 'missing.css')=='http://localhost/assets/missing.css'
@@ -0,0 +1,60 @@
+import pytest
+from app import suggestions
+from autocomplete import edit_distance
+from conftest import add_product, add_user, login
+from models import db, Product
+
+def names(result):
+    return [product['name'] for product in result['products']]
+
+@pytest.fixture
+def catalog(app):
+    return {name: add_product(name, category=category) for name, category in [('Chess Board', 'Games'), ('Chess Clock', 'Games'), ('Chessboard Puzzle', 'Books'), ('Checkers', 'Games'), ('Banana Bread', 'Food')]}
+
+def test_edit_distance_counts_transpositions_and_gives_up_past_the_limit():
+    assert edit_distance('chess', 'chses', 1)==1
+    assert edit_distance('chess', 'chase', 2)==2
+    assert edit_distance('chess', 'banana', 2)==3
+
+def test_prefixes_of_every_word_match(catalog):
+    assert sorted(names(suggestions.suggest('ches')))==['Chess Board', 'Chess Clock', 'Chessboard Puzzle']
+    assert names(suggestions.suggest('chess cl'))==['Chess Clock']
+    assert names(suggestions.suggest('bread ban'))==['Banana Bread']
+    # Categories are indexed too.
+    result = suggestions.suggest('food')
+    assert names(result)==['Banana Bread'] and result['categories']==['Food'] and not result['corrected']
+
+def test_misspelt_words_are_matched_within_a_few_edits(catalog):
+    result = suggestions.suggest('chses clock')
+    assert names(result)==['Chess Clock'] and result['corrected']
+    assert names(suggestions.suggest('banan'))==['Banana Bread']
+    assert names(suggestions.suggest('xylophone'))==[]
+    assert suggestions.correct('chess clcok')=='chess clock'
+    assert suggestions.correct('chess clock') is None
+
+def test_best_sellers_come_first(app, client, catalog):
+    add_user('alice')
+    login(client, 'alice')
+    for _ in range(3):
+        client.post(f'/product/buy/{catalog["Chess Clock"]}', data={'quantity': 1})
+    result = suggestions.suggest('chess', limit=2)
+    assert names(result)==['Chess Clock', 'Chess Board'] and result['products'][0]['sold']==3
+
+def test_committed_product_changes_are_picked_up(app, catalog):
+    assert names(suggestions.suggest('chess clock'))==['Chess Clock']
+    product = db.session.get(Product, catalog['Chess Clock'])
+    product.name = 'Chess Timer'
+    add_product('Chess Pieces')
+    assert names(suggestions.suggest('chess clock'))==[] and names(suggestions.suggest('chess timer'))==['Chess Timer']
+    assert names(suggestions.suggest('pieces'))==['Chess Pieces']
+    product.archived = True
+    db.session.rollback()
+    assert names(suggestions.suggest('chess timer'))==['Chess Timer']
+    product.archived = True
+    db.session.commit()
+    assert names(suggestions.suggest('chess timer'))==[]
+
+def test_suggest_endpoint(client, catalog):
+    response = client.get('/search/suggest', query_string={'q': 'checkrs', 'limit': 1})
+    assert response.status_code==200 and names(response.json)==['Checkers'] and response.json['corrected']
+    assert client.get('/search/suggest').json=={'products': [], 'categories': [], 'corrected': False}
@@ -0,0 +1,50 @@
+import pytest
+from sqlalchemy import select
+from app import cart_store
+from checkout import OutOfStock
+from models import db, Cart, Product
+from conftest import add_product, add_user
+
+def cart(user_id):
+    db.session.expire_all()
+    return dict(db.session.execute(select(Cart.product_id, Cart.amount).where(Cart.user_id==user_id)).all())
+
+def test_adding_again_changes_the_quantity(app):
+    alice = add_user('alice')
+    chess, lamp = add_product('Chess'), add_product('Lamp')
+    cart_store.set_quantity(alice, chess, 2)
+    cart_store.set_quantities(alice, {chess: 5, lamp: 1})
+    assert cart(alice)=={chess: 5, lamp: 1}
+    cart_store.set_quantities(alice, {chess: 0, lamp: 3})
+    assert cart(alice)=={lamp: 3}
+    assert db.session.get(Product, chess).held==0 and db.session.get(Product, lamp).held==3
+
+def test_only_the_owner_removes_a_line(app):
+    alice, bob = add_user('alice'), add_user('bob')
+    chess = add_product('Chess')
+    cart_store.set_quantity(alice, chess, 2)
+    line = db.session.scalar(select(Cart.id).where(Cart.user_id==alice))
+    assert not cart_store.remove(bob, line)
+    assert cart_store.remove(alice, line)
+    assert cart(alice)=={} and db.session.get(Product, chess).held==0
+
+def test_a_quantity_over_the_stock_leaves_the_cart_alone(app):
+    alice = add_user('alice')
+    chess = add_product('Chess', stock=3)
+    cart_store.set_quantity(alice, chess, 2)
+    with pytest.raises(OutOfStock):
+        cart_store.set_quantity(alice, chess, 4)
+    assert cart(alice)=={chess: 2}
+
+def test_write_behind_collects_edits_until_flushed(app, monkeypatch):
+    monkeypatch.setitem(app.config, 'CART_WRITE_BEHIND', True)
+    monkeypatch.setitem(app.config, 'CART_WRITE_BEHIND_DELAY', 60)
+    alice = add_user('alice')
+    chess, lamp = add_product('Chess'), add_product('Lamp')
+    cart_store.set_quantity(alice, chess, 1)
+    cart_store.set_quantity(alice, chess, 3)
+    cart_store.set_quantity(alice, lamp, 2)
+    assert cart(alice)=={}
+    assert db.session.get(Product, chess).held==3 # Holds are never deferred.
+    cart_store.flush(alice)
+    assert cart(alice)=={chess: 3, lamp: 2}
@@ -0,0 +1,86 @@
+import io
+import json
+import pytest
+from sqlalchemy import select
+from catalog import CatalogError, bulk_update, import_products, open_upload
+from exports import PRODUCT_FIELDS, product_rows, to_csv, to_ndjson
+from models import db, Product
+from conftest import add_product, add_user, login
+
+CSV = '''name,desc,price,stock,category,image
+Chess,Wooden board,20,5,Games,
+Lamp,Lamp book,15,2,Books,lamp.jpg
+Chess,Twice,1,1,Games,
+Broken,No price,,3,Games,
+Nowhere,Bad category,5,5,Space,
+'''
+
+def catalog():
+    db.session.expire_all()
+    return {product.name: (product.price, product.stock, product.category) for product in db.session.scalars(select(Product))}
+
+def test_import_reports_rejected_rows_by_line(app):
+    report = import_products(open_upload(io.BytesIO(CSV.encode()), 'csv'))
+    assert (report.created, report.updated, report.skipped)==(2, 0, 0)
+    assert [line for line, _ in report.errors]==[4, 5, 6]
+    assert catalog()=={'Chess': (20, 5, 'Games'), 'Lamp': (15, 2, 'Books')}
+
+def test_replace_updates_and_skip_keeps_existing_products(app):
+    add_product('Chess', stock=1, price=99)
+    rows = '{"name": "Chess", "desc": "New", "price": 25, "stock": 4, "category": "Games"}\n\nnot json\n'
+    report = import_products(open_upload(io.BytesIO(rows.encode()), 'jsonl'), replace=False)
+    assert (report.created, report.skipped, report.errors)==(0, 1, [(3, 'Invalid JSON.')])
+    assert catalog()['Chess']==(99, 1, 'Games')
+    report = import_products(open_upload(io.BytesIO(rows.encode()), 'ndjson'))
+    assert report.updated==1 and catalog()['Chess']==(25, 4, 'Games')
+
+@pytest.mark.parametrize('fmt', ['csv', 'ndjson'])
+def test_export_reads_back_unchanged(app, fmt):
+    import_products(open_upload(io.BytesIO(CSV.encode()), 'csv'))
+    before = catalog()
+    serialize = to_csv if fmt=='csv' else to_ndjson
+    exported = ''.join(serialize(product_rows(), PRODUCT_FIELDS)).encode()
+    db.session.execute(Product.__table__.delete())
+    db.session.commit()
+    report = import_products(open_upload(io.BytesIO(exported), fmt))
+    assert report.created==2 and not report.errors and catalog()==before
+
+def test_a_file_that_is_not_utf8_keeps_the_rows_before_it(app):
+    good = ''.join(f'Game {number},Board,20,5,Games\n' for number in range(500))
+    data = f'\ufeffname,desc,price,stock,category\n{good}'.encode()+'Café,Crème,5,5,Books\nLast,Row,1,1,Games\n'.encode('latin-1')
+    report = import_products(open_upload(io.BytesIO(data), 'csv'), chunk_size=100)
+    assert report.created==500 and report.errors==[(502, 'The file is not UTF-8 encoded, the rest of it was not imported.')]
+    assert 'Last' not in catalog()
+
+def test_bulk_update_sets_and_adjusts(app):
+    chess, lamp = add_product('Chess', stock=5, price=20), add_product('Lamp', stock=2)
+    changed = bulk_update([{'id': chess, 'price': 30}, {'name': 'Lamp', 'stock_delta': 3}, {'id': str(chess), 'stock': 9}])
+    assert changed==3 and catalog()=={'Chess': (30, 9, 'Games'), 'Lamp': (20, 5, 'Games')}
+    assert bulk_update([{'id': lamp, 'stock_delta': -6}])==0 # Never below zero.
+
+@pytest.mark.parametrize('changes, message', [
+    ([['Chess', 5]], 'object'),
+    ([{'price': 5}], 'id or a name'),
+    ([{'name': ['Chess'], 'price': 5}], 'string'),
+    ([{'id': 1}], 'price, stock or stock_delta'),
+    ([{'id': 1, 'stock': 1, 'stock_delta': 1}], 'either'),
+    ([{'id': 'x', 'price': 1}], 'whole number'),
+    ([{'id': 1, 'price': -1}], 'negative'),
+])
+def test_bulk_update_rejects_malformed_changes(app, changes, message):
+    with pytest.raises(CatalogError, match=message):
+        bulk_update(changes)
+
+def test_bulk_route_reports_bad_payloads(app, client):
+    add_user('admin', role='admin')
+    login(client, 'admin')
+    assert client.post('/admin/products/bulk', json=[{'id': 1, 'price': 5}]).status_code==400
+    assert client.post('/admin/products/bulk', data=json.dumps({'changes': 'all'}), content_type='application/json').status_code==400
+    assert client.post('/admin/products/bulk', json={'changes': [{'id': 1}]}).json=={'error': 'Every change needs a price, stock or stock_delta.'}
+
+def test_import_route_reads_the_upload(app, client):
+    add_user('admin', role='admin')
+    login(client, 'admin')
+    response = client.post('/admin/products/import', data={'file': (io.BytesIO(CSV.encode()), 'products.csv'), 'replace': 'y'}, follow_redirects=True)
+    assert b'2 added' in response.data and b'Line 6:' in response.data
+    assert set(catalog())=={'Chess', 'Lamp'}
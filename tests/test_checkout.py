@@ -0,0 +1,41 @@
+import pytest
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from app import cart_store
+from checkout import CheckoutError, OutOfStock, UserNotFound, purchase_cart, purchase_item
+from models import db, User, Product, TransactionHistory
+from conftest import add_product, add_user, rendezvous, run_concurrently
+
+def test_concurrent_checkouts_of_one_cart_buy_it_once(app):
+    alice, bob = add_user('alice'), add_user('bob')
+    product_id = add_product('Chess', stock=10, price=20)
+    cart_store.set_quantity(alice, product_id, 3)
+    with rendezvous('FROM cart'):
+        results = run_concurrently(app, lambda: purchase_cart(alice), lambda: purchase_cart(alice))
+    assert 60 in results and sum(isinstance(result, CheckoutError) for result in results)==1
+
+    db.session.expire_all()
+    product = db.session.get(Product, product_id)
+    assert db.session.get(User, alice).balance==10000-60
+    assert db.session.scalar(select(func.count()).select_from(TransactionHistory))==1
+    assert (product.stock, product.held)==(7, 0)
+    with pytest.raises(OutOfStock) as error:
+        purchase_item(bob, product_id, 8)
+    assert error.value.available==7
+
+def test_stock_and_held_cannot_go_negative(app):
+    product_id = add_product('Chess', stock=1)
+    for values in ({'stock': -1}, {'held': -1}):
+        with pytest.raises(IntegrityError):
+            db.session.execute(update(Product).where(Product.id==product_id).values(**values))
+        db.session.rollback()
+
+def test_buying_for_a_deleted_user_fails_cleanly(app):
+    alice = add_user('alice')
+    product_id = add_product('Chess', stock=10)
+    db.session.execute(delete(User).where(User.id==alice))
+    db.session.commit()
+    with pytest.raises(UserNotFound):
+        purchase_item(alice, product_id, 1)
+    db.session.expire_all()
+    assert db.session.get(Product, product_id).stock==10
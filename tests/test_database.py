@@ -0,0 +1,51 @@
+import os
+import pytest
+from flask import Flask, g
+from sqlalchemy import select, text, update
+from database import REPLICA_BIND, _update_or_insert, read_only
+from models import db, Cart, Product
+from conftest import add_product, add_user
+
+def test_sqlite_connections_are_configured(app):
+    assert db.session.execute(text('PRAGMA journal_mode')).scalar()=='wal'
+    assert db.session.execute(text('PRAGMA foreign_keys')).scalar()==1
+
+@pytest.fixture
+def replica_app(tmp_path):
+    replica_app = Flask(__name__)
+    replica_app.config.update(SQLALCHEMY_DATABASE_URI=f'sqlite:///{tmp_path}/primary.sqlite', SQLALCHEMY_BINDS={REPLICA_BIND: f'sqlite:///{tmp_path}/replica.sqlite'})
+    db.init_app(replica_app)
+    with replica_app.test_request_context():
+        yield replica_app
+        db.session.remove()
+        for engine in db.engines.values():
+            engine.dispose()
+    db.metadatas.pop(REPLICA_BIND) # Registered on the shared db by init_app, the test app has no replica.
+
+def bind_path(clause):
+    return os.path.basename(db.session.get_bind(clause=clause).url.database)
+
+def test_read_only_views_read_from_the_replica(replica_app):
+    @read_only
+    def view():
+        return bind_path(select(Product)), bind_path(update(Product).values(stock=1))
+    assert view()==('replica.sqlite', 'primary.sqlite')
+    assert bind_path(select(Product))=='primary.sqlite'
+
+def test_read_only_is_undone_when_the_view_fails(replica_app):
+    @read_only
+    def view():
+        raise RuntimeError()
+    with pytest.raises(RuntimeError):
+        view()
+    assert not g.read_replica and bind_path(select(Product))=='primary.sqlite'
+
+def test_portable_upsert_updates_or_inserts(app):
+    alice = add_user('alice')
+    chess, lamp = add_product('Chess'), add_product('Lamp')
+    rows = [{'user_id': alice, 'product_id': chess, 'amount': 2}]
+    _update_or_insert(db.session, Cart.__table__, rows, ['user_id', 'product_id'], lambda excluded: {'amount': excluded.amount})
+    rows = [{'user_id': alice, 'product_id': chess, 'amount': 5}, {'user_id': alice, 'product_id': lamp, 'amount': 1}]
+    _update_or_insert(db.session, Cart.__table__, rows, ['user_id', 'product_id'], lambda excluded: {'amount': Cart.__table__.c.amount+excluded['amount']})
+    db.session.commit()
+    assert db.session.execute(select(Cart.product_id, Cart.amount).order_by(Cart.product_id)).all()==[(chess, 7), (lamp, 1)]
@@ -0,0 +1,46 @@
+import io
+import os
+from flask import Flask
+from PIL import Image
+from images import FORMATS, VARIANTS, ImagePipeline, process_image, variant_filename, variant_filenames
+
+def upload(size=(1200, 600), mode='RGB', color=(200, 30, 30), fmt='PNG'):
+    data = io.BytesIO()
+    Image.new(mode, size, color).save(data, fmt)
+    data.seek(0)
+    return data
+
+def test_every_variant_is_written_within_its_box(tmp_path):
+    filename = process_image(upload().read(), tmp_path)
+    assert sorted(os.listdir(tmp_path))==sorted(variant_filenames(filename))
+    assert len(os.listdir(tmp_path))==len(VARIANTS)*len(FORMATS)
+    digest = filename.split('-')[0]
+    for variant, (width, height) in VARIANTS.items():
+        with Image.open(tmp_path/variant_filename(digest, variant, '.webp')) as image:
+            assert image.width==min(width, 1200) and image.height<=height
+
+def test_transparency_becomes_white(tmp_path):
+    filename = process_image(upload(mode='RGBA', color=(0, 0, 0, 0)).read(), tmp_path)
+    with Image.open(tmp_path/filename) as image:
+        assert image.mode=='RGB' and all(channel>=250 for channel in image.getpixel((10, 10)))
+
+def test_the_same_upload_is_not_processed_again(tmp_path):
+    data = upload().read()
+    filename = process_image(data, tmp_path)
+    mtime = os.path.getmtime(tmp_path/filename)
+    assert process_image(data, tmp_path)==filename and os.path.getmtime(tmp_path/filename)==mtime
+
+def test_legacy_images_are_a_single_file():
+    assert variant_filenames('7.png')==['7.png']
+
+def test_pipeline_reports_the_newest_upload_per_key(tmp_path):
+    app = Flask(__name__)
+    app.config['IMAGE_PIPELINE_SYNC'] = True
+    pipeline, done = ImagePipeline(app), []
+    pipeline.submit(upload(color=(1, 2, 3)), tmp_path, key=('product', 1), on_done=done.append)
+    pipeline.submit(upload(color=(4, 5, 6)), tmp_path, key=('product', 1), on_done=done.append)
+    assert len(done)==2 and done[0]!=done[1] and all(os.path.exists(tmp_path/filename) for filename in done)
+    # A job finishing after a newer one was submitted for the same key is dropped.
+    pipeline._latest[('product', 1)] = 99
+    pipeline._finish(('product', 1), 98, done.append, 'stale.jpg')
+    assert 'stale.jpg' not in done
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import func, select
+from app import inventory
+from checkout import OutOfStock
+from catalog import delete_product
+from models import db, Product, StockHold
+from conftest import add_product, add_user, rendezvous, run_concurrently
+
+def held(product_id):
+    db.session.expire_all()
+    product = db.session.get(Product, product_id)
+    holds = db.session.scalar(select(func.coalesce(func.sum(StockHold.amount), 0)).where(StockHold.product_id==product_id))
+    return product.held, holds
+
+def test_hold_reserves_stock(app):
+    alice, bob = add_user('alice'), add_user('bob')
+    product_id = add_product('Chess', stock=5)
+    inventory.hold(alice, {product_id: 3})
+    with pytest.raises(OutOfStock) as error:
+        inventory.hold(bob, {product_id: 3})
+    assert error.value.available==2
+    inventory.hold(bob, {product_id: 2})
+    assert held(product_id)==(5, 5)
+
+def test_changing_a_hold_applies_the_difference(app):
+    alice = add_user('alice')
+    product_id = add_product('Chess', stock=5)
+    inventory.hold(alice, {product_id: 2})
+    inventory.hold(alice, {product_id: 5})
+    assert held(product_id)==(5, 5)
+    inventory.release(alice, [product_id])
+    assert held(product_id)==(0, 0)
+
+def test_concurrent_identical_holds_count_once(app):
+    alice = add_user('alice')
+    product_id = add_product('Chess', stock=10)
+    with rendezvous('FROM stock_hold'):
+        results = run_concurrently(app, lambda: inventory.hold(alice, {product_id: 4}), lambda: inventory.hold(alice, {product_id: 4}))
+    assert results==[None, None]
+    assert held(product_id)==(4, 4)
+    inventory.expire(datetime.utcnow()+timedelta(days=1))
+    assert held(product_id)==(0, 0)
+
+def test_expire_releases_only_expired_holds(app):
+    alice, bob = add_user('alice'), add_user('bob')
+    product_id = add_product('Chess', stock=10)
+    inventory.hold(alice, {product_id: 3})
+    db.session.execute(StockHold.__table__.update().where(StockHold.user_id==alice).values(expires_at=datetime.utcnow()-timedelta(seconds=1)))
+    db.session.commit()
+    inventory.hold(bob, {product_id: 2})
+    assert inventory.expire()==1
+    assert held(product_id)==(2, 2)
+
+def test_archiving_a_product_releases_its_holds(app):
+    alice = add_user('alice')
+    product_id = add_product('Chess', stock=10)
+    inventory.hold(alice, {product_id: 3})
+    delete_product(product_id, archive=True)
+    assert held(product_id)==(0, 0)
+
+def test_holds_only_refresh_cached_pages_when_a_product_sells_out(app, client):
+    alice = add_user('alice')
+    product_id = add_product('Chess', stock=5)
+    client.get('/')
+    version = inventory.page_cache.version()
+    inventory.hold(alice, {product_id: 2})
+    assert inventory.page_cache.version()==version
+    inventory.hold(alice, {product_id: 5})
+    assert inventory.page_cache.version()==version+1
+    assert b'Out of Stock' in client.get('/').data
@@ -0,0 +1,49 @@
+from flask import Flask
+from app import password_hasher
+from hashing import LoginThrottle
+from models import db, User
+from conftest import add_user
+
+def post_login(client, username, password):
+    response = client.post('/login', data={'username': username, 'pw': password})
+    assert response.status_code==302
+    return response.headers['Location']
+
+def test_failed_logins_lock_the_username_until_one_succeeds(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'LOGIN_MAX_FAILURES_PER_USER', 3)
+    add_user('alice')
+    for _ in range(3):
+        assert post_login(client, 'alice', 'wrong')=='/login'
+    # Locked out, the right password doesn't get through either.
+    assert post_login(client, 'alice', 'password')=='/login'
+    assert client.get('/cart').status_code==302
+
+def test_a_successful_login_resets_the_failures(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'LOGIN_MAX_FAILURES_PER_USER', 3)
+    add_user('alice')
+    for _ in range(2):
+        post_login(client, 'alice', 'wrong')
+    assert post_login(client, 'alice', 'password')=='/'
+    client.get('/logout')
+    for _ in range(2):
+        post_login(client, 'alice', 'wrong')
+    assert post_login(client, 'alice', 'password')=='/'
+
+def test_attempts_expire_after_the_window(monkeypatch):
+    app = Flask(__name__)
+    app.config.update(LOGIN_THROTTLE_WINDOW=60, LOGIN_MAX_ATTEMPTS_PER_IP=2)
+    throttle, now = LoginThrottle(app), [1000.0]
+    monkeypatch.setattr('hashing.time.monotonic', lambda: now[0])
+    assert throttle.allow('10.0.0.1', 'alice') and throttle.allow('10.0.0.1', 'bob')
+    assert not throttle.allow('10.0.0.1', 'carol')
+    assert throttle.allow('10.0.0.2', 'carol') # Per address.
+    now[0] += 61
+    assert throttle.allow('10.0.0.1', 'carol')
+
+def test_login_upgrades_the_hash_to_the_current_cost(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'BCRYPT_LOG_ROUNDS', 5)
+    alice = add_user('alice')
+    assert post_login(client, 'alice', 'password')=='/'
+    db.session.expire_all()
+    hashed = db.session.get(User, alice).password
+    assert hashed.split('$')[2]=='05' and password_hasher.check(hashed, 'password')
@@ -0,0 +1,52 @@
+import re
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from metrics import SQL_SECONDS, Counter, Histogram
+from models import db
+from conftest import add_product
+
+def sample(body, line):
+    match = re.search(rf'^{re.escape(line)} (\S+)$', body, re.MULTILINE)
+    return float(match.group(1)) if match else 0.0
+
+def test_histograms_render_cumulative_buckets():
+    histogram = Histogram('test_seconds', 'Test.', ('view',), (0.1, 1.0))
+    for seconds in (0.05, 0.5, 5.0):
+        histogram.observe(seconds, 'index')
+    assert histogram.render()[2:]==[
+        'test_seconds_bucket{view="index",le="0.1"} 1',
+        'test_seconds_bucket{view="index",le="1.0"} 2',
+        'test_seconds_bucket{view="index",le="+Inf"} 3',
+        'test_seconds_sum{view="index"} 5.55',
+        'test_seconds_count{view="index"} 3',
+    ]
+
+def test_label_values_are_escaped():
+    counter = Counter('test_total', 'Test.', ('path',))
+    counter.inc('a"b\\c\nd', amount=2)
+    assert counter.render()[-1]=='test_total{path="a\\"b\\\\c\\nd"} 2'
+
+def test_requests_and_their_queries_are_counted(app, client):
+    add_product('Chess')
+    line = 'http_requests_total{endpoint="home",method="GET",status="200"}'
+    before = sample(client.get('/metrics').get_data(as_text=True), line)
+    client.get('/')
+    client.get('/')
+    body = client.get('/metrics').get_data(as_text=True)
+    assert sample(body, line)==before+2
+    assert sample(body, 'db_query_duration_seconds_count{endpoint="home"}')>0
+
+def test_failed_statements_are_timed_and_cleaned_up(app):
+    before = sample('\n'.join(SQL_SECONDS.render()), 'db_query_duration_seconds_count{endpoint="background"}')
+    with pytest.raises(OperationalError):
+        db.session.execute(text('SELECT * FROM no_such_table'))
+    assert 'query_started' not in db.session.connection().info
+    db.session.rollback()
+    assert sample('\n'.join(SQL_SECONDS.render()), 'db_query_duration_seconds_count{endpoint="background"}')==before+1
+
+def test_profiling_needs_the_token(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'PROFILE_TOKEN', 'secret')
+    assert b'cumulative' not in client.get('/', headers={'X-Profile': 'wrong'}).data
+    profiled = client.get('/', headers={'X-Profile': 'secret'})
+    assert profiled.mimetype=='text/plain' and profiled.get_data(as_text=True).startswith('GET /?')
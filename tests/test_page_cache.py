@@ -0,0 +1,33 @@
+from sqlalchemy import update
+from app import page_cache
+from models import db, Product
+from conftest import add_product, add_user, login
+
+def test_matching_etag_gets_a_304_without_rendering(app, client):
+    add_product('Chess')
+    first = client.get('/')
+    assert first.status_code==200 and first.headers['ETag'] and b'Chess' in first.data
+    # Changed behind the cache's back, the cached page is still what the client has.
+    db.session.execute(update(Product).values(name='Go'))
+    db.session.commit()
+    revalidated = client.get('/', headers={'If-None-Match': first.headers['ETag']})
+    assert revalidated.status_code==304 and revalidated.data==b''
+    assert client.get('/', headers={'If-None-Match': '"stale"'}).data==first.data
+
+def test_a_bump_serves_the_new_page_with_a_new_etag(app, client):
+    add_product('Chess')
+    first = client.get('/')
+    db.session.execute(update(Product).values(name='Go'))
+    db.session.commit()
+    page_cache.bump()
+    second = client.get('/', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code==200 and b'Go' in second.data and second.headers['ETag']!=first.headers['ETag']
+
+def test_logged_in_visitors_bypass_the_cache(app, client):
+    add_user('alice')
+    add_product('Chess')
+    anonymous = client.get('/')
+    login(client, 'alice')
+    page = client.get('/', headers={'If-None-Match': anonymous.headers['ETag']})
+    assert page.status_code==200 and 'ETag' not in page.headers
+    assert b'Logout' in page.data and b'Logout' not in anonymous.data
@@ -0,0 +1,48 @@
+import base64
+import json
+from datetime import datetime
+import pytest
+from pagination import decode_cursor, encode_cursor, paginate_products
+from conftest import add_product
+
+def raw_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+def test_cursors_round_trip():
+    values = [19, 'Chess', 2.5, datetime(2026, 10, 18, 9, 30)]
+    assert decode_cursor(encode_cursor(values), 4)==values
+
+@pytest.mark.parametrize('cursor', [
+    '!!!not base64',
+    base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+    raw_cursor({'id': 3}),
+    raw_cursor([3]),                  # Wrong length for a two column sort.
+    raw_cursor([[1, 2], 3]),
+    raw_cursor([True, 3]),
+    raw_cursor([None, 3]),
+    raw_cursor([{'dt': 5}, 3]),
+    raw_cursor([{'dt': 'yesterday'}, 3]),
+    raw_cursor([{'dt': '2026-10-18', 'x': 1}, 3]),
+])
+def test_invalid_or_tampered_cursors_are_ignored(cursor):
+    assert decode_cursor(cursor, 2) is None
+
+def test_pages_follow_the_sort_and_bad_cursors_restart(app):
+    for number, price in enumerate((30, 10, 20, 10, 40)):
+        add_product(f'Game {number}', price=price)
+    first = paginate_products(sort='price_asc', per_page=3)
+    assert [product.price for product in first.items]==[10, 10, 20] and first.has_next
+    second = paginate_products(sort='price_asc', per_page=3, after=first.next_cursor)
+    assert [product.price for product in second.items]==[30, 40] and not second.has_next
+    assert [product.id for product in paginate_products(sort='price_asc', per_page=3, after='garbage').items]==[product.id for product in first.items]
+
+def test_ties_on_the_sort_column_are_neither_skipped_nor_repeated(app):
+    product_ids = [add_product(f'Game {number}', price=10) for number in range(4)]
+    seen, after = [], None
+    while True:
+        page = paginate_products(sort='price_desc', per_page=1, after=after)
+        seen += [product.id for product in page.items]
+        if not page.has_next:
+            break
+        after = page.next_cursor
+    assert seen==product_ids[::-1]
@@ -0,0 +1,39 @@
+import pytest
+from app import cart_store
+from models import db, Product
+from conftest import add_product, add_user, login
+
+# QUERY_BUDGET_ENFORCE is set by the app fixture, so a view going over its @query_budget raises QueryBudgetExceeded
+# and fails the test. Several products are used so that a query per cart line or per transaction shows up.
+
+@pytest.fixture
+def shopper(app, client):
+    alice = add_user('alice')
+    product_ids = [add_product(f'Game {number}', stock=10) for number in range(5)]
+    for product_id in product_ids:
+        cart_store.set_quantity(alice, product_id, 2)
+    login(client, 'alice')
+    return product_ids
+
+def fetch(app, client, method, path, **kwargs):
+    # Requests made inside the test's app context would share its g and session, and so the user and products the test
+    # already loaded. Each one gets its own context here, like it does when the app is served.
+    with app.app_context():
+        return client.open(path, method=method, **kwargs)
+
+def stocks(product_ids):
+    db.session.expire_all()
+    return [db.session.get(Product, product_id).stock for product_id in product_ids]
+
+def test_cart_and_checkout_stay_within_budget(app, client, shopper):
+    assert fetch(app, client, 'GET', '/cart').status_code==200
+    assert fetch(app, client, 'POST', '/checkout').status_code==302
+    assert stocks(shopper)==[8]*5
+    assert fetch(app, client, 'GET', '/cart').status_code==200
+
+def test_buy_item_and_transactions_stay_within_budget(app, client, shopper):
+    for product_id in shopper:
+        assert fetch(app, client, 'POST', f'/product/buy/{product_id}', data={'quantity': 1}).status_code==302
+    assert stocks(shopper)==[9]*5
+    response = fetch(app, client, 'GET', '/transactions')
+    assert response.status_code==200 and b'Game 4' in response.data
@@ -0,0 +1,41 @@
+from sqlalchemy import delete, update
+from models import db, Product
+from search import search_products
+from conftest import add_product
+
+def names(results):
+    return [product.name for product in results.items]
+
+def test_index_follows_inserts_updates_and_deletes(app):
+    product_id = add_product('Chess Board')
+    assert names(search_products('chess'))==['Chess Board']
+    assert names(search_products('ches boa'))==['Chess Board'] # Every word is a prefix.
+
+    db.session.execute(update(Product).where(Product.id==product_id).values(name='Go Board', desc='Nineteen by nineteen'))
+    db.session.commit()
+    assert names(search_products('chess'))==[]
+    assert names(search_products('go'))==['Go Board']
+
+    db.session.execute(delete(Product).where(Product.id==product_id))
+    db.session.commit()
+    assert names(search_products('board'))==[]
+
+def test_archived_products_and_fts_syntax_are_not_matched(app):
+    product_id = add_product('Chess Board')
+    add_product('Chess Clock')
+    assert search_products('"chess" OR NEAR(').total==0 # Quoted words, never FTS operators.
+    db.session.execute(update(Product).where(Product.id==product_id).values(archived=True))
+    db.session.commit()
+    assert names(search_products('chess'))==['Chess Clock']
+
+def test_paging_ranks_name_hits_first_and_keeps_the_total(app):
+    for number in range(5):
+        add_product(f'Puzzle {number}', category='Toys')
+    add_product('Lamp', category='Puzzle')
+    first = search_products('puzzle', per_page=4)
+    assert (first.total, first.pages, first.has_next, len(first.items))==(6, 2, True, 4)
+    assert 'Lamp' not in names(first)
+    second = search_products('puzzle', page=2, per_page=4)
+    assert names(second)[-1]=='Lamp' and not second.has_next
+    past = search_products('puzzle', page=9, per_page=4)
+    assert (past.items, past.total, past.prev_num)==([], 6, 2)
@@ -0,0 +1,61 @@
+from contextlib import contextmanager
+from sqlalchemy import event, update
+from app import page_cache, search_cache
+from models import db, Product
+from conftest import add_product, add_user, login
+
+@contextmanager
+def count_queries():
+    statements = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'after_cursor_execute', count)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', count)
+
+def names(results):
+    return [product.name for product in results.items]
+
+def test_repeated_searches_are_answered_from_memory(app):
+    add_product('Chess Board')
+    add_product('Chess Clock')
+    first = search_cache.search('chess', per_page=1)
+    with count_queries() as statements:
+        # Case, punctuation, word order and repeated words don't make a different search.
+        again = search_cache.search('  CHESS, chess!', per_page=1)
+    assert statements==[] and names(again)==names(first) and again.total==2
+    with count_queries() as statements:
+        search_cache.search('chess', page=2, per_page=1)
+    assert len(statements)>0 # Another page is another entry.
+
+def test_cached_products_are_plain_copies(app):
+    product_id = add_product('Chess Board', stock=0)
+    search_cache.search('chess')
+    db.session.remove()
+    product = search_cache.search('chess').items[0]
+    assert (product.id, product.name, product.stock, product.available)==(product_id, 'Chess Board', 0, False)
+
+def test_a_catalog_bump_starts_over(app):
+    product_id = add_product('Chess Board')
+    assert names(search_cache.search('chess'))==['Chess Board']
+    db.session.execute(update(Product).where(Product.id==product_id).values(name='Go Board', desc='Nineteen by nineteen'))
+    db.session.commit()
+    assert names(search_cache.search('chess'))==['Chess Board'] # Until the views bump the version.
+    page_cache.bump()
+    assert names(search_cache.search('chess'))==[] and names(search_cache.search('go'))==['Go Board']
+
+def test_empty_terms_do_not_query(app):
+    with count_queries() as statements:
+        results = search_cache.search(' ?! ', page=0)
+    assert statements==[] and (results.items, results.total, results.page)==([], 0, 1)
+
+def test_a_purchase_refreshes_the_stock_shown_in_results(app, client):
+    add_user('alice')
+    product_id = add_product('Chess Board', stock=1)
+    login(client, 'alice')
+    assert search_cache.search('chess').items[0].available
+    client.post(f'/product/buy/{product_id}', data={'quantity': 1})
+    product = search_cache.search('chess').items[0]
+    assert product.stock==0 and not product.available
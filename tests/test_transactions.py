@@ -0,0 +1,46 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+from models import db, TransactionHistory
+from repository import paginate_transactions
+from conftest import add_product, add_user, login
+
+def add_history(user_id, product_id, days):
+    # One purchase a day, at noon, the given days back from 2026-10-18.
+    for day in days:
+        db.session.add(TransactionHistory(user_id=user_id, product_id=product_id, amount=day+1, total=20*(day+1), created_at=datetime(2026, 10, 18, 12)-timedelta(days=day)))
+    db.session.commit()
+
+def test_history_pages_newest_first_within_the_dates(app):
+    alice, bob = add_user('alice'), add_user('bob')
+    chess = add_product('Chess')
+    add_history(alice, chess, range(10))
+    add_history(bob, chess, range(3))
+    first = paginate_transactions(alice, per_page=4)
+    second = paginate_transactions(alice, per_page=4, after=first.next_cursor)
+    assert [row.amount for row in first.items+second.items]==list(range(1, 9))
+    week = paginate_transactions(alice, start=datetime(2026, 10, 12), end=datetime(2026, 10, 15))
+    assert [row.created_at.day for row in week.items]==[14, 13, 12]
+
+def test_exports_stream_the_filtered_history(app, client):
+    alice, bob = add_user('alice'), add_user('bob')
+    chess = add_product('Chess')
+    add_history(alice, chess, range(5))
+    add_history(bob, chess, range(5))
+    login(client, 'alice')
+
+    response = client.get('/transactions/export.csv?start=2026-10-15&end=2026-10-17')
+    assert response.mimetype=='text/csv' and 'attachment' in response.headers['Content-Disposition']
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [(row['created_at'], row['product'], row['amount']) for row in rows]==[('2026-10-15T12:00:00', 'Chess', '4'), ('2026-10-16T12:00:00', 'Chess', '3'), ('2026-10-17T12:00:00', 'Chess', '2')]
+
+    lines = client.get('/transactions/export.ndjson').get_data(as_text=True).splitlines()
+    assert [json.loads(line)['total'] for line in lines]==[100, 80, 60, 40, 20]
+    assert client.get('/transactions/export.xml').status_code==404
+
+def test_bad_dates_are_reported(app, client):
+    add_user('alice')
+    login(client, 'alice')
+    response = client.get('/transactions?start=yesterday', follow_redirects=True)
+    assert response.status_code==200 and b'YYYY-MM-DD' in response.data
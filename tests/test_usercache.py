@@ -0,0 +1,47 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from app import user_cache
+from checkout import purchase_item
+from models import db
+from conftest import add_product, add_user, login
+
+@contextmanager
+def counting():
+    statements = []
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    event.listen(db.engine, 'after_cursor_execute', count)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'after_cursor_execute', count)
+
+def test_snapshot_is_served_from_memory(app):
+    alice = add_user('alice', balance=500)
+    user_cache.invalidate(alice)
+    with counting() as statements:
+        user = user_cache.load(str(alice))
+        assert (user.username, user.balance, user.role)==('alice', 500, 'user')
+        assert user_cache.load(alice).username=='alice'
+    assert len(statements)==1
+    assert user_cache.load('nobody') is None and user_cache.load(10**6) is None
+
+def test_other_attributes_and_writes_go_to_the_row(app):
+    alice = add_user('alice')
+    user = user_cache.load(alice)
+    assert user.password.startswith('$2b$')
+    user.email = 'new@example.com'
+    db.session.commit()
+    assert user_cache.load(alice).email=='new@example.com' # The write dropped the stale snapshot.
+
+def test_purchases_drop_the_stale_snapshot(app, client):
+    alice = add_user('alice', balance=500)
+    product_id = add_product('Chess', price=20)
+    login(client, 'alice')
+    # Each request in its own app context, so the logged in user comes from the cache like in production.
+    with app.app_context():
+        client.get('/cart')
+    assert user_cache.load(alice).balance==500
+    with app.app_context():
+        client.post(f'/product/buy/{product_id}', data={'quantity': 2})
+    assert user_cache.load(alice).balance==460
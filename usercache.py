@@ -0,0 +1,66 @@
+from flask_login import UserMixin
+from sqlalchemy import select
+from caching import TTLCache
+from models import db, User
+
+# Cache for Flask-Login's user loader.
+# Every authenticated request used to load the user row just to check who is logged in. Now a snapshot of the
+# columns the site reads on most pages (identity, role and balance) is kept in a small LRU cache for a few seconds, and
+# the user loader hands out a CachedUser built from it. Anything else (the password hash, relationships) and every
+# write goes through to the real User row, loaded on first use.
+# Views that change a user call user_cache.invalidate(user_id) after committing. The cache lives in each worker
+# process, so a change made in another process shows up here at the latest after USER_CACHE_TTL seconds.
+
+SNAPSHOT_COLUMNS = (User.id, User.username, User.email, User.role, User.balance)
+
+class CachedUser(UserMixin):
+    def __init__(self, snapshot, cache):
+        object.__setattr__(self, '_snapshot', snapshot)
+        object.__setattr__(self, '_cache', cache)
+        object.__setattr__(self, '_user', None)
+
+    def _load(self):
+        if self._user is None:
+            object.__setattr__(self, '_user', db.session.get(User, self._snapshot['id']))
+        return self._user
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the object itself.
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._user is None and name in self._snapshot:
+            return self._snapshot[name]
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._load(), name, value)
+        self._cache.invalidate(self._snapshot['id'])
+
+class UserCache():
+    def __init__(self, app=None):
+        self.cache = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('USER_CACHE_SIZE', 4096)
+        app.config.setdefault('USER_CACHE_TTL', 30) # Seconds
+        self.cache = TTLCache(maxsize=app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'])
+
+    def load(self, user_id):
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+
+        snapshot = self.cache.get(user_id)
+        if snapshot is None:
+            row = db.session.execute(select(*SNAPSHOT_COLUMNS).where(User.id==user_id)).first()
+            if row is None:
+                return None
+            snapshot = row._asdict()
+            self.cache.set(user_id, snapshot)
+        return CachedUser(snapshot, self)
+
+    def invalidate(self, user_id):
+        self.cache.delete(int(user_id))